@@ -1,76 +1,8 @@
-from flask import Flask, jsonify
-from flask_cors import CORS
-from flask_jwt_extended import JWTManager
-from dotenv import load_dotenv
-from routes.skill_routes import skill_routes
-from routes.auth_routes import auth_routes
-from routes.user_routes import user_routes  # Add this import
-import os
-from datetime import timedelta
+import time
 
-# Load environment variables
-load_dotenv()
-
-app = Flask(__name__)
-
-# Configuration
-app.config.update(
-    GOOGLE_CLIENT_ID=os.getenv('GOOGLE_CLIENT_ID'),
-    GOOGLE_CLIENT_SECRET=os.getenv('GOOGLE_CLIENT_SECRET'),
-    GITHUB_CLIENT_ID=os.getenv('GITHUB_CLIENT_ID'),
-    GITHUB_CLIENT_SECRET=os.getenv('GITHUB_CLIENT_SECRET'),
-    JWT_SECRET_KEY=os.getenv('JWT_SECRET_KEY'),
-    FRONTEND_URL=os.getenv('FRONTEND_URL', 'http://localhost:5173'),
-    JWT_ACCESS_TOKEN_EXPIRES=timedelta(days=1),
-    JWT_HEADER_TYPE='Bearer',
-    JWT_HEADER_NAME='Authorization',
-    JWT_TOKEN_LOCATION=['headers'],
-)
-
-# Updated CORS configuration
-CORS(app, 
-     resources={
-         r"/api/*": {
-             "origins": [os.getenv('FRONTEND_URL', 'http://localhost:5173')],
-             "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-             "allow_headers": ["Content-Type", "Authorization"],
-             "expose_headers": ["Authorization"],
-             "supports_credentials": True,
-             "max_age": 120  # Caching preflight requests
-         }
-     })
-
-jwt = JWTManager(app)
-
-# Add JWT error handlers
-@jwt.invalid_token_loader
-def invalid_token_callback(error):
-    return jsonify({
-        'error': 'Invalid token',
-        'message': 'The token provided is not valid'
-    }), 401
-
-@jwt.expired_token_loader
-def expired_token_callback(jwt_header, jwt_data):
-    return jsonify({
-        'error': 'Token expired',
-        'message': 'The token has expired'
-    }), 401
-
-@jwt.unauthorized_loader
-def missing_token_callback(error):
-    return jsonify({
-        'error': 'Authorization required',
-        'message': 'Token is missing'
-    }), 401
-
-# Register blueprints
-app.register_blueprint(auth_routes, url_prefix='/api/auth')
-app.register_blueprint(skill_routes, url_prefix='/api')
-app.register_blueprint(user_routes, url_prefix='/api')
+# Reference point for STARTUP_PROFILE timings
+_IMPORT_STARTED = time.perf_counter()
 
-if __name__ == "__main__":
-    app.run(debug=True)
 from flask import Flask, jsonify
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
@@ -78,13 +10,38 @@ from dotenv import load_dotenv
 from routes.skill_routes import skill_routes
 from routes.auth_routes import auth_routes
 from routes.user_routes import user_routes
+from routes.webhook_routes import webhook_routes
+from utils.indexes import MONGO_ENSURE_INDEXES, ensure_indexes_in_background
+from utils.db_config import messages_collection
+from utils.message_store import CHAT_ARCHIVE_ENABLED, message_archive
+from utils.message_archive import start_archiver
 import os
+import logging
 from datetime import timedelta
 
+logger = logging.getLogger(__name__)
+
+# Log how long app creation and the first request took after import
+STARTUP_PROFILE = os.getenv('STARTUP_PROFILE', 'false').lower() == 'true'
+
+
+def _profile_startup(app):
+    created_ms = (time.perf_counter() - _IMPORT_STARTED) * 1000
+    logger.warning(f"Startup profile: app created {created_ms:.1f} ms after import started")
+    first_request = []
+
+    @app.before_request
+    def log_first_request():
+        if not first_request:
+            first_request.append(True)
+            elapsed_ms = (time.perf_counter() - _IMPORT_STARTED) * 1000
+            logger.warning(f"Startup profile: first request {elapsed_ms:.1f} ms after import started")
+
+
 def create_app():
     # Load environment variables
     load_dotenv()
-    
+
     app = Flask(__name__)
 
     # Configuration
@@ -102,7 +59,7 @@ def create_app():
     )
 
     # CORS setup
-    CORS(app, 
+    CORS(app,
          resources={
              r"/api/*": {
                  "origins": [os.getenv('FRONTEND_URL', 'http://localhost:5173')],
@@ -110,7 +67,7 @@ def create_app():
                  "allow_headers": ["Content-Type", "Authorization"],
                  "expose_headers": ["Authorization"],
                  "supports_credentials": True,
-                 "max_age": 120
+                 "max_age": 120  # Caching preflight requests
              }
          })
 
@@ -142,9 +99,21 @@ def create_app():
     app.register_blueprint(auth_routes, url_prefix='/api/auth')
     app.register_blueprint(skill_routes, url_prefix='/api')
     app.register_blueprint(user_routes, url_prefix='/api')
+    app.register_blueprint(webhook_routes, url_prefix='/api/webhooks')
+
+    # Indexes the routes' queries rely on; created off the startup path.
+    # With MONGO_ENSURE_INDEXES off, missing required ones are still logged
+    ensure_indexes_in_background(apply=MONGO_ENSURE_INDEXES)
+
+    # Move chat messages past CHAT_ARCHIVE_AFTER_DAYS into archive segments
+    if CHAT_ARCHIVE_ENABLED:
+        start_archiver(messages_collection, message_archive)
+
+    if STARTUP_PROFILE:
+        _profile_startup(app)
 
     return app
 
 if __name__ == "__main__":
     app = create_app()
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True)
@@ -1,4 +1,12 @@
-bind = "0.0.0.0:10000"
-workers = 4
-threads = 4
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '10000')}"
+workers = int(os.getenv("GUNICORN_WORKERS", "4"))
+# "gthread" serves each request on a thread; "gevent" serves them on
+# greenlets, so requests waiting on GitHub or OAuth providers stop holding
+# a thread each. The gevent worker patches sockets, which makes requests
+# and PyMongo cooperative without code changes.
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
 timeout = 120
@@ -1,3 +1,4 @@
 from .user import User
+from .message import Message
 
-__all__ = ['User']
+__all__ = ['User', 'Message']
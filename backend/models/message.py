@@ -0,0 +1,32 @@
+from datetime import datetime
+
+# Conversation of messages sent without a recipient, and of messages
+# stored before conversations existed
+GENERAL_CONVERSATION = 'general'
+
+
+class Message:
+    def __init__(self, user_id, message, recipient_id=None, conversation_id=None):
+        self.user_id = user_id
+        self.message = message
+        self.recipient_id = recipient_id
+        self.conversation_id = conversation_id or self.conversation_for(user_id, recipient_id)
+        now = datetime.utcnow()
+        # MongoDB keeps milliseconds; match it so pushed and stored copies agree
+        self.timestamp = now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+    @staticmethod
+    def conversation_for(user_id, recipient_id=None):
+        """Id of the direct conversation between two users, whichever one sends"""
+        if not recipient_id:
+            return GENERAL_CONVERSATION
+        return ':'.join(sorted([str(user_id), str(recipient_id)]))
+
+    def to_dict(self):
+        return {
+            'user_id': self.user_id,
+            'message': self.message,
+            'recipient_id': self.recipient_id,
+            'conversation_id': self.conversation_id,
+            'timestamp': self.timestamp
+        }
@@ -1,8 +1,10 @@
 from flask import Blueprint, request, jsonify, current_app, redirect
 from flask_jwt_extended import create_access_token
-import requests
 from models import User
-from utils.db_config import users_collection
+from utils.user_repository import USER_PROJECTION, user_repository
+from utils.skill_matching import skill_matcher
+from utils import http_client
+from utils.github_rate_limit import PRIORITY_LOGIN, GitHubRateLimited, github_request, rate_limited_response
 import os
 import logging
 from functools import wraps
@@ -66,7 +68,7 @@ def google_callback():
             return jsonify({'error': 'No code provided'}), 400
 
         # Exchange code for token
-        token_response = requests.post(
+        token_response = http_client.post(
             'https://oauth2.googleapis.com/token',
             data={
                 'client_id': os.getenv('GOOGLE_CLIENT_ID'),
@@ -81,22 +83,20 @@ def google_callback():
             return jsonify({'error': 'Failed to get token'}), 400
             
         access_token = token_response.json().get('access_token')
-        userinfo = requests.get(
+        userinfo = http_client.get(
             'https://www.googleapis.com/oauth2/v2/userinfo',
             headers={'Authorization': f'Bearer {access_token}'}
         ).json()
 
         # Find or create user
-        user = users_collection.find_one({"email": userinfo['email']})
-        if not user:
-            new_user = User(
-                username=userinfo.get('name', ''),
-                email=userinfo['email'],
-                auth_provider='google',
-                provider_id=userinfo['id']
-            )
-            result = users_collection.insert_one(new_user.to_dict())
-            user = users_collection.find_one({"_id": result.inserted_id})
+        new_user = User(
+            username=userinfo.get('name', ''),
+            email=userinfo['email'],
+            auth_provider='google',
+            provider_id=userinfo['id']
+        )
+        user = user_repository.upsert_by_email(userinfo['email'], new_user.to_dict())
+        skill_matcher.apply(user)
             
         # Create JWT token
         token = create_user_token(user['_id'])
@@ -135,7 +135,7 @@ def github_callback():
             return jsonify({'error': 'No code provided'}), 400
 
         # Exchange code for token with proper headers
-        token_response = requests.post(
+        token_response = http_client.post(
             'https://github.com/login/oauth/access_token',
             data={
                 'client_id': os.getenv('GITHUB_CLIENT_ID'),
@@ -168,7 +168,7 @@ def github_callback():
         }
         
         # Make user request
-        user_response = requests.get('https://api.github.com/user', headers=headers)
+        user_response = github_request('GET', 'https://api.github.com/user', headers=headers, priority=PRIORITY_LOGIN)
         if not user_response.ok:
             logger.error(f"GitHub user API error: {user_response.text}")
             return jsonify({'error': 'Failed to get user info'}), 400
@@ -176,7 +176,9 @@ def github_callback():
         github_user = user_response.json()
 
         # Make emails request
-        emails_response = requests.get('https://api.github.com/user/emails', headers=headers)
+        emails_response = github_request(
+            'GET', 'https://api.github.com/user/emails', headers=headers, priority=PRIORITY_LOGIN
+        )
         if not emails_response.ok:
             logger.error(f"GitHub emails API error: {emails_response.text}")
             return jsonify({'error': 'Failed to get user emails'}), 400
@@ -192,31 +194,19 @@ def github_callback():
             return jsonify({'error': 'No email found'}), 400
 
         # Find or create user
-        user = users_collection.find_one({"email": primary_email})
-        if not user:
-            new_user = {
-                "username": github_user['login'],
-                "email": primary_email,
-                "auth_provider": "github",
-                "provider_id": str(github_user['id']),
-                "github_connected": True,
-                "github_username": github_user['login'],
-                "github_access_token": access_token
-            }
-            result = users_collection.insert_one(new_user)
-            user = users_collection.find_one({"_id": result.inserted_id})
-        else:
-            # Update existing user with GitHub info
-            users_collection.update_one(
-                {"_id": user["_id"]},
-                {
-                    "$set": {
-                        "github_connected": True,
-                        "github_username": github_user['login'],
-                        "github_access_token": access_token
-                    }
-                }
-            )
+        new_user = {
+            "username": github_user['login'],
+            "email": primary_email,
+            "auth_provider": "github",
+            "provider_id": str(github_user['id'])
+        }
+        # Existing users get the GitHub info set, new ones are created with it
+        user = user_repository.upsert_by_email(primary_email, new_user, {
+            "github_connected": True,
+            "github_username": github_user['login'],
+            "github_access_token": access_token
+        })
+        skill_matcher.apply(user)
 
         # Create JWT token
         token = create_user_token(user['_id'])
@@ -229,6 +219,8 @@ def github_callback():
             'message': 'GitHub authentication successful'
         })
 
+    except GitHubRateLimited as e:
+        return rate_limited_response(e)
     except Exception as e:
         logger.exception("GitHub callback error")
         return jsonify({'error': str(e)}), 400
@@ -245,9 +237,6 @@ def register():
     if not username or not email or not password:
         return jsonify({'error': 'Missing required fields'}), 400
 
-    if users_collection.find_one({'email': email}):
-        return jsonify({'error': 'User already exists'}), 400
-
     new_user = User(
         username=username,
         email=email,
@@ -255,8 +244,10 @@ def register():
         skills_needed=skills_needed
     )
     new_user.set_password(password)  # Assuming you have a method to hash the password
-    result = users_collection.insert_one(new_user.to_dict())
-    user = users_collection.find_one({"_id": result.inserted_id})
+    user = user_repository.create_unless_exists(new_user.to_dict())
+    if not user:
+        return jsonify({'error': 'User already exists'}), 400
+    skill_matcher.apply(user)
 
     token = create_user_token(user['_id'])
     user_data = user.copy()
@@ -278,7 +269,7 @@ def login():
         if not email or not password:
             return jsonify({'error': 'Missing email or password'}), 400
 
-        user = users_collection.find_one({'email': email})
+        user = user_repository.find_by_email(email)
         if not user:
             return jsonify({'error': 'User not found'}), 404
 
@@ -299,7 +290,7 @@ def login():
             expires_delta=timedelta(days=1)
         )
 
-        user_data = {k: v for k, v in user.items() if k != 'password'}
+        user_data = {k: v for k, v in user.items() if k not in USER_PROJECTION}
         user_data['_id'] = str(user_data['_id'])
 
         return jsonify({
@@ -1,6 +1,18 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify
+from flask_jwt_extended import get_jwt_identity, jwt_required
 from bson import ObjectId
-from utils.db_config import users_collection, skills_collection, messages_collection
+from bson.errors import InvalidId
+from models import User, Message
+from utils.db_config import users_collection, skills_collection
+from utils.pagination import PUBLIC_USER_PROJECTION, keyset_page, parse_page_args
+from utils.streaming import stream_format, stream_cursor
+from utils.chat_history import decode_position, is_member, parse_history_args, requested_conversation
+from utils.message_store import message_store
+from utils.chat_hub import chat_hub, sse_stream
+from utils.leaderboard import leaderboard, windowed_leaderboard, rank_of, KARMA_WINDOWS
+from utils.user_repository import user_repository
+from utils.skill_matching import skill_matcher
+from utils.auth import auth_required
 
 skill_routes = Blueprint("skill_routes", __name__)
 
@@ -18,17 +30,30 @@ def add_user():
         if not all(field in data for field in required_fields):
             return jsonify({"error": "Missing required fields"}), 400
             
-        user = User(**data)
-        result = users_collection.insert_one(user.to_dict())
-        return jsonify({"message": "User added successfully", "id": str(result.inserted_id)}), 201
+        user = user_repository.create(User(**data).to_dict())
+        skill_matcher.apply(user)
+        return jsonify({"message": "User added successfully", "id": str(user["_id"])}), 201
         
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
 @skill_routes.route("/api/users", methods=["GET"])
 def get_users():
-    users = list(users_collection.find({}, {'_id': False}))
-    return jsonify(users)
+    try:
+        limit, after = parse_page_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    fmt = stream_format(request)
+    if fmt:
+        # Streams every user from the cursor on, batch by batch
+        query = {"_id": {"$gt": after}} if after else {}
+        return stream_cursor(users_collection.find(query, PUBLIC_USER_PROJECTION).sort("_id", 1), fmt)
+
+    users, next_cursor = keyset_page(users_collection, {}, PUBLIC_USER_PROJECTION, limit, after)
+    for user in users:
+        user["_id"] = str(user["_id"])
+    return jsonify({"users": users, "next_cursor": next_cursor})
 
 @skill_routes.route("/api/skills", methods=["POST"])
 def add_skill():
@@ -38,22 +63,116 @@ def add_skill():
 
 @skill_routes.route("/api/skills", methods=["GET"])
 def get_skills():
+    fmt = stream_format(request)
+    if fmt:
+        return stream_cursor(skills_collection.find({}, {"_id": 0}), fmt)
+
     skills = list(skills_collection.find({}, {"_id": 0}))
     return jsonify(skills)
 
 @skill_routes.route('/api/leaderboard', methods=['GET'])
 def get_leaderboard():
-    users = list(users_collection.find({}).sort("karma_points", -1).limit(10))
-    return jsonify([{**user, '_id': str(user['_id'])} for user in users])
+    window = request.args.get("window", "all")
+    if window == "all":
+        version, entries = leaderboard.top()
+    elif window in KARMA_WINDOWS:
+        version, entries = windowed_leaderboard.top(window)
+    else:
+        return jsonify({"error": "window must be one of: all, " + ", ".join(KARMA_WINDOWS)}), 400
+
+    etag = f'"{version}"'
+    if request.headers.get("If-None-Match") == etag:
+        return "", 304
+
+    response = jsonify(entries)
+    response.headers["ETag"] = etag
+    response.headers["X-Leaderboard-Version"] = version
+    return response
+
+@skill_routes.route('/api/leaderboard/rank/<user_id>', methods=['GET'])
+def get_leaderboard_rank(user_id):
+    try:
+        neighbours = int(request.args.get("neighbours", 2))
+        result = rank_of(user_id, neighbours)
+    except (InvalidId, ValueError):
+        return jsonify({"error": "Invalid user id or neighbours"}), 400
+
+    if not result:
+        return jsonify({"error": "User not found"}), 404
+    return jsonify(result)
 
 @skill_routes.route('/api/chat', methods=['POST'])
+@auth_required
 def send_message():
     data = request.get_json()
-    message = Message(data['user_id'], data['message'])
-    result = messages_collection.insert_one(message.to_dict())
-    return jsonify({"message": "Message sent", "id": str(result.inserted_id)})
+    if not data or not data.get("message"):
+        return jsonify({"error": "No message provided"}), 400
+
+    # The sender is whoever the token names, never a user_id in the body
+    sender = get_jwt_identity()
+    recipient_id = data.get("recipient_id")
+    conversation_id = data.get("conversation_id")
+    if conversation_id and not is_member(conversation_id, sender):
+        return jsonify({"error": "Not a member of this conversation"}), 403
+
+    message = Message(
+        sender,
+        data["message"],
+        recipient_id=recipient_id,
+        conversation_id=conversation_id or Message.conversation_for(sender, recipient_id)
+    )
+    document = message.to_dict()
+    message_store.append(document)
+    chat_hub.message_sent(dict(document))
+    document["_id"] = str(document["_id"])
+    return jsonify({"message": "Message sent", "id": document["_id"], "data": document})
 
 @skill_routes.route('/api/chat', methods=['GET'])
+@auth_required
 def get_messages():
-    messages = list(messages_collection.find({}).sort("timestamp", 1))
-    return jsonify([{**msg, '_id': str(msg['_id'])} for msg in messages])
+    if not is_member(requested_conversation(request.args), get_jwt_identity()):
+        return jsonify({"error": "Not a member of this conversation"}), 403
+    try:
+        conversation_id, limit, before, after = parse_history_args(message_store, request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    fmt = stream_format(request)
+    if fmt:
+        # Full export of one conversation, oldest first
+        return stream_cursor(message_store.export(conversation_id), fmt)
+
+    messages, cursors, has_more = message_store.page(conversation_id, limit, before, after)
+    for msg in messages:
+        msg["_id"] = str(msg["_id"])
+    return jsonify({"messages": messages, **cursors, "has_more": has_more})
+
+@skill_routes.route('/api/chat/stream', methods=['GET'])
+# EventSource cannot send headers, so browsers pass the token as ?jwt=
+@jwt_required(locations=["headers", "query_string"])
+def stream_messages():
+    if not is_member(requested_conversation(request.args), get_jwt_identity()):
+        return jsonify({"error": "Not a member of this conversation"}), 403
+    try:
+        conversation_id, _, _, after = parse_history_args(message_store, request.args)
+        # Set by the browser when an EventSource reconnects
+        last_event_id = request.headers.get("Last-Event-ID")
+        if last_event_id:
+            after = decode_position(last_event_id)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    subscription = chat_hub.subscribe(conversation_id)
+    if subscription is None:
+        response = jsonify({"error": "Too many open chat streams, try again shortly"})
+        response.headers["Retry-After"] = "5"
+        return response, 503
+    response = Response(
+        sse_stream(subscription, conversation_id, after),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    # A client gone before the first event never starts the generator,
+    # whose own cleanup would then not run
+    response.call_on_close(lambda: chat_hub.unsubscribe(subscription))
+    return response
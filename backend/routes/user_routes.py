@@ -1,15 +1,28 @@
 from flask import Blueprint, jsonify, request
-from utils.db_config import users_collection
+from utils.db_config import users_collection, pool_metrics
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from bson import ObjectId
 import requests # Add this import at the top
 import os  # Add this import at the top
 import logging
 from utils.auth import auth_required
-from datetime import datetime, timedelta
-from collections import defaultdict
+from utils import http_client
+from utils.github_rate_limit import (
+    PRIORITY_BACKGROUND, PRIORITY_LOGIN, GitHubRateLimited, github_request, rate_limited_response
+)
+from utils.github_fetch import GITHUB_API_URL, GitHubTokenExpired
+from utils.github_cache import get_contributions
+from utils.contribution_calendar import build_calendar, compact_calendar, longest_streak
+from utils.singleflight import SingleFlight, flight_stats
+from utils.pagination import PUBLIC_USER_PROJECTION, keyset_page, parse_page_args
+from utils.streaming import stream_format, stream_cursor
+from utils.leaderboard import leaderboard
+from utils.karma_ledger import KARMA_COALESCE, karma_ledger
+from utils.user_repository import USER_PROJECTION, user_repository
+from utils.chat_hub import chat_hub
+from utils.message_store import message_archive
+from utils.skill_matching import MATCH_LIMIT, MATCH_MODES, MAX_MATCH_LIMIT, MatcherLoading, skill_matcher
 from calendar import monthrange
-import math
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
@@ -17,14 +30,27 @@ logger = logging.getLogger(__name__)
 
 user_routes = Blueprint('users', __name__)
 
+activity_flights = SingleFlight('github_activity')
+
 @user_routes.route('/users', methods=['GET'])
 def get_users():
     try:
-        users = list(users_collection.find({}, {'password': 0}))
+        limit, after = parse_page_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        fmt = stream_format(request)
+        if fmt:
+            # Streams every user from the cursor on, batch by batch
+            query = {'_id': {'$gt': after}} if after else {}
+            return stream_cursor(users_collection.find(query, PUBLIC_USER_PROJECTION).sort('_id', 1), fmt)
+
+        users, next_cursor = keyset_page(users_collection, {}, PUBLIC_USER_PROJECTION, limit, after)
         # Convert ObjectId to string for JSON serialization
         for user in users:
             user['_id'] = str(user['_id'])
-        return jsonify(users)
+        return jsonify({'users': users, 'next_cursor': next_cursor})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -41,7 +67,7 @@ def manage_profile():
 
         if request.method == 'GET':
             try:
-                user = users_collection.find_one({'_id': ObjectId(current_user_id)}, {'password': 0})
+                user = user_repository.find_by_id(current_user_id)
                 if not user:
                     logger.error(f"User not found: {current_user_id}")
                     return jsonify({'error': 'User not found'}), 404
@@ -61,14 +87,10 @@ def manage_profile():
                 for field in protected_fields:
                     update_data.pop(field, None)
                 
-                result = users_collection.update_one(
-                    {'_id': ObjectId(current_user_id)},
-                    {'$set': update_data}
-                )
-                
-                # Always fetch and return the latest user data
-                updated_user = users_collection.find_one({'_id': ObjectId(current_user_id)}, {'password': 0})
+                # The update returns the latest user data with it
+                updated_user = user_repository.update(current_user_id, update_data)
                 if updated_user:
+                    skill_matcher.apply(updated_user)
                     updated_user['_id'] = str(updated_user['_id'])
                     return jsonify(updated_user), 200
                 
@@ -85,7 +107,7 @@ def manage_profile():
 @user_routes.route('/users/<user_id>', methods=['GET'])
 def get_user(user_id):
     try:
-        user = users_collection.find_one({'_id': ObjectId(user_id)}, {'password': 0})
+        user = user_repository.find_by_id(user_id)
         if user:
             user['_id'] = str(user['_id'])
             return jsonify(user)
@@ -107,16 +129,12 @@ def update_user(user_id):
         for field in sensitive_fields:
             update_data.pop(field, None)
 
-        result = users_collection.update_one(
-            {'_id': ObjectId(user_id)},
-            {'$set': update_data}
-        )
-
-        if result.modified_count:
-            updated_user = users_collection.find_one({'_id': ObjectId(user_id)}, {'password': 0})
+        updated_user = user_repository.update(user_id, update_data)
+        if updated_user:
+            skill_matcher.apply(updated_user)
             updated_user['_id'] = str(updated_user['_id'])
             return jsonify(updated_user)
-        return jsonify({'error': 'User not found or no changes made'}), 404
+        return jsonify({'error': 'User not found'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -132,41 +150,68 @@ def update_user_skills(user_id):
         skills_offered = data.get('skills_offered', [])
         skills_needed = data.get('skills_needed', [])
 
-        result = users_collection.update_one(
-            {'_id': ObjectId(user_id)},
-            {
-                '$set': {
-                    'skills_offered': skills_offered,
-                    'skills_needed': skills_needed
-                }
-            }
-        )
+        updated_user = user_repository.update(user_id, {
+            'skills_offered': skills_offered,
+            'skills_needed': skills_needed
+        })
 
-        if result.modified_count:
-            updated_user = users_collection.find_one({'_id': ObjectId(user_id)}, {'password': 0})
+        if updated_user:
+            skill_matcher.apply(updated_user)
             updated_user['_id'] = str(updated_user['_id'])
             return jsonify(updated_user)
-        return jsonify({'error': 'User not found or no changes made'}), 404
+        return jsonify({'error': 'User not found'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@user_routes.route('/matches', methods=['GET'])
+@auth_required
+def get_matches():
+    mode = request.args.get('mode', 'reciprocal')
+    if mode not in MATCH_MODES:
+        return jsonify({'error': 'mode must be one of: ' + ', '.join(MATCH_MODES)}), 400
+    try:
+        limit = int(request.args.get('limit', MATCH_LIMIT))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    limit = max(1, min(limit, MAX_MATCH_LIMIT))
+
+    try:
+        found = skill_matcher.matches(get_jwt_identity(), mode, limit)
+        if found is None:
+            return jsonify({'error': 'User not found'}), 404
+        matches, approximate = found
+        return jsonify({'mode': mode, 'matches': matches, 'approximate': approximate})
+    except MatcherLoading:
+        response = jsonify({'error': 'Matches are still loading, try again shortly'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    except Exception as e:
+        logger.error(f"Error matching user: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @user_routes.route('/users/<user_id>/karma', methods=['PUT'])
 @jwt_required()
 def update_karma(user_id):
     try:
         data = request.get_json()
         karma_change = data.get('karma_change', 0)
+        strict = not KARMA_COALESCE or request.args.get('consistency') == 'strict'
 
-        result = users_collection.update_one(
-            {'_id': ObjectId(user_id)},
-            {'$inc': {'karma_points': karma_change}}
-        )
+        if strict:
+            # Applies this worker's buffered karma for the user together with this change
+            updated_user = karma_ledger.apply_now(user_id, karma_change, USER_PROJECTION)
+            if not updated_user:
+                return jsonify({'error': 'User not found'}), 404
+        else:
+            user = user_repository.find_by_id(user_id)
+            if not user:
+                return jsonify({'error': 'User not found'}), 404
+            pending = karma_ledger.add(user_id, karma_change)
+            updated_user = {**user, 'karma_points': user.get('karma_points', 0) + pending}
 
-        if result.modified_count:
-            updated_user = users_collection.find_one({'_id': ObjectId(user_id)}, {'password': 0})
-            updated_user['_id'] = str(updated_user['_id'])
-            return jsonify(updated_user)
-        return jsonify({'error': 'User not found'}), 404
+        leaderboard.apply(updated_user)
+        updated_user['_id'] = str(updated_user['_id'])
+        return jsonify(updated_user)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -182,7 +227,7 @@ def link_github():
             return jsonify({'error': 'No GitHub code provided'}), 400
 
         # Exchange code for token
-        token_response = requests.post(
+        token_response = http_client.post(
             'https://github.com/login/oauth/access_token',
             data={
                 'client_id': os.getenv('GITHUB_CLIENT_ID'),
@@ -204,7 +249,7 @@ def link_github():
             
         # Get GitHub user info
         headers = {'Authorization': f'Bearer {access_token}'}
-        github_response = requests.get('https://api.github.com/user', headers=headers)
+        github_response = github_request('GET', f'{GITHUB_API_URL}/user', headers=headers, priority=PRIORITY_LOGIN)
         
         if not github_response.ok:
             return jsonify({'error': 'Failed to get GitHub user info'}), 400
@@ -212,24 +257,20 @@ def link_github():
         github_user = github_response.json()
         
         # Update user in database
-        result = users_collection.update_one(
-            {'_id': ObjectId(current_user_id)},
-            {
-                '$set': {
-                    'github_connected': True,
-                    'github_username': github_user['login'],
-                    'github_access_token': access_token
-                }
-            }
-        )
+        updated_user = user_repository.update(current_user_id, {
+            'github_connected': True,
+            'github_username': github_user['login'],
+            'github_access_token': access_token
+        })
         
-        if result.modified_count:
-            updated_user = users_collection.find_one({'_id': ObjectId(current_user_id)}, {'password': 0})
+        if updated_user:
             updated_user['_id'] = str(updated_user['_id'])
             return jsonify(updated_user)
         
         return jsonify({'error': 'Failed to update user'}), 400
             
+    except GitHubRateLimited as e:
+        return rate_limited_response(e)
     except Exception as e:
         print(f"GitHub linking error: {str(e)}")
         return jsonify({'error': str(e)}), 400
@@ -253,9 +294,14 @@ def get_github_activity():
         }
         
         username = user.get('github_username')
-        activity_url = f'https://api.github.com/users/{username}/events/public'
+        activity_url = f'{GITHUB_API_URL}/users/{username}/events/public'
         
-        response = requests.get(activity_url, headers=headers)
+        # The activity feed is the first thing shed when the budget runs low;
+        # concurrent refreshes of the same user's feed share one call
+        response = activity_flights.do(
+            current_user_id, github_request, 'GET', activity_url,
+            headers=headers, priority=PRIORITY_BACKGROUND
+        )
         
         if response.status_code == 401:
             # Token expired or invalid
@@ -266,6 +312,8 @@ def get_github_activity():
         
         return jsonify(activity)
         
+    except GitHubRateLimited as e:
+        return rate_limited_response(e)
     except requests.exceptions.RequestException as e:
         logger.error(f"GitHub API error: {str(e)}")
         return jsonify({'error': 'Failed to fetch GitHub activity'}), 500
@@ -286,47 +334,9 @@ def get_github_commits():
         if not user.get('github_access_token'):
             return jsonify({'error': 'GitHub token not found'}), 400
 
-        headers = {
-            'Authorization': f'token {user["github_access_token"]}',
-            'Accept': 'application/vnd.github.v3+json'
-        }
-        
-        username = user.get('github_username')
-        
-        # Get user's repositories
-        repos_url = f'https://api.github.com/users/{username}/repos'
-        repos_response = requests.get(repos_url, headers=headers)
-        
-        if repos_response.status_code == 401:
-            return jsonify({'error': 'GitHub token expired'}), 401
-            
-        repos = repos_response.json()
-        
-        # Collect commit data for the last year
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=365)
-        
-        commit_data = defaultdict(int)
-        
-        for repo in repos:
-            if repo['fork']:  # Skip forked repositories
-                continue
-                
-            commits_url = f'https://api.github.com/repos/{username}/{repo["name"]}/commits'
-            params = {
-                'author': username,
-                'since': start_date.isoformat(),
-                'until': end_date.isoformat(),
-                'per_page': 100
-            }
-            
-            commits_response = requests.get(commits_url, headers=headers, params=params)
-            
-            if commits_response.ok:
-                commits = commits_response.json()
-                for commit in commits:
-                    date = commit['commit']['author']['date'][:10]  # YYYY-MM-DD
-                    commit_data[date] += 1
+        # Commit data for the last year, served from the contributions cache
+        force_refresh = request.args.get('refresh', 'false').lower() == 'true'
+        commit_data = get_contributions(user, force_refresh=force_refresh)
         
         # Format data for the graph
         graph_data = [
@@ -341,9 +351,13 @@ def get_github_commits():
             'commit_data': graph_data,
             'total_commits': sum(commit_data.values()),
             'active_days': len(commit_data),
-            'longest_streak': calculate_longest_streak(commit_data)
+            'longest_streak': longest_streak(commit_data)
         })
         
+    except GitHubTokenExpired:
+        return jsonify({'error': 'GitHub token expired'}), 401
+    except GitHubRateLimited as e:
+        return rate_limited_response(e)
     except requests.exceptions.RequestException as e:
         logger.error(f"GitHub API error: {str(e)}")
         return jsonify({'error': 'Failed to fetch GitHub commits'}), 500
@@ -364,153 +378,36 @@ def get_github_contributions():
         if not user.get('github_access_token'):
             return jsonify({'error': 'GitHub token not found'}), 400
 
-        username = user.get('github_username')
-        headers = {
-            'Authorization': f'token {user["github_access_token"]}',
-            'Accept': 'application/vnd.github.v3+json'
-        }
+        force_refresh = request.args.get('refresh', 'false').lower() == 'true'
 
-        # Get contribution data for the last year
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=365)
-        
-        # Initialize contribution data structure
-        contribution_data = {
-            'total_contributions': 0,
-            'contributions_by_day': defaultdict(int),
-            'contributions_by_week': [],
-            'longest_streak': 0,
-            'current_streak': 0,
-            'max_contributions': 0,
-            'contribution_levels': [],
-            'months': []
-        }
+        # Commit data for the last year, served from the contributions cache
+        commit_data = get_contributions(user, force_refresh=force_refresh)
 
-        # Get all repositories
-        repos_url = f'https://api.github.com/users/{username}/repos?per_page=100'
-        repos_response = requests.get(repos_url, headers=headers)
-        
-        if repos_response.status_code == 401:
-            return jsonify({'error': 'GitHub token expired'}), 401
-            
-        repos = repos_response.json()
-
-        # Collect commit data
-        for repo in repos:
-            if repo['fork']:
-                continue
-
-            commits_url = f'https://api.github.com/repos/{username}/{repo["name"]}/commits'
-            params = {
-                'author': username,
-                'since': start_date.isoformat(),
-                'until': end_date.isoformat(),
-                'per_page': 100
-            }
+        # Opt-in packed per-day array for clients that render the grid themselves
+        if request.args.get('format') == 'compact':
+            return jsonify(compact_calendar(commit_data))
 
-            try:
-                commits_response = requests.get(commits_url, headers=headers, params=params)
-                if commits_response.ok:
-                    commits = commits_response.json()
-                    for commit in commits:
-                        date = commit['commit']['author']['date'][:10]
-                        contribution_data['contributions_by_day'][date] += 1
-                        contribution_data['total_contributions'] += 1
-            except Exception as e:
-                logger.error(f"Error fetching commits for repo {repo['name']}: {str(e)}")
-                continue
-
-        # Process contribution data
-        dates = sorted(contribution_data['contributions_by_day'].keys())
-        if dates:
-            # Calculate streaks
-            current_streak = 0
-            longest_streak = 0
-            current_date = datetime.now().date()
-            
-            for date in reversed(dates):
-                date_obj = datetime.strptime(date, '%Y-%m-%d').date()
-                if (current_date - date_obj).days <= 1:
-                    if contribution_data['contributions_by_day'][date] > 0:
-                        current_streak += 1
-                        longest_streak = max(longest_streak, current_streak)
-                    else:
-                        break
-                else:
-                    break
-
-            contribution_data['current_streak'] = current_streak
-            contribution_data['longest_streak'] = longest_streak
-
-            # Calculate contribution levels
-            contributions = list(contribution_data['contributions_by_day'].values())
-            max_contributions = max(contributions) if contributions else 0
-            contribution_data['max_contributions'] = max_contributions
-            
-            # Define contribution levels (similar to GitHub)
-            if max_contributions > 0:
-                levels = [
-                    0,
-                    math.ceil(max_contributions / 4),
-                    math.ceil(max_contributions / 2),
-                    math.ceil(3 * max_contributions / 4),
-                    max_contributions
-                ]
-                contribution_data['contribution_levels'] = levels
-
-            # Organize data by weeks
-            weeks = []
-            current_week = []
-            for date in dates:
-                day_contributions = contribution_data['contributions_by_day'][date]
-                current_week.append({
-                    'date': date,
-                    'count': day_contributions,
-                    'level': next(i for i, level in enumerate(contribution_data['contribution_levels'])
-                               if day_contributions <= level)
-                })
-                
-                if len(current_week) == 7:
-                    weeks.append(current_week)
-                    current_week = []
-            
-            if current_week:
-                weeks.append(current_week)
-            
-            contribution_data['contributions_by_week'] = weeks
-
-            # Add month labels
-            months = []
-            current_month = None
-            for date in dates:
-                month = datetime.strptime(date, '%Y-%m-%d').strftime('%b')
-                if month != current_month:
-                    months.append(month)
-                    current_month = month
-            
-            contribution_data['months'] = months
+        contribution_data = build_calendar(commit_data)
+        contribution_data['contributions_by_day'] = commit_data
 
         return jsonify(contribution_data)
         
+    except GitHubTokenExpired:
+        return jsonify({'error': 'GitHub token expired'}), 401
+    except GitHubRateLimited as e:
+        return rate_limited_response(e)
     except Exception as e:
         logger.error(f"Error getting GitHub contributions: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-def calculate_longest_streak(commit_data):
-    if not commit_data:
-        return 0
-        
-    dates = sorted(commit_data.keys())
-    longest_streak = current_streak = 1
-    
-    for i in range(1, len(dates)):
-        current_date = datetime.strptime(dates[i], '%Y-%m-%d')
-        prev_date = datetime.strptime(dates[i-1], '%Y-%m-%d')
-        
-        if (current_date - prev_date).days == 1:
-            current_streak += 1
-            longest_streak = max(longest_streak, current_streak)
-        else:
-            current_streak = 1
-            
-    return longest_streak
+@user_routes.route('/users/github/metrics', methods=['GET'])
+@auth_required
+def get_github_metrics():
+    return jsonify({
+        'singleflight': flight_stats(),
+        'http_pools': http_client.pool_stats(),
+        'mongo_pool': pool_metrics.snapshot(),
+        'chat_hub': dict(chat_hub.stats),
+        'chat_archive': dict(message_archive.stats),
+        'skill_matcher': skill_matcher.stats()
+    })
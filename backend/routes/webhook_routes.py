@@ -0,0 +1,27 @@
+from flask import Blueprint, request, jsonify
+from utils.github_webhooks import verify_signature, ingest_push
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+webhook_routes = Blueprint('webhooks', __name__)
+
+@webhook_routes.route('/github', methods=['POST'])
+def github_webhook():
+    signature = request.headers.get('X-Hub-Signature-256')
+    if not verify_signature(os.getenv('GITHUB_WEBHOOK_SECRET'), request.get_data(), signature):
+        return jsonify({'error': 'Invalid signature'}), 401
+
+    event = request.headers.get('X-GitHub-Event')
+    if event == 'ping':
+        return jsonify({'message': 'pong'})
+    if event != 'push':
+        return jsonify({'message': f'Ignored {event} event'}), 202
+
+    try:
+        ingested = ingest_push(request.get_json())
+        return jsonify({'message': 'Push ingested', 'commits': ingested})
+    except Exception as e:
+        logger.error(f"GitHub webhook error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
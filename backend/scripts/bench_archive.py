@@ -0,0 +1,105 @@
+"""Benchmark chat history before and after archiving old messages.
+
+Seeds `--messages` messages into a scratch collection of the benchmark
+database, times the hot path (latest pages and caught-up polls) and
+records the collection's storage and index size. It then archives the
+oldest `--archive-fraction` of every conversation into segment files under
+`--archive-dir` and repeats the measurements through the tiered store,
+adding pages of archived history and the segments' size on disk.
+WiredTiger keeps the freed space until `compact` runs, so the index size
+is the number that drops right away. Run from the backend directory with
+a local mongod:
+
+    python scripts/bench_archive.py --mongodb-uri mongodb://127.0.0.1:27017
+"""
+import argparse
+import tempfile
+import random
+import time
+import sys
+import os
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymongo import MongoClient
+from bson import ObjectId
+from utils.chat_history import MessageStore, decode_position
+from utils.message_archive import MessageArchive, TieredMessageStore, archive_old_messages
+from utils.indexes import INDEXES
+from bench_chat import seed, sizes, timed
+
+STARTED = datetime(2024, 1, 1)
+
+
+def directory_size(path):
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path) for name in names
+    )
+
+
+def hot_path(store, conversations, runs):
+    def conversation():
+        return f'c{random.randrange(conversations)}'
+
+    positions = []
+    for _ in range(runs):
+        conversation_id = conversation()
+        _, cursors, _ = store.page(conversation_id, 50)
+        positions.append((conversation_id, decode_position(cursors['after'])))
+    latest = iter(positions)
+
+    def empty_poll():
+        conversation_id, after = next(latest)
+        store.page(conversation_id, 50, after=after)
+
+    print(f'  latest page: {timed(lambda: store.page(conversation(), 50), runs)}')
+    print(f'  empty poll:  {timed(empty_poll, runs)}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mongodb-uri', default='mongodb://127.0.0.1:27017')
+    parser.add_argument('--messages', type=int, default=1_000_000)
+    parser.add_argument('--conversations', type=int, default=1_000)
+    parser.add_argument('--archive-fraction', type=float, default=0.8)
+    parser.add_argument('--archive-dir', help='defaults to a temporary directory')
+    parser.add_argument('--runs', type=int, default=200)
+    args = parser.parse_args()
+
+    db = MongoClient(args.mongodb_uri).skill_swap_bench
+    collection = db.archive_messages
+    # Archiving empties the collection, so every run starts from a fresh seed
+    collection.drop()
+    db.message_archives.drop()
+    seed(collection, args.messages, args.conversations)
+    db.message_archives.create_indexes(INDEXES['message_archives'])
+
+    print(f'before: {sizes(db, "archive_messages")}')
+    hot_path(MessageStore(collection), args.conversations, args.runs)
+
+    directory = args.archive_dir or tempfile.mkdtemp(prefix='chat-archive-')
+    archive = MessageArchive(db.message_archives, directory)
+    # seed() spaces messages a millisecond apart
+    cutoff = STARTED + timedelta(milliseconds=int(args.messages * args.archive_fraction))
+    started = time.perf_counter()
+    archived = archive_old_messages(collection, archive, cutoff)
+    print(f'archived {archived:,} messages in {time.perf_counter() - started:.1f} s')
+
+    print(f'after:  {sizes(db, "archive_messages")}')
+    print(f'        {directory_size(directory) / 2**20:,.1f} MiB of segments in {directory}')
+    store = TieredMessageStore(MessageStore(collection), archive, age=datetime.utcnow() - cutoff)
+    hot_path(store, args.conversations, args.runs)
+
+    def archived_page():
+        # A page that starts inside the archive
+        before = STARTED + timedelta(milliseconds=random.randrange(1, int(args.messages * args.archive_fraction)))
+        store.page(f'c{random.randrange(args.conversations)}', 50, before=(before, ObjectId('f' * 24)))
+
+    print(f'  archived page: {timed(archived_page, args.runs)}')
+    print(f'  archive stats: {archive.stats}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""Check the contributions calendar against the old code and time it.
+
+Generates `--years` random years of per-day commit counts and compares
+utils.contribution_calendar with a copy of the loop-based calculation it
+replaced: totals, the busiest day, level thresholds, every active day's
+level and the longest streak must match, and the compact payload must
+decode to the same per-day counts as the full calendar. It then times
+both implementations on a full year. Needs no database:
+
+    python scripts/bench_calendar.py --years 300
+"""
+from datetime import date, datetime, timedelta
+import argparse
+import base64
+import random
+import math
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.contribution_calendar import build_calendar, compact_calendar
+from bench_chat import timed
+
+END = date(2024, 6, 30)
+
+
+def legacy_calendar(commit_data):
+    """The calculation previously inlined in routes/user_routes.py"""
+    dates = sorted(commit_data)
+    max_contributions = max(commit_data.values()) if commit_data else 0
+    levels = []
+    if max_contributions > 0:
+        levels = [
+            0,
+            math.ceil(max_contributions / 4),
+            math.ceil(max_contributions / 2),
+            math.ceil(3 * max_contributions / 4),
+            max_contributions
+        ]
+    day_levels = {
+        day: next(i for i, level in enumerate(levels) if commit_data[day] <= level)
+        for day in dates
+    }
+
+    longest_streak = current_streak = 1 if dates else 0
+    for i in range(1, len(dates)):
+        current_date = datetime.strptime(dates[i], '%Y-%m-%d')
+        prev_date = datetime.strptime(dates[i - 1], '%Y-%m-%d')
+        if (current_date - prev_date).days == 1:
+            current_streak += 1
+            longest_streak = max(longest_streak, current_streak)
+        else:
+            current_streak = 1
+
+    # Weeks and month labels changed shape, so they are built for timing only
+    weeks, week = [], []
+    months = []
+    for day in dates:
+        week.append({'date': day, 'count': commit_data[day], 'level': day_levels[day]})
+        if len(week) == 7:
+            weeks.append(week)
+            week = []
+        month = datetime.strptime(day, '%Y-%m-%d').strftime('%b')
+        if not months or months[-1] != month:
+            months.append(month)
+    if week:
+        weeks.append(week)
+
+    return {
+        'total_contributions': sum(commit_data.values()),
+        'max_contributions': max_contributions,
+        'contribution_levels': levels,
+        'levels': day_levels,
+        'longest_streak': longest_streak
+    }
+
+
+def random_year(rng):
+    # Vary how busy a year is, from a few active days to nearly every day
+    activity = rng.random()
+    counts = {}
+    for offset in range(365):
+        if rng.random() < activity:
+            counts[(END - timedelta(days=offset)).isoformat()] = rng.choice((1, 1, 2, 3, 5, 8, 40))
+    return counts
+
+
+def check(commit_data):
+    expected = legacy_calendar(commit_data)
+    calendar = build_calendar(commit_data, END)
+    days = [day for week in calendar['contributions_by_week'] for day in week]
+    levels = {day['date']: day['level'] for day in days if day['count']}
+    for key in ('total_contributions', 'max_contributions', 'contribution_levels', 'longest_streak'):
+        if calendar[key] != expected[key]:
+            return f'{key}: {calendar[key]} != {expected[key]}'
+    if levels != expected['levels']:
+        return 'day levels differ'
+
+    compact = compact_calendar(commit_data, END)
+    packed = base64.b64decode(compact['counts'])
+    counts = [int.from_bytes(packed[i:i + 2], 'little') for i in range(0, len(packed), 2)]
+    if compact['start'] != days[0]['date'] or counts != [day['count'] for day in days]:
+        return 'compact counts differ from the calendar'
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--years', type=int, default=300)
+    parser.add_argument('--runs', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    failures = 0
+    for _ in range(args.years):
+        commit_data = random_year(rng)
+        problem = check(commit_data)
+        if problem:
+            failures += 1
+            print(f'mismatch on {len(commit_data)} active days: {problem}')
+    print(f'{args.years - failures}/{args.years} random years match the old calculation')
+
+    full_year = {(END - timedelta(days=offset)).isoformat(): offset % 7 + 1 for offset in range(365)}
+    print(f'old calendar: {timed(lambda: legacy_calendar(full_year), args.runs)}')
+    print(f'new calendar: {timed(lambda: build_calendar(full_year, END), args.runs)}')
+    print(f'compact:      {timed(lambda: compact_calendar(full_year, END), args.runs)}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,128 @@
+"""Benchmark chat polling against a large local message collection.
+
+Seeds `--messages` messages (10M by default) spread over `--conversations`
+conversations into a separate benchmark database, applies the registry
+indexes, then times incremental polls and history pages through
+utils.chat_history. `--legacy` also times the old unscoped full read.
+`--buckets` packs the same messages into time buckets and compares index
+size and page latency of the two layouts. Run from the backend directory
+with a local mongod:
+
+    python scripts/bench_chat.py --mongodb-uri mongodb://127.0.0.1:27017 --buckets
+"""
+import argparse
+import statistics
+import random
+import time
+import sys
+import os
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymongo import MongoClient
+from utils.chat_history import MessageStore, decode_position
+from utils.message_buckets import BucketedMessageStore, migrate
+from utils.indexes import INDEXES
+
+BATCH_SIZE = 10000
+
+
+def seed(collection, total, conversations):
+    if collection.estimated_document_count() >= total:
+        return
+    collection.drop()
+    started = datetime(2024, 1, 1)
+    for offset in range(0, total, BATCH_SIZE):
+        collection.insert_many([{
+            'user_id': f'user{i % 1000}',
+            'message': f'message {i}',
+            'conversation_id': f'c{i % conversations}',
+            'timestamp': started + timedelta(milliseconds=i)
+        } for i in range(offset, min(offset + BATCH_SIZE, total))], ordered=False)
+        print(f'\rseeded {min(offset + BATCH_SIZE, total):,}', end='', flush=True)
+    print()
+    collection.create_indexes(INDEXES['messages'])
+
+
+def seed_buckets(messages, buckets):
+    if buckets.estimated_document_count():
+        return
+    started = time.perf_counter()
+    message_count, bucket_count = migrate(messages, buckets)
+    print(f'packed {message_count:,} messages into {bucket_count:,} buckets '
+          f'in {time.perf_counter() - started:.1f} s')
+    buckets.create_indexes(INDEXES['message_buckets'])
+
+
+def sizes(db, name):
+    stats = db.command('collStats', name)
+    return (f'{stats["count"]:,} documents, {stats["storageSize"] / 2**20:,.1f} MiB data, '
+            f'{stats["totalIndexSize"] / 2**20:,.1f} MiB indexes')
+
+
+def timed(fn, runs):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return f'p50 {statistics.median(samples):.2f} ms, p95 {samples[int(len(samples) * 0.95) - 1]:.2f} ms'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mongodb-uri', default='mongodb://127.0.0.1:27017')
+    parser.add_argument('--messages', type=int, default=10_000_000)
+    parser.add_argument('--conversations', type=int, default=10_000)
+    parser.add_argument('--runs', type=int, default=200)
+    parser.add_argument('--legacy', action='store_true', help='also time the old full read (slow)')
+    parser.add_argument('--buckets', action='store_true', help='also compare the bucketed layout')
+    args = parser.parse_args()
+
+    db = MongoClient(args.mongodb_uri).skill_swap_bench
+    collection = db.messages
+    seed(collection, args.messages, args.conversations)
+    stores = {'documents': MessageStore(collection)}
+    if args.buckets:
+        seed_buckets(collection, db.message_buckets)
+        stores['buckets'] = BucketedMessageStore(db.message_buckets)
+        print(f'documents: {sizes(db, "messages")}')
+        print(f'buckets:   {sizes(db, "message_buckets")}')
+
+    def conversation():
+        return f'c{random.randrange(args.conversations)}'
+
+    for layout, store in stores.items():
+        # Position every poll at the newest message, as a client that is caught up
+        positions = []
+        for _ in range(args.runs):
+            conversation_id = conversation()
+            _, cursors, _ = store.page(conversation_id, 50)
+            positions.append((conversation_id, decode_position(cursors['after'])))
+        latest = iter(positions)
+
+        def empty_poll():
+            conversation_id, after = next(latest)
+            store.page(conversation_id, 50, after=after)
+
+        def latest_page():
+            store.page(conversation(), 50)
+
+        def older_page():
+            conversation_id, after = random.choice(positions)
+            store.page(conversation_id, 50, before=after)
+
+        print(f'[{layout}] latest page: {timed(latest_page, args.runs)}')
+        print(f'[{layout}] older page:  {timed(older_page, args.runs)}')
+        print(f'[{layout}] empty poll:  {timed(empty_poll, args.runs)}')
+
+    if args.legacy:
+        started = time.perf_counter()
+        count = sum(1 for _ in collection.find({}).sort('timestamp', 1))
+        print(f'legacy full read: {count:,} messages in {time.perf_counter() - started:.1f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Compare sequential and concurrent commit fetching against a fake GitHub.
+
+Starts a fake GitHub API that lists `--repos` repositories, answers each
+repo's commits with `--commits` commits spread over the last year, and
+sleeps `--latency` seconds before every response. It then fetches the
+per-day commit counts through utils.github_fetch one repo at a time and
+with the default concurrency, checks that both runs count the same
+commits and reports the speedup. Needs no database or network:
+
+    python scripts/bench_github_fetch.py --repos 20 --latency 0.2
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+import argparse
+import threading
+import json
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import github_fetch
+from utils.github_fetch import GITHUB_FETCH_CONCURRENCY, FetchBudget, fetch_commit_counts, fetch_repos
+from load_github import _free_port
+
+USERNAME = 'octocat'
+
+
+def start_fake_github(repos, commits, latency):
+    now = datetime.utcnow()
+    repo_list = json.dumps([
+        {'name': f'repo{i}', 'fork': i % 10 == 9} for i in range(repos)
+    ]).encode()
+    commit_list = json.dumps([
+        {'commit': {'author': {'date': (now - timedelta(hours=i * 7)).strftime('%Y-%m-%dT%H:%M:%SZ')}}}
+        for i in range(commits)
+    ]).encode()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            path = urlparse(self.path).path
+            body = repo_list if path == f'/users/{USERNAME}/repos' else commit_list
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('X-RateLimit-Limit', '5000')
+            self.send_header('X-RateLimit-Remaining', '5000')
+            self.send_header('X-RateLimit-Reset', str(int(time.time()) + 3600))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    ThreadingHTTPServer.daemon_threads = True
+    server = ThreadingHTTPServer(('127.0.0.1', _free_port()), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repos', type=int, default=20)
+    parser.add_argument('--commits', type=int, default=50, help='commits per repo')
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds per fake GitHub response')
+    args = parser.parse_args()
+
+    server, url = start_fake_github(args.repos, args.commits, args.latency)
+    github_fetch.GITHUB_API_URL = url
+    headers = {'Authorization': 'token bench-token'}
+    since = datetime.utcnow() - timedelta(days=365)
+
+    repos = fetch_repos(USERNAME, headers)
+    results = {}
+    for label, concurrency in (('sequential', 1), ('concurrent', GITHUB_FETCH_CONCURRENCY)):
+        started = time.perf_counter()
+        counts = fetch_commit_counts(USERNAME, headers, repos, since, None, concurrency, FetchBudget())
+        elapsed = time.perf_counter() - started
+        results[label] = (counts, elapsed)
+        print(f'{label:>10}: {sum(counts.values()):,} commits over {len(counts)} days in {elapsed:.2f} s')
+    server.shutdown()
+
+    (sequential, slow), (concurrent, fast) = results['sequential'], results['concurrent']
+    if sequential != concurrent:
+        print('FAIL: concurrent counts differ from sequential ones')
+        return 1
+    print(f'speedup: {slow / fast:.1f}x for {sum(not repo["fork"] for repo in repos)} repos')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
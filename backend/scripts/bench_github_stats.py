@@ -0,0 +1,153 @@
+"""Compare the REST and GraphQL stats backends against a recorded calendar.
+
+Serves fixtures/github_contribution_calendar.json, a contributionCalendar
+response in GitHub's GraphQL shape, from a fake GitHub that also answers
+the REST repo and commit listings with the same per-day counts spread
+over `--repos` repositories, each response delayed by `--latency`
+seconds. It checks that utils.github_graphql parses the fixture into the
+calendar's days and total, that GraphQL errors and a rejected token
+raise, and that the REST crawl counts the same days, then reports calls
+and time per backend. Needs no database or network:
+
+    python scripts/bench_github_stats.py --repos 20 --latency 0.05
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+import argparse
+import threading
+import json
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import github_fetch, github_graphql
+from utils.github_fetch import GitHubTokenExpired, FetchBudget, fetch_commit_counts, fetch_repos
+from utils.github_graphql import GitHubGraphQLError, fetch_contribution_calendar
+from load_github import _free_port
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'github_contribution_calendar.json')
+USERNAME = 'octocat'
+BAD_TOKEN = 'revoked-token'
+
+
+def calendar_days(fixture):
+    calendar = fixture['data']['user']['contributionsCollection']['contributionCalendar']
+    days = [day for week in calendar['weeks'] for day in week['contributionDays']]
+    return calendar['totalContributions'], days
+
+
+def start_fake_github(fixture, repos, latency):
+    _, days = calendar_days(fixture)
+    repo_list = json.dumps([{'name': f'repo{i}', 'fork': False} for i in range(repos)]).encode()
+    # Every contribution becomes a commit at noon in one of the repos
+    commits = [[] for _ in range(repos)]
+    for index, day in enumerate(days):
+        for n in range(day['contributionCount']):
+            commits[(index + n) % repos].append({'commit': {'author': {'date': f'{day["date"]}T12:00:00Z'}}})
+    commit_lists = {f'repo{i}': json.dumps(repo_commits).encode() for i, repo_commits in enumerate(commits)}
+    calendar = json.dumps(fixture).encode()
+    calls = {'rest': 0, 'graphql': 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, body):
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('X-RateLimit-Limit', '5000')
+            self.send_header('X-RateLimit-Remaining', '5000')
+            self.send_header('X-RateLimit-Reset', str(int(time.time()) + 3600))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            time.sleep(latency)
+            calls['rest'] += 1
+            path = urlparse(self.path).path
+            if path == f'/users/{USERNAME}/repos':
+                self._send(200, repo_list)
+            else:
+                # /repos/<owner>/<repo>/commits
+                self._send(200, commit_lists.get(path.split('/')[3], b'[]'))
+
+        def do_POST(self):
+            time.sleep(latency)
+            calls['graphql'] += 1
+            request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            if self.headers.get('Authorization') == f'bearer {BAD_TOKEN}':
+                self._send(401, b'{"message": "Bad credentials"}')
+            elif request['variables']['login'] != USERNAME:
+                self._send(200, json.dumps({
+                    'data': {'user': None},
+                    'errors': [{'type': 'NOT_FOUND', 'message': 'Could not resolve to a User'}]
+                }).encode())
+            else:
+                self._send(200, calendar)
+
+        def log_message(self, *args):
+            pass
+
+    ThreadingHTTPServer.daemon_threads = True
+    server = ThreadingHTTPServer(('127.0.0.1', _free_port()), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}', calls
+
+
+def raises(error, fn):
+    try:
+        fn()
+    except error:
+        return True
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repos', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per fake GitHub response')
+    args = parser.parse_args()
+
+    with open(FIXTURE) as fixture_file:
+        fixture = json.load(fixture_file)
+    total, days = calendar_days(fixture)
+    expected = {day['date']: day['contributionCount'] for day in days if day['contributionCount']}
+    since = datetime.fromisoformat(days[0]['date'])
+    until = datetime.fromisoformat(days[-1]['date']) + timedelta(hours=23, minutes=59, seconds=59)
+
+    server, url, calls = start_fake_github(fixture, args.repos, args.latency)
+    github_fetch.GITHUB_API_URL = url
+    github_graphql.GITHUB_GRAPHQL_URL = f'{url}/graphql'
+    failures = []
+
+    started = time.perf_counter()
+    graphql_days = fetch_contribution_calendar(USERNAME, 'fixture-token', since, until)
+    graphql_time = time.perf_counter() - started
+    graphql_calls = calls['graphql']
+    if graphql_days != expected or sum(graphql_days.values()) != total:
+        failures.append('GraphQL days differ from the recorded calendar')
+    if not raises(GitHubGraphQLError, lambda: fetch_contribution_calendar('ghost', 'fixture-token', since, until)):
+        failures.append('a GraphQL error payload did not raise GitHubGraphQLError')
+    if not raises(GitHubTokenExpired, lambda: fetch_contribution_calendar(USERNAME, BAD_TOKEN, since, until)):
+        failures.append('a 401 did not raise GitHubTokenExpired')
+
+    headers = {'Authorization': 'token fixture-token'}
+    started = time.perf_counter()
+    budget = FetchBudget()
+    rest_days = fetch_commit_counts(USERNAME, headers, fetch_repos(USERNAME, headers, budget), since, until, budget=budget)
+    rest_time = time.perf_counter() - started
+    if dict(rest_days) != expected:
+        failures.append('REST counts differ from the recorded calendar')
+    server.shutdown()
+
+    print(f'recorded calendar: {total:,} contributions on {len(expected)} of {len(days)} days')
+    print(f'   rest: {calls["rest"]} calls, {rest_time:.2f} s')
+    print(f'graphql: {graphql_calls} call, {graphql_time:.2f} s')
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
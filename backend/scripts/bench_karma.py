@@ -0,0 +1,138 @@
+"""Benchmark sustained karma events per second with and without coalescing.
+
+Seeds `--users` users into scratch collections of the benchmark database
+and, from `--threads` threads for `--seconds`, records karma events whose
+users follow a skewed popularity (a few mentors get most of the karma).
+The coalesced run records each event in the ledger and lets the
+background flush apply them in bulk; the strict run applies every event
+before moving on, as `?consistency=strict` does. Each run must end with
+every user's karma, and the sum of its `karma_events` day buckets that
+feed the weekly and monthly boards, equal to the deltas it was sent.
+
+A crash check then records events on one ledger, claims a flush on it
+without applying it, abandons both, and has a second ledger recover
+them. Run from the backend directory with a local mongod:
+
+    python scripts/bench_karma.py --mongodb-uri mongodb://127.0.0.1:27017
+"""
+from collections import defaultdict
+import threading
+import argparse
+import random
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymongo import MongoClient
+from utils.karma_ledger import KarmaLedger
+from utils.indexes import INDEXES
+
+
+def reset(db, users):
+    for name in ('karma_users', 'karma_events', 'karma_ledger'):
+        db[name].drop()
+    db.karma_events.create_indexes(INDEXES['karma_events'])
+    db.karma_ledger.create_indexes(INDEXES['karma_ledger'])
+    return db.karma_users.insert_many([{'username': f'user{i}', 'karma_points': 0} for i in range(users)]).inserted_ids
+
+
+def ledger_for(db, **kwargs):
+    return KarmaLedger(users=db.karma_users, events=db.karma_events, ledger=db.karma_ledger, **kwargs)
+
+
+def check(db, sent):
+    """Users whose total or day buckets differ from the deltas they were sent"""
+    days = defaultdict(int)
+    for bucket in db.karma_events.find({}, {'user_id': 1, 'delta': 1}):
+        days[bucket['user_id']] += bucket['delta']
+    wrong = 0
+    for user in db.karma_users.find({}, {'karma_points': 1}):
+        expected = sent.get(user['_id'], 0)
+        wrong += user['karma_points'] != expected or days.get(user['_id'], 0) != expected
+    return wrong
+
+
+def run(db, ids, strict, threads, seconds):
+    ledger = ledger_for(db)
+    weights = [1 / (rank + 1) for rank in range(len(ids))]
+    sent = defaultdict(int)
+    counts = []
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def worker():
+        rng = random.Random()
+        mine = defaultdict(int)
+        count = 0
+        while not stop.is_set():
+            user_id = rng.choices(ids, weights)[0]
+            if strict:
+                ledger.apply_now(user_id, 1)
+            else:
+                ledger.add(user_id, 1)
+            mine[user_id] += 1
+            count += 1
+        with lock:
+            for user_id, delta in mine.items():
+                sent[user_id] += delta
+            counts.append(count)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in workers:
+        thread.join()
+    ledger.flush()
+
+    label = 'strict' if strict else 'coalesced'
+    print(f'{label:>10}: {sum(counts) / seconds:,.0f} events/s, '
+          f'{ledger.stats["writes"]:,} user and bucket writes for {sum(counts):,} events')
+    return check(db, sent)
+
+
+def crash_check(db, ids):
+    dead = ledger_for(db)
+    sent = defaultdict(int)
+    for _ in range(200):
+        user_id = random.choice(ids)
+        dead.add(user_id, 2)
+        sent[user_id] += 2
+    # One flush claimed but never applied, the rest never claimed
+    stalled = dead._take(ids[0])
+    if stalled:
+        dead._claim({'_id': {'$in': stalled}})
+    survivor = ledger_for(db, recovery_seconds=0)
+    survivor.recover()
+    # Recovering twice must not count anything again
+    survivor.recover()
+    wrong = check(db, sent)
+    print(f'   crash: {survivor.stats["recovered"]} flushes recovered, {len(ids) - wrong}/{len(ids)} users exact')
+    return wrong
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mongodb-uri', default='mongodb://127.0.0.1:27017')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    db = MongoClient(args.mongodb_uri).skill_swap_bench
+    wrong = 0
+    for strict in (False, True):
+        ids = reset(db, args.users)
+        wrong += run(db, ids, strict, args.threads, args.seconds)
+    wrong += crash_check(db, reset(db, args.users))
+    if wrong:
+        print(f'FAIL: {wrong} users ended with the wrong karma or day buckets')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
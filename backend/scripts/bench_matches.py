@@ -0,0 +1,99 @@
+"""Benchmark the skill matcher over synthetic users.
+
+Builds the matcher's indexes from `--users` generated users (1M by
+default) whose skills follow a Zipf-like popularity curve over `--skills`
+skill names, then times match queries in each mode and incremental skill
+updates, with `--budget` as the scan budget (0 for exact matching).
+`--check` queries also run without the budget to report how often the
+budgeted top scores equal the exact ones. Needs no database:
+
+    python scripts/bench_matches.py --users 1000000 --budget 1000
+"""
+import argparse
+import resource
+import random
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+from utils.skill_matching import MATCH_MODES, SkillMatcher
+from bench_chat import timed
+
+
+def synthetic_users(count, skills, seed):
+    rng = random.Random(seed)
+    names = [f'skill-{i}' for i in range(skills)]
+    weights = [1 / (rank + 1) for rank in range(skills)]
+
+    def pick():
+        return rng.choices(names, weights, k=rng.randint(1, 5))
+
+    for i in range(count):
+        yield {
+            '_id': ObjectId(),
+            'username': f'user{i}',
+            'skills_offered': pick(),
+            'skills_needed': pick()
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--skills', type=int, default=2_000)
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--runs', type=int, default=2_000)
+    parser.add_argument('--budget', type=int, default=1000, help='scan budget, 0 for exact matching')
+    parser.add_argument('--check', type=int, default=200, help='queries compared with exact matching')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    # The matcher is fed directly, so it never loads from MongoDB
+    matcher = SkillMatcher(sync_seconds=None, scan_budget=args.budget or None)
+    users = list(synthetic_users(args.users, args.skills, args.seed))
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    matcher.rebuild(users)
+    print(f'built indexes for {args.users:,} users in {time.perf_counter() - started:.1f} s: {matcher.stats()}')
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f'peak RSS grew by {(rss_after - rss_before) / 1024:,.0f} MiB while building')
+
+    rng = random.Random(args.seed + 1)
+    found = []
+    for mode in MATCH_MODES:
+        def query():
+            found.append(matcher.matches(str(rng.choice(users)['_id']), mode, args.limit))
+        found.clear()
+        print(f'{mode:>10}: {timed(query, args.runs)}, '
+              f'{sum(len(matches) for matches, _ in found) / len(found):.1f} matches on average, '
+              f'{sum(approximate for _, approximate in found) / len(found):.0%} approximate')
+
+    if args.check and args.budget:
+        budget = matcher.scan_budget
+        for mode in MATCH_MODES:
+            same = 0
+            for _ in range(args.check):
+                user_id = str(rng.choice(users)['_id'])
+                matcher.scan_budget = budget
+                scores = [match['score'] for match in matcher.matches(user_id, mode, args.limit)[0]]
+                matcher.scan_budget = None
+                same += scores == [match['score'] for match in matcher.matches(user_id, mode, args.limit)[0]]
+            print(f'{mode:>10}: top scores exact for {same}/{args.check} users')
+        matcher.scan_budget = budget
+
+    extra = list(synthetic_users(args.runs, args.skills, args.seed + 2))
+
+    def update():
+        user = rng.choice(users)
+        fresh = extra.pop()
+        matcher.apply({'_id': user['_id'], 'skills_offered': fresh['skills_offered'],
+                       'skills_needed': fresh['skills_needed']})
+
+    print(f'    update: {timed(update, args.runs)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Benchmark user listing pages as the users collection grows.
+
+Grows a scratch users collection of the benchmark database through each
+of `--sizes` (1k to 1M by default) and, at every size, times the first
+page, pages resumed from a random keyset cursor deep in the collection
+and, for comparison, the same deep page read with skip() and the old
+unpaginated full listing (only up to `--full-max` users, it gets slow).
+Keyset pages should stay flat while the other two grow with the
+collection. Run from the backend directory with a local mongod:
+
+    python scripts/bench_pagination.py --mongodb-uri mongodb://127.0.0.1:27017
+"""
+import argparse
+import random
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymongo import MongoClient
+from utils.pagination import DEFAULT_PAGE_SIZE, PUBLIC_USER_PROJECTION, keyset_page
+from bench_chat import BATCH_SIZE, timed
+
+SKILLS = ['python', 'react', 'guitar', 'spanish', 'sql', 'design', 'rust', 'chess']
+
+
+def grow(collection, total):
+    count = collection.estimated_document_count()
+    for offset in range(count, total, BATCH_SIZE):
+        collection.insert_many([{
+            'username': f'user{i}',
+            'email': f'user{i}@example.com',
+            'password': 'x' * 60,
+            'skills_offered': random.sample(SKILLS, 2),
+            'skills_needed': random.sample(SKILLS, 2),
+            'karma_points': random.randrange(1000),
+            'github_connected': False
+        } for i in range(offset, min(offset + BATCH_SIZE, total))], ordered=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mongodb-uri', default='mongodb://127.0.0.1:27017')
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000')
+    parser.add_argument('--full-max', type=int, default=100_000, help='largest size to time the full listing at')
+    parser.add_argument('--runs', type=int, default=100)
+    args = parser.parse_args()
+
+    collection = MongoClient(args.mongodb_uri).skill_swap_bench.users
+    collection.drop()
+    limit = DEFAULT_PAGE_SIZE
+
+    for size in sorted(int(size) for size in args.sizes.split(',')):
+        grow(collection, size)
+        # Cursors from the deeper half, where skip() has the most to walk
+        ids = [document['_id'] for document in collection.find({}, {'_id': 1}).sort('_id', 1)]
+        deep = ids[len(ids) // 2:-limit] or ids
+
+        def keyset():
+            keyset_page(collection, {}, PUBLIC_USER_PROJECTION, limit, random.choice(deep))
+
+        def skipped():
+            offset = random.randrange(len(ids) // 2, max(len(ids) - limit, len(ids) // 2 + 1))
+            list(collection.find({}, PUBLIC_USER_PROJECTION).sort('_id', 1).skip(offset).limit(limit))
+
+        print(f'{size:>9,} users')
+        print(f'  first page:  {timed(lambda: keyset_page(collection, {}, PUBLIC_USER_PROJECTION, limit), args.runs)}')
+        print(f'  keyset page: {timed(keyset, args.runs)}')
+        print(f'  skip page:   {timed(skipped, args.runs)}')
+        if size <= args.full_max:
+            print(f'  full list:   {timed(lambda: list(collection.find({})), max(args.runs // 10, 3))}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Measure time to first byte and peak memory of streamed list responses.
+
+Seeds `--messages` chat messages into a scratch collection of the
+benchmark database, then serves the whole collection once per mode, each
+in a fresh Python process so peak RSS belongs to that mode alone:
+buffered (list the cursor and jsonify it, as the routes did before),
+a streamed JSON array and NDJSON through utils.streaming. Reports time to
+the first body chunk, total time, body size and how far peak RSS grew
+while serving. Run from the backend directory with a local mongod:
+
+    python scripts/bench_streaming.py --mongodb-uri mongodb://127.0.0.1:27017
+"""
+import subprocess
+import argparse
+import resource
+import time
+import json
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymongo import MongoClient
+from flask import Flask, jsonify
+from utils.streaming import stream_cursor
+from bench_chat import seed
+
+MODES = ('buffered', 'json', 'ndjson')
+COLLECTION = 'stream_messages'
+
+
+def serve(collection, mode):
+    """Build the response for `mode` and drain its body like a WSGI server"""
+    app = Flask(__name__)
+    with app.test_request_context():
+        started = time.perf_counter()
+        if mode == 'buffered':
+            documents = list(collection.find({}))
+            for document in documents:
+                document['_id'] = str(document['_id'])
+            chunks = iter([jsonify(documents).get_data()])
+        else:
+            chunks = iter(stream_cursor(collection.find({}), mode).response)
+        first = next(chunks)
+        first_byte = time.perf_counter() - started
+        size = len(first) + sum(len(chunk) for chunk in chunks)
+        return {'ttfb_ms': first_byte * 1000, 'total_ms': (time.perf_counter() - started) * 1000, 'bytes': size}
+
+
+def child(mongodb_uri, mode):
+    collection = MongoClient(mongodb_uri).skill_swap_bench[COLLECTION]
+    # Warm the connection so the first byte does not include connecting
+    collection.find_one()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result = serve(collection, mode)
+    result['rss_mib'] = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mongodb-uri', default='mongodb://127.0.0.1:27017')
+    parser.add_argument('--messages', type=int, default=200_000)
+    parser.add_argument('--conversations', type=int, default=100)
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        child(args.mongodb_uri, args.mode)
+        return
+
+    seed(MongoClient(args.mongodb_uri).skill_swap_bench[COLLECTION], args.messages, args.conversations)
+    for mode in MODES:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--mongodb-uri', args.mongodb_uri, '--mode', mode],
+            capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f'{mode:>8}: first byte {result["ttfb_ms"]:,.1f} ms, total {result["total_ms"]:,.0f} ms, '
+              f'{result["bytes"] / 2**20:,.1f} MiB body, peak RSS +{result["rss_mib"]:,.1f} MiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""Replay GitHub push webhooks concurrently and measure ingest throughput.
+
+Seeds `--users` linked users into the configured database, builds
+`--pushes` push payloads per user, and delivers every payload
+`--replays` times at once from `--concurrency` threads through the
+signed POST /api/webhooks/github route. Pushes to one repo are delivered
+in order, a round at a time, as the high-water mark expects. Redeliveries
+and concurrent deliveries of one push must count its commits once, so
+the script checks every user's rollup against the commits it pushed and
+reports deliveries per second. Run from the backend directory with a local mongod:
+
+    python scripts/bench_webhooks.py --mongodb-uri mongodb://127.0.0.1:27017
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import argparse
+import hashlib
+import random
+import hmac
+import json
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WEBHOOK_SECRET = 'bench-webhook-secret'
+SEED_MARKER = 'bench_webhooks_seed'
+
+
+def push_payload(owner, repo, commits, started):
+    return {
+        'ref': 'refs/heads/main',
+        'repository': {
+            'name': repo,
+            'fork': False,
+            'default_branch': 'main',
+            'owner': {'login': owner}
+        },
+        'commits': [{
+            'id': f'{owner}-{repo}-{started.timestamp()}-{i}',
+            'distinct': True,
+            'timestamp': (started + timedelta(minutes=i)).strftime('%Y-%m-%dT%H:%M:%S+00:00'),
+            'author': {'username': owner}
+        } for i in range(commits)]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mongodb-uri', default='mongodb://127.0.0.1:27017')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--repos', type=int, default=3, help='repos per user')
+    parser.add_argument('--pushes', type=int, default=20, help='pushes per user')
+    parser.add_argument('--commits', type=int, default=3, help='commits per push')
+    parser.add_argument('--replays', type=int, default=3, help='deliveries of every push')
+    parser.add_argument('--concurrency', type=int, default=16)
+    args = parser.parse_args()
+
+    os.environ.setdefault('MONGODB_URI', args.mongodb_uri)
+    os.environ['GITHUB_WEBHOOK_SECRET'] = WEBHOOK_SECRET
+    from flask import Flask
+    from routes.webhook_routes import webhook_routes
+    from utils.db_config import users_collection, github_contributions_collection
+    from utils.indexes import INDEXES
+
+    app = Flask(__name__)
+    app.register_blueprint(webhook_routes, url_prefix='/api/webhooks')
+    github_contributions_collection.create_indexes(INDEXES['github_contributions'])
+
+    old_ids = [user['_id'] for user in users_collection.find({SEED_MARKER: True}, {'_id': 1})]
+    github_contributions_collection.delete_many({'user_id': {'$in': old_ids}})
+    users_collection.delete_many({SEED_MARKER: True})
+    owners = [f'hook{i}' for i in range(args.users)]
+    user_ids = users_collection.insert_many([{
+        'username': owner,
+        'email': f'{owner}@example.com',
+        'github_connected': True,
+        'github_username': owner,
+        SEED_MARKER: True
+    } for owner in owners]).inserted_ids
+
+    # Pushes to one repo move forward in time. Rounds keep them in order,
+    # and within a round every delivery of a push races its replays
+    started = datetime.utcnow() - timedelta(days=2)
+    rounds = []
+    for push in range(args.pushes):
+        deliveries = []
+        for owner in owners:
+            payload = push_payload(
+                owner, f'repo{push % args.repos}', args.commits,
+                started + timedelta(minutes=push * args.commits)
+            )
+            deliveries.extend([json.dumps(payload).encode()] * args.replays)
+        random.shuffle(deliveries)
+        rounds.append(deliveries)
+
+    def deliver(body):
+        signature = 'sha256=' + hmac.new(WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+        response = app.test_client().post('/api/webhooks/github', data=body, headers={
+            'Content-Type': 'application/json',
+            'X-GitHub-Event': 'push',
+            'X-Hub-Signature-256': signature
+        })
+        return response.status_code
+
+    statuses = []
+    begun = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for deliveries in rounds:
+            statuses.extend(executor.map(deliver, deliveries))
+    elapsed = time.perf_counter() - begun
+
+    expected = args.pushes * args.commits
+    wrong = 0
+    for user_id in user_ids:
+        rollup = github_contributions_collection.find_one({'user_id': user_id}) or {'days': {}}
+        wrong += sum(rollup['days'].values()) != expected
+
+    github_contributions_collection.delete_many({'user_id': {'$in': user_ids}})
+    users_collection.delete_many({SEED_MARKER: True})
+
+    failed = sum(status != 200 for status in statuses)
+    print(f'{len(statuses):,} deliveries of {args.users * args.pushes:,} pushes in {elapsed:.2f} s: '
+          f'{len(statuses) / elapsed:,.0f} deliveries/s, {failed} failed')
+    print(f'{args.users - wrong}/{args.users} users counted every commit exactly once')
+    return 1 if wrong or failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,162 @@
+"""Check that each user write endpoint makes one round trip to the users collection.
+
+Registers a PyMongo command listener, creates the app against a local
+MongoDB and calls every endpoint that writes a user, with a fake OAuth
+provider and GitHub answering the external calls. Commands are counted
+per endpoint on the thread that served it, so background threads do not
+add to them. Each endpoint must send exactly one command to `users`;
+commands to other collections, such as the karma ledger's own writes,
+are listed next to it. Test users and their karma are removed
+afterwards. Run from the backend directory with a local mongod:
+
+    python scripts/check_round_trips.py --mongodb-uri mongodb://127.0.0.1:27017
+"""
+from collections import Counter
+import threading
+import argparse
+import json
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymongo import MongoClient, monitoring
+from requests.adapters import BaseAdapter
+from requests.models import Response
+
+JWT_SECRET = 'round-trip-check-not-a-real-secret'
+EMAIL_DOMAIN = 'round-trips.example.com'
+GITHUB_LOGIN = 'round-trip-octocat'
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Counts commands per collection sent from the thread being watched"""
+
+    def __init__(self):
+        self.thread = None
+        self.counts = Counter()
+
+    def watch(self):
+        self.thread = threading.get_ident()
+        self.counts = Counter()
+
+    def started(self, event):
+        if threading.get_ident() != self.thread:
+            return
+        target = event.command.get(event.command_name)
+        collection = target if isinstance(target, str) else event.command.get('collection', event.command_name)
+        self.counts[collection] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+class FakeProviders(BaseAdapter):
+    """Answers the Google and GitHub calls the auth endpoints make"""
+
+    ANSWERS = {
+        '/token': {'access_token': 'google-token'},
+        '/oauth2/v2/userinfo': {'email': f'google@{EMAIL_DOMAIN}', 'name': 'Google User', 'id': 'google-1'},
+        '/login/oauth/access_token': {'access_token': 'github-token'},
+        '/user': {'login': GITHUB_LOGIN, 'id': 1, 'email': None},
+        '/user/emails': [{'email': f'github@{EMAIL_DOMAIN}', 'primary': True, 'verified': True}]
+    }
+
+    def send(self, request, **kwargs):
+        path = request.path_url.split('?')[0]
+        response = Response()
+        response.status_code = 200 if path in self.ANSWERS else 404
+        response._content = json.dumps(self.ANSWERS.get(path, {})).encode()
+        response.headers['Content-Type'] = 'application/json'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mongodb-uri', default='mongodb://127.0.0.1:27017')
+    args = parser.parse_args()
+
+    os.environ.update({
+        'MONGODB_URI': args.mongodb_uri,
+        'JWT_SECRET_KEY': JWT_SECRET,
+        'MONGO_ENSURE_INDEXES': 'false',
+        'CHAT_ARCHIVE_ENABLED': 'false'
+    })
+    counter = CommandCounter()
+    # Registered before the app's client exists, so the client reports to it
+    monitoring.register(counter)
+
+    from flask_jwt_extended import create_access_token
+    from app import create_app
+    from utils import http_client
+
+    users = MongoClient(args.mongodb_uri).skill_swap.users
+    test_users = {'email': {'$regex': f'@{EMAIL_DOMAIN}$'}}
+    users.delete_many(test_users)
+
+    fake = FakeProviders()
+    http_client.get_session().mount('https://', fake)
+    http_client.get_session().mount('http://', fake)
+
+    app = create_app()
+    client = app.test_client()
+    failures = 0
+
+    def call(name, method, path, body=None, token=None):
+        nonlocal failures
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        counter.watch()
+        response = client.open(path, method=method, json=body, headers=headers)
+        counts = dict(counter.counts)
+        counter.thread = None
+
+        users_commands = counts.pop('users', 0)
+        ok = response.status_code == 200 and users_commands == 1
+        failures += not ok
+        others = ', '.join(f'{collection} {count}' for collection, count in sorted(counts.items()))
+        print(f"{'ok' if ok else 'FAIL':>4} {name:<22} HTTP {response.status_code}, "
+              f"users {users_commands}{f', also {others}' if others else ''}")
+        return response.get_json()
+
+    try:
+        registered = call('register', 'POST', '/api/auth/register', {
+            'username': 'round-trip', 'email': f'register@{EMAIL_DOMAIN}', 'password': 'round-trip',
+            'skills_offered': ['python'], 'skills_needed': ['guitar']
+        })
+        user_id = registered['user']['_id']
+        with app.app_context():
+            token = create_access_token(identity=user_id)
+
+        call('google callback', 'POST', '/api/auth/google/callback', {'code': 'google-code'})
+        call('github callback', 'POST', '/api/auth/github/callback', {'code': 'github-code'})
+        call('profile update', 'PUT', '/api/users/me', {'bio': 'Teaches Python'}, token)
+        call('user update', 'PUT', f'/api/users/{user_id}', {'bio': 'Learns guitar'}, token)
+        call('skills update', 'PUT', f'/api/users/skills/{user_id}',
+             {'skills_offered': ['python', 'sql'], 'skills_needed': ['guitar']}, token)
+        call('karma', 'PUT', f'/api/users/{user_id}/karma', {'karma_change': 5}, token)
+        call('karma (strict)', 'PUT', f'/api/users/{user_id}/karma?consistency=strict', {'karma_change': 5}, token)
+        call('github link', 'POST', '/api/users/github/link', {'code': 'github-code'}, token)
+    finally:
+        from utils.karma_ledger import karma_ledger
+        karma_ledger.flush()
+        ids = [user['_id'] for user in users.find(test_users, {'_id': 1})]
+        users.database.karma_ledger.delete_many({'user_id': {'$in': ids}})
+        users.database.karma_events.delete_many({'user_id': {'$in': ids}})
+        users.delete_many(test_users)
+
+    if failures:
+        print(f'FAIL: {failures} endpoints did not make exactly one users round trip')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
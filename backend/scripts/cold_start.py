@@ -0,0 +1,109 @@
+"""Measure backend cold start: import cost per module and time to first request.
+
+Runs against local stand-ins only: a throwaway JWT secret, a MongoDB URI
+that defaults to localhost (the probed route never touches the database)
+and no GitHub credentials. Run from the backend directory:
+
+    python scripts/cold_start.py --runs 5 --top 15
+"""
+import argparse
+import statistics
+import subprocess
+import socket
+import sys
+import time
+import os
+import urllib.request
+import urllib.error
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Served without a database or GitHub call, so it times startup alone
+PROBE_PATH = '/api/auth/github'
+
+
+def _env(mongodb_uri):
+    env = dict(os.environ)
+    env.update({
+        'MONGODB_URI': mongodb_uri,
+        'JWT_SECRET_KEY': 'cold-start-benchmark',
+        'MONGO_ENSURE_INDEXES': 'false',
+        'STARTUP_PROFILE': 'true',
+        'PYTHONDONTWRITEBYTECODE': '1'
+    })
+    return env
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def import_costs(env, top):
+    """Cumulative import time, in ms, of the modules `import wsgi` pulls in"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import wsgi'],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Two spaces of indent per nesting level
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((depth, int(cumulative) / 1000, name.strip()))
+
+    # Lines are printed children first, so wsgi's subtree is the run of
+    # nested lines right before it; report the modules the app imports
+    end = next(i for i, row in enumerate(rows) if row[2] == 'wsgi' and row[0] == 0)
+    start = end
+    while start > 0 and rows[start - 1][0] > 0:
+        start -= 1
+    costs = [(cost, name) for depth, cost, name in rows[start:end + 1] if depth <= 2]
+    return sorted(costs, reverse=True)[:top]
+
+
+def time_to_first_request(env, timeout):
+    """Seconds from starting gunicorn to the first answered request"""
+    port = _free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--workers', '1', '--bind', f'127.0.0.1:{port}', 'wsgi:app'],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}{PROBE_PATH}', timeout=1):
+                    return time.perf_counter() - started
+            except urllib.error.HTTPError:
+                return time.perf_counter() - started
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.01)
+        raise TimeoutError(f'No response within {timeout}s')
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help='modules to list by import cost')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--mongodb-uri', default='mongodb://127.0.0.1:27017')
+    args = parser.parse_args()
+    env = _env(args.mongodb_uri)
+
+    print('Import cost (cumulative ms):')
+    for cost, name in import_costs(env, args.top):
+        print(f'  {cost:8.1f}  {name}')
+
+    samples = [time_to_first_request(env, args.timeout) * 1000 for _ in range(args.runs)]
+    print(f'Time to first request over {args.runs} runs (ms): '
+          f'min {min(samples):.0f}, median {statistics.median(samples):.0f}, max {max(samples):.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+"""Load test the GitHub activity route against a slow fake GitHub.
+
+Starts a fake GitHub API that answers every call after `--latency`
+seconds, seeds `--users` linked users into a local MongoDB, then, for
+each worker class, starts gunicorn with one worker and fires
+`--concurrency` simultaneous dashboard requests. The number of requests
+the worker kept in flight at once is throughput x latency. Run from the
+backend directory with a local mongod:
+
+    python scripts/load_github.py --mongodb-uri mongodb://127.0.0.1:27017
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import statistics
+import subprocess
+import threading
+import socket
+import sys
+import time
+import os
+import urllib.request
+import urllib.error
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+JWT_SECRET = 'load-test-secret'
+SEED_MARKER = 'load_github_seed'
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_fake_github(latency):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            body = b'[]'
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('X-RateLimit-Limit', '5000')
+            self.send_header('X-RateLimit-Remaining', '5000')
+            self.send_header('X-RateLimit-Reset', str(int(time.time()) + 3600))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    ThreadingHTTPServer.daemon_threads = True
+    ThreadingHTTPServer.request_queue_size = 1024
+    server = ThreadingHTTPServer(('127.0.0.1', _free_port()), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+def seed_users(mongodb_uri, count):
+    """Insert linked users with distinct tokens; returns an access token per user"""
+    from pymongo import MongoClient
+    from flask import Flask
+    from flask_jwt_extended import JWTManager, create_access_token
+
+    users = MongoClient(mongodb_uri).skill_swap.users
+    users.delete_many({SEED_MARKER: True})
+    ids = users.insert_many([{
+        'username': f'load{i}',
+        'email': f'load{i}@example.com',
+        'github_connected': True,
+        'github_username': f'load{i}',
+        'github_access_token': f'load-token-{i}',
+        SEED_MARKER: True
+    } for i in range(count)]).inserted_ids
+
+    app = Flask(__name__)
+    app.config['JWT_SECRET_KEY'] = JWT_SECRET
+    JWTManager(app)
+    with app.app_context():
+        return [create_access_token(identity=str(user_id)) for user_id in ids]
+
+
+def remove_users(mongodb_uri):
+    from pymongo import MongoClient
+    MongoClient(mongodb_uri).skill_swap.users.delete_many({SEED_MARKER: True})
+
+
+def _wait_ready(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/api/auth/github', timeout=1)
+            return
+        except urllib.error.HTTPError:
+            return
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.05)
+    raise TimeoutError('gunicorn did not start')
+
+
+def run(worker_class, tokens, concurrency, env):
+    port = _free_port()
+    env = {**env, 'GUNICORN_WORKER_CLASS': worker_class, 'PORT': str(port)}
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn_config.py', 'wsgi:app'],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        _wait_ready(port)
+
+        def call(token):
+            started = time.perf_counter()
+            request = urllib.request.Request(
+                f'http://127.0.0.1:{port}/api/users/github/activity',
+                headers={'Authorization': f'Bearer {token}'}
+            )
+            try:
+                with urllib.request.urlopen(request, timeout=120) as response:
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                status = e.code
+            return status, time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(call, tokens[:concurrency]))
+        elapsed = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies = sorted(latency for _, latency in results)
+    ok = sum(1 for status, _ in results if status == 200)
+    return {
+        'ok': ok,
+        'elapsed': elapsed,
+        'p50': statistics.median(latencies),
+        'p95': latencies[int(len(latencies) * 0.95) - 1],
+        'throughput': ok / elapsed
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mongodb-uri', default='mongodb://127.0.0.1:27017')
+    parser.add_argument('--latency', type=float, default=0.5, help='seconds per fake GitHub call')
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=4, help='threads of the gthread worker')
+    parser.add_argument('--worker-classes', default='gthread,gevent')
+    args = parser.parse_args()
+
+    fake_github, github_url = start_fake_github(args.latency)
+    tokens = seed_users(args.mongodb_uri, args.concurrency)
+    env = {
+        **os.environ,
+        'MONGODB_URI': args.mongodb_uri,
+        'JWT_SECRET_KEY': JWT_SECRET,
+        'GITHUB_API_URL': github_url,
+        'GUNICORN_WORKERS': '1',
+        'GUNICORN_THREADS': str(args.threads),
+        'MONGO_ENSURE_INDEXES': 'false'
+    }
+    try:
+        for worker_class in args.worker_classes.split(','):
+            result = run(worker_class, tokens, args.concurrency, env)
+            print(f"{worker_class:8} {result['ok']}/{args.concurrency} ok in {result['elapsed']:.1f}s, "
+                  f"p50 {result['p50']:.2f}s, p95 {result['p95']:.2f}s, "
+                  f"{result['throughput']:.1f} req/s, "
+                  f"~{result['throughput'] * args.latency:.0f} requests in flight")
+    finally:
+        remove_users(args.mongodb_uri)
+        fake_github.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Load test the in-memory leaderboard against the old sort per request.
+
+Seeds `--users` users with random karma into a scratch collection of the
+benchmark database. Each phase runs `--concurrency` reader threads for
+`--seconds` while a writer applies `--writes` karma changes per second,
+some of them large drops that push users off the top. The old phase reads
+the top with an unindexed sort of whole documents per request, as the
+route used to; the board phase creates the registry indexes and reads
+utils.leaderboard.Leaderboard, which the writer keeps up to date. After
+the board phase the board must equal the top read back from the
+collection. Run from the backend directory with a local mongod:
+
+    python scripts/load_leaderboard.py --mongodb-uri mongodb://127.0.0.1:27017
+"""
+import statistics
+import threading
+import argparse
+import random
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymongo import MongoClient, ReturnDocument
+from utils.leaderboard import LEADERBOARD_PROJECTION, Leaderboard, _entry
+from utils.indexes import INDEXES
+from bench_chat import BATCH_SIZE
+
+
+def seed(collection, total):
+    collection.drop()
+    for offset in range(0, total, BATCH_SIZE):
+        collection.insert_many([{
+            'username': f'user{i}',
+            'email': f'user{i}@example.com',
+            'password': 'x' * 60,
+            'github_access_token': 'x' * 40,
+            'skills_offered': ['python', 'react'],
+            'skills_needed': ['guitar'],
+            'karma_points': int(random.paretovariate(1.5) * 10)
+        } for i in range(offset, min(offset + BATCH_SIZE, total))], ordered=False)
+
+
+def run_phase(read, write, concurrency, seconds, writes):
+    samples = []
+    stop = threading.Event()
+
+    def reader():
+        mine = []
+        while not stop.is_set():
+            started = time.perf_counter()
+            read()
+            mine.append((time.perf_counter() - started) * 1000)
+        samples.extend(mine)
+
+    def writer():
+        while not stop.is_set():
+            write()
+            time.sleep(1 / writes)
+
+    threads = [threading.Thread(target=reader) for _ in range(concurrency)]
+    if writes:
+        threads.append(threading.Thread(target=writer))
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    samples.sort()
+    return (f'{len(samples) / seconds:,.0f} reads/s, p50 {statistics.median(samples):.2f} ms, '
+            f'p95 {samples[int(len(samples) * 0.95) - 1]:.2f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mongodb-uri', default='mongodb://127.0.0.1:27017')
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--writes', type=float, default=200, help='karma changes per second')
+    args = parser.parse_args()
+
+    collection = MongoClient(args.mongodb_uri).skill_swap_bench.leaderboard_users
+    seed(collection, args.users)
+    ids = [user['_id'] for user in collection.find({}, {'_id': 1})]
+    board = Leaderboard(collection=collection)
+
+    def change_karma(apply):
+        # Mostly small gains; now and then a top user loses most of it
+        if random.random() < 0.1:
+            top = collection.find_one({}, {'_id': 1}, sort=[('karma_points', -1)])
+            user_id, delta = top['_id'], -random.randrange(100, 10_000)
+        else:
+            user_id, delta = random.choice(ids), random.randrange(1, 50)
+        updated = collection.find_one_and_update(
+            {'_id': user_id}, {'$inc': {'karma_points': delta}},
+            projection=LEADERBOARD_PROJECTION, return_document=ReturnDocument.AFTER
+        )
+        apply(updated)
+
+    def old_top():
+        users = list(collection.find({}).sort('karma_points', -1).limit(10))
+        return [{**user, '_id': str(user['_id'])} for user in users]
+
+    print(f'old sort per request: {run_phase(old_top, lambda: change_karma(lambda user: None), args.concurrency, args.seconds, args.writes)}')
+
+    collection.create_indexes(INDEXES['users'])
+    board.top()
+    print(f'in-memory board:      {run_phase(board.top, lambda: change_karma(board.apply), args.concurrency, args.seconds, args.writes)}')
+
+    expected = [
+        _entry(user) for user in
+        collection.find({}, LEADERBOARD_PROJECTION).sort([('karma_points', -1), ('_id', 1)]).limit(board.size)
+    ]
+    _, entries = board.top()
+    if entries != expected:
+        print('FAIL: the board differs from the collection after the load')
+        return 1
+    print('board matches the collection after the load')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
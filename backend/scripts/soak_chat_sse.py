@@ -0,0 +1,133 @@
+"""Soak test chat push: concurrent SSE subscribers and delivery latency.
+
+Opens `--subscribers` Server-Sent Events connections to a running backend
+(one conversation each, spread over `--conversations`), keeps them open,
+then sends `--messages` messages and measures how long each takes to
+reach every subscriber of its conversation. Subscribers are plain
+non-blocking sockets on one selector, so the client side is not the
+bottleneck. Subscribers stream and send as one soak user, with a token
+signed by `--jwt-secret`, which must be the server's JWT_SECRET_KEY. Start the
+server first, e.g. one gevent worker allowed that many streams:
+
+    GUNICORN_WORKERS=1 GUNICORN_WORKER_CLASS=gevent CHAT_MAX_STREAMS=2000 gunicorn -c gunicorn_config.py wsgi:app
+    python scripts/soak_chat_sse.py --base-url http://127.0.0.1:10000 --subscribers 2000
+"""
+from urllib.parse import urlsplit
+import argparse
+import selectors
+import statistics
+import socket
+import json
+import time
+import os
+import urllib.request
+
+# skill_routes paths already start with /api and the blueprint adds another
+CHAT_PATH = '/api/api/chat'
+SOAK_USER = 'soak'
+
+
+def soak_token(secret):
+    from flask import Flask
+    from flask_jwt_extended import JWTManager, create_access_token
+
+    app = Flask(__name__)
+    app.config['JWT_SECRET_KEY'] = secret
+    JWTManager(app)
+    with app.app_context():
+        return create_access_token(identity=SOAK_USER)
+
+
+def conversation(i, conversations):
+    # Direct conversations of the soak user, so its token may stream them
+    return f'{SOAK_USER}:peer-{i % conversations}'
+
+
+def open_subscriber(host, port, conversation_id, token):
+    sock = socket.create_connection((host, port))
+    sock.sendall((
+        f'GET {CHAT_PATH}/stream?conversation={conversation_id}&jwt={token} HTTP/1.0\r\n'
+        f'Host: {host}\r\nAccept: text/event-stream\r\n\r\n'
+    ).encode())
+    sock.setblocking(False)
+    return sock
+
+
+def send(base_url, conversation_id, sent_at, token):
+    body = json.dumps({'conversation_id': conversation_id, 'message': f'soak {sent_at}'}).encode()
+    request = urllib.request.Request(
+        f'{base_url}{CHAT_PATH}', data=body,
+        headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'}
+    )
+    urllib.request.urlopen(request, timeout=30).read()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--base-url', default='http://127.0.0.1:10000')
+    parser.add_argument('--subscribers', type=int, default=1000)
+    parser.add_argument('--conversations', type=int, default=10)
+    parser.add_argument('--messages', type=int, default=50)
+    parser.add_argument('--interval', type=float, default=0.2, help='seconds between messages')
+    parser.add_argument('--jwt-secret', default=os.getenv('JWT_SECRET_KEY'))
+    args = parser.parse_args()
+    if not args.jwt_secret:
+        parser.error('--jwt-secret or JWT_SECRET_KEY is required')
+    token = soak_token(args.jwt_secret)
+
+    url = urlsplit(args.base_url)
+    selector = selectors.DefaultSelector()
+    opened = 0
+    for i in range(args.subscribers):
+        try:
+            sock = open_subscriber(url.hostname, url.port or 80, conversation(i, args.conversations), token)
+        except OSError as e:
+            print(f'stopped opening subscribers at {opened}: {e}')
+            break
+        selector.register(sock, selectors.EVENT_READ, data=bytearray())
+        opened += 1
+    print(f'{opened} subscribers connected')
+    time.sleep(1)
+
+    latencies = []
+    closed = 0
+    next_send = time.monotonic()
+    sent = 0
+    deadline = None
+    while True:
+        now = time.monotonic()
+        if sent < args.messages and now >= next_send:
+            send(args.base_url, conversation(sent, args.conversations), time.time(), token)
+            sent += 1
+            next_send = now + args.interval
+            if sent == args.messages:
+                deadline = now + 5
+        if deadline and now > deadline:
+            break
+        for key, _ in selector.select(timeout=0.05):
+            chunk = key.fileobj.recv(65536)
+            if not chunk:
+                selector.unregister(key.fileobj)
+                closed += 1
+                continue
+            buffer = key.data
+            buffer.extend(chunk)
+            received_at = time.time()
+            *lines, rest = bytes(buffer).split(b'\n')
+            buffer[:] = rest
+            for line in lines:
+                if line.startswith(b'data: '):
+                    message = json.loads(line[len(b'data: '):])
+                    latencies.append(received_at - float(message['message'].split(' ', 1)[1]))
+
+    expected = sent * (opened // args.conversations)
+    print(f'{len(latencies)}/{expected} deliveries, {closed} subscribers dropped')
+    if latencies:
+        latencies.sort()
+        print(f'delivery latency p50 {statistics.median(latencies) * 1000:.1f} ms, '
+              f'p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f} ms, '
+              f'max {latencies[-1] * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Index registry checks against a real MongoDB.
+
+Runs against MONGODB_TEST_URI (a local mongod by default) in a scratch
+database that is dropped afterwards, and is skipped when no server
+answers. Run from the backend directory:
+
+    python -m pytest tests
+"""
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import ServerSelectionTimeoutError
+from utils.indexes import (
+    INDEXES, KARMA_EVENT_RETENTION_DAYS, collection_scans, ensure_indexes, missing_required_indexes
+)
+
+MONGODB_TEST_URI = os.getenv('MONGODB_TEST_URI', 'mongodb://127.0.0.1:27017')
+TEST_DATABASE = 'skill_swap_test_indexes'
+
+
+@pytest.fixture
+def db():
+    client = MongoClient(MONGODB_TEST_URI, serverSelectionTimeoutMS=1000)
+    try:
+        client.admin.command('ping')
+    except ServerSelectionTimeoutError:
+        pytest.skip(f'no MongoDB at {MONGODB_TEST_URI}')
+    client.drop_database(TEST_DATABASE)
+    yield client[TEST_DATABASE]
+    client.drop_database(TEST_DATABASE)
+    client.close()
+
+
+def test_route_queries_use_an_index(db):
+    ensure_indexes(db)
+    assert collection_scans(db) == []
+
+
+def test_registry_is_idempotent(db):
+    ensure_indexes(db)
+    ensure_indexes(db)
+    for collection, indexes in INDEXES.items():
+        names = set(db[collection].index_information())
+        assert {index.document['name'] for index in indexes} <= names
+
+
+def test_registry_applies_over_indexes_created_before_it(db):
+    # What the leaderboard's lazy create_index calls left on existing deployments
+    db.users.create_index([('karma_points', -1), ('_id', 1)])
+    db.users.create_index('email', unique=True)
+    db.karma_events.create_index([('user_id', 1), ('day', 1)], unique=True)
+    db.karma_events.create_index('day', expireAfterSeconds=KARMA_EVENT_RETENTION_DAYS * 86400)
+
+    ensure_indexes(db)
+    assert collection_scans(db) == []
+
+
+def test_one_failing_index_does_not_stop_the_others(db):
+    # Duplicate emails left by the old find-then-insert sign-ups
+    db.users.insert_many([{'email': 'twice@example.com'}, {'email': 'twice@example.com'}])
+
+    assert ensure_indexes(db) == [('users', 'email_1')]
+    assert missing_required_indexes(db) == [('users', 'email_1')]
+    assert 'user_id_1_day_1' in db.karma_events.index_information()
+    assert 'user_id_unique' in db.github_contributions.index_information()
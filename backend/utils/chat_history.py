@@ -0,0 +1,150 @@
+from models.message import GENERAL_CONVERSATION
+from utils.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from bson import ObjectId
+from bson.errors import InvalidId
+from datetime import datetime, timedelta
+import base64
+import struct
+
+# Messages are ordered by (timestamp, _id) within a conversation, which is
+# what the conversation_timestamp index covers
+HISTORY_SORT = [('timestamp', 1), ('_id', 1)]
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _cursor(timestamp, message_id):
+    millis = (timestamp - _EPOCH) // timedelta(milliseconds=1)
+    raw = struct.pack('>q', millis) + message_id.binary
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def encode_position(message):
+    """Opaque cursor for a message's place in its conversation"""
+    return _cursor(message['timestamp'], message['_id'])
+
+
+def decode_position(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        millis, = struct.unpack('>q', raw[:8])
+        return _EPOCH + timedelta(milliseconds=millis), ObjectId(raw[8:])
+    except (InvalidId, ValueError, TypeError, struct.error):
+        raise ValueError('Invalid cursor')
+
+
+def conversation_query(conversation_id):
+    if conversation_id == GENERAL_CONVERSATION:
+        # Messages stored before conversations existed have no conversation_id
+        return {'conversation_id': {'$in': [GENERAL_CONVERSATION, None]}}
+    return {'conversation_id': conversation_id}
+
+
+def requested_conversation(args):
+    return args.get('conversation', GENERAL_CONVERSATION)
+
+
+def is_member(conversation_id, user_id):
+    """Whether a user may read a conversation: general, or a direct one naming them"""
+    if conversation_id == GENERAL_CONVERSATION:
+        return True
+    return str(user_id) in conversation_id.split(':')
+
+
+def _beyond(position, direction):
+    timestamp, message_id = position
+    op = '$gt' if direction > 0 else '$lt'
+    return {'$or': [
+        {'timestamp': {op: timestamp}},
+        {'timestamp': timestamp, '_id': {op: message_id}}
+    ]}
+
+
+def parse_history_args(store, args):
+    """Read conversation, limit and one of before/after/since_id; raises ValueError"""
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    conversation_id = requested_conversation(args)
+
+    before, after, since_id = args.get('before'), args.get('after'), args.get('since_id')
+    if sum(1 for value in (before, after, since_id) if value) > 1:
+        raise ValueError('Use only one of before, after and since_id')
+    if since_id:
+        try:
+            since = store.find(conversation_id, ObjectId(since_id))
+        except (InvalidId, TypeError):
+            raise ValueError('Invalid since_id')
+        if not since:
+            raise ValueError('Unknown since_id')
+        after = encode_position(since)
+
+    return (
+        conversation_id,
+        limit,
+        decode_position(before) if before else None,
+        decode_position(after) if after else None
+    )
+
+
+def page_cursors(messages, after=None):
+    """The `before` and `after` cursors to continue from a page of messages"""
+    return {
+        'before': encode_position(messages[0]) if messages else None,
+        # An empty poll keeps the client where it was
+        'after': encode_position(messages[-1]) if messages else (_cursor(*after) if after else None)
+    }
+
+
+def history_page(collection, conversation_id, limit, before=None, after=None):
+    """Fetch one page of a conversation, oldest message first.
+
+    With `after` the page holds the messages right after that position
+    (what a polling client asks for), with `before` the ones right before
+    it, and with neither the latest messages. Returns the messages, the
+    `before` and `after` cursors to continue from and whether more
+    messages exist past the page in the direction it was read.
+    """
+    query = conversation_query(conversation_id)
+    if after:
+        query = {**query, **_beyond(after, 1)}
+        messages = list(collection.find(query).sort(HISTORY_SORT).limit(limit + 1))
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+    else:
+        if before:
+            query = {**query, **_beyond(before, -1)}
+        newest_first = [(field, -1) for field, _ in HISTORY_SORT]
+        messages = list(collection.find(query).sort(newest_first).limit(limit + 1))
+        has_more = len(messages) > limit
+        messages = messages[:limit][::-1]
+
+    return messages, page_cursors(messages, after), has_more
+
+
+class MessageStore:
+    """Chat messages stored one document each in the messages collection"""
+
+    # Change stream events that carry new messages; see messages_from_change
+    watch_pipeline = [{'$match': {'operationType': 'insert'}}]
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def append(self, document):
+        """Store a message; sets its `_id`"""
+        self.collection.insert_one(document)
+
+    def find(self, conversation_id, message_id):
+        return self.collection.find_one({'_id': message_id}, {'timestamp': 1})
+
+    def page(self, conversation_id, limit, before=None, after=None):
+        return history_page(self.collection, conversation_id, limit, before, after)
+
+    def export(self, conversation_id):
+        """Cursor over a whole conversation, oldest first"""
+        return self.collection.find(conversation_query(conversation_id)).sort(HISTORY_SORT)
+
+    def messages_from_change(self, change):
+        return [change['fullDocument']]
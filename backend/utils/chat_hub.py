@@ -0,0 +1,191 @@
+from utils.chat_history import MAX_PAGE_SIZE, encode_position
+from utils.message_store import message_store
+from utils.streaming import to_json
+from utils.serving import ASYNC_WORKER, GUNICORN_THREADS, GUNICORN_WORKER_CONNECTIONS
+from models.message import GENERAL_CONVERSATION
+from pymongo.errors import OperationFailure, PyMongoError
+from collections import defaultdict
+import threading
+import queue
+import time
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Messages a subscriber may fall behind by before it is disconnected; the
+# client reconnects with its last event id and catches up from history
+CHAT_SUBSCRIBER_QUEUE_SIZE = int(os.getenv('CHAT_SUBSCRIBER_QUEUE_SIZE', '100'))
+# 'auto' tails a change stream when the deployment supports one and falls
+# back to the in-process broker otherwise; 'local' never tries
+CHAT_HUB_SOURCE = os.getenv('CHAT_HUB_SOURCE', 'auto')
+CHAT_HUB_RETRY_SECONDS = float(os.getenv('CHAT_HUB_RETRY_SECONDS', '2'))
+# Comment lines sent on idle streams so proxies keep the connection open
+CHAT_SSE_HEARTBEAT_SECONDS = float(os.getenv('CHAT_SSE_HEARTBEAT_SECONDS', '15'))
+# Streams one worker keeps open at once; more are refused with a 503. An
+# open stream holds a gthread worker's thread for as long as it lasts, so
+# by default half the threads stay free for other requests. Under gevent a
+# stream only holds a greenlet and a connection
+CHAT_MAX_STREAMS = int(os.getenv(
+    'CHAT_MAX_STREAMS',
+    str(GUNICORN_WORKER_CONNECTIONS // 2 if ASYNC_WORKER else max(GUNICORN_THREADS // 2, 1))
+))
+
+
+class Subscription:
+    """One client's queue of new messages for a conversation"""
+
+    def __init__(self, conversation_id):
+        self.conversation_id = conversation_id
+        self.queue = queue.Queue(maxsize=CHAT_SUBSCRIBER_QUEUE_SIZE)
+        self.overflowed = False
+
+    def offer(self, message):
+        """Queue a message; returns False once the subscriber has fallen too far behind"""
+        if self.overflowed:
+            return False
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except queue.Full:
+            self.overflowed = True
+            return False
+
+    def get(self, timeout):
+        """Next message, or None when `timeout` passes without one"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class ChatHub:
+    """Fans new chat messages out to this worker's subscribers.
+
+    Messages come from a change stream on the message store's collection, so every
+    worker sees messages sent through any other worker. Deployments without
+    change streams (a standalone mongod) fall back to publishing the
+    messages this worker inserts itself.
+    """
+
+    def __init__(self, source=CHAT_HUB_SOURCE, max_streams=CHAT_MAX_STREAMS):
+        self.local = source == 'local'
+        self.max_streams = max_streams
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+        self._tailer_pid = None
+        self.stats = {'subscribers': 0, 'delivered': 0, 'overflowed': 0, 'refused': 0}
+
+    def subscribe(self, conversation_id):
+        """Open a subscription, or return None when max_streams are already open"""
+        self._ensure_tailer()
+        subscription = Subscription(conversation_id)
+        with self._lock:
+            if self.stats['subscribers'] >= self.max_streams:
+                self.stats['refused'] += 1
+                return None
+            self._subscribers[conversation_id].add(subscription)
+            self.stats['subscribers'] += 1
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.conversation_id)
+            if subscribers and subscription in subscribers:
+                subscribers.discard(subscription)
+                self.stats['subscribers'] -= 1
+                if not subscribers:
+                    del self._subscribers[subscription.conversation_id]
+
+    def publish(self, message):
+        conversation_id = message.get('conversation_id') or GENERAL_CONVERSATION
+        with self._lock:
+            subscribers = list(self._subscribers.get(conversation_id, ()))
+        for subscription in subscribers:
+            if subscription.offer(message):
+                self.stats['delivered'] += 1
+            else:
+                self.stats['overflowed'] += 1
+
+    def message_sent(self, message):
+        """Called after this worker stores a message"""
+        if self.local:
+            self.publish(message)
+
+    def _ensure_tailer(self):
+        # The tailing thread does not survive a fork; each worker runs its own
+        if self.local or self._tailer_pid == os.getpid():
+            return
+        with self._lock:
+            if self._tailer_pid != os.getpid():
+                self._tailer_pid = os.getpid()
+                threading.Thread(target=self._tail, name='chat-hub', daemon=True).start()
+
+    def _tail(self):
+        resume_token = None
+        while True:
+            try:
+                collection = message_store.collection
+                with collection.watch(message_store.watch_pipeline, resume_after=resume_token) as stream:
+                    logger.info(f"Chat hub tailing the {collection.name} change stream")
+                    for change in stream:
+                        resume_token = stream.resume_token
+                        for message in message_store.messages_from_change(change):
+                            self.publish(message)
+            except OperationFailure as e:
+                if e.code == 286:
+                    # The oplog moved past our resume point; clients catch up on reconnect
+                    resume_token = None
+                elif e.code in (40573, 40324) or 'replica set' in str(e).lower():
+                    # Change streams need a replica set; push what this worker stores
+                    logger.warning("Change streams unavailable, chat hub using the local broker")
+                    self.local = True
+                    return
+                else:
+                    logger.error(f"Chat change stream failed, retrying: {str(e)}")
+            except PyMongoError as e:
+                logger.error(f"Chat change stream failed, retrying: {str(e)}")
+            time.sleep(CHAT_HUB_RETRY_SECONDS)
+
+
+chat_hub = ChatHub()
+
+
+def _event(message):
+    return f'id: {encode_position(message)}\ndata: {to_json(message)}\n\n'
+
+
+def sse_stream(subscription, conversation_id, after=None):
+    """Server-Sent Events for a subscription, starting after position `after`.
+
+    Messages stored after `after` are replayed from history first; the
+    subscription was opened before that read, so nothing sent in between is
+    lost, and live messages at or before the last one sent are skipped.
+    Each event id is the message's history cursor, so a reconnecting
+    client's Last-Event-ID resumes exactly where it stopped.
+    """
+    try:
+        last = after
+        yield ': connected\n\n'
+        if after:
+            has_more = True
+            while has_more:
+                messages, _, has_more = message_store.page(
+                    conversation_id, MAX_PAGE_SIZE, after=last
+                )
+                for message in messages:
+                    last = (message['timestamp'], message['_id'])
+                    yield _event(message)
+
+        while not subscription.overflowed:
+            message = subscription.get(timeout=CHAT_SSE_HEARTBEAT_SECONDS)
+            if message is None:
+                yield ': keepalive\n\n'
+                continue
+            position = (message['timestamp'], message['_id'])
+            if last and position <= last:
+                continue
+            last = position
+            yield _event(message)
+    finally:
+        chat_hub.unsubscribe(subscription)
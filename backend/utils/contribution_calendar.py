@@ -0,0 +1,128 @@
+from array import array
+from bisect import bisect_left
+from datetime import date, timedelta
+import base64
+import math
+import sys
+
+CALENDAR_DAYS = 365
+
+
+def day_counts(counts_by_day, end=None, days=CALENDAR_DAYS):
+    """Pack {'YYYY-MM-DD': count} into a day-indexed array ending at `end`.
+
+    Slot 0 is `end - days`, the last slot is `end` itself; days outside the
+    window are dropped.
+    """
+    end = end or date.today()
+    start = end - timedelta(days=days)
+    counts = array('I', bytes(4 * (days + 1)))
+    first = start.toordinal()
+    for day, count in counts_by_day.items():
+        index = date.fromisoformat(day).toordinal() - first
+        if 0 <= index <= days:
+            counts[index] += count
+    return start, counts
+
+
+def streaks(counts):
+    """Return (current_streak, longest_streak) of consecutive active days.
+
+    The current streak still counts when today has no commits yet.
+    """
+    active = bytes(1 if count else 0 for count in counts)
+    longest = max(map(len, active.split(b'\x00')), default=0)
+    if active.endswith(b'\x00'):
+        active = active[:-1]
+    current = len(active) - len(active.rstrip(b'\x01'))
+    return current, longest
+
+
+def longest_streak(counts_by_day, end=None):
+    """Longest run of consecutive active days in the year ending at `end`"""
+    return streaks(day_counts(counts_by_day, end)[1])[1]
+
+
+def contribution_levels(max_contributions):
+    """Level thresholds at the quarters of the busiest day (similar to GitHub)"""
+    if max_contributions <= 0:
+        return []
+    return [
+        0,
+        math.ceil(max_contributions / 4),
+        math.ceil(max_contributions / 2),
+        math.ceil(3 * max_contributions / 4),
+        max_contributions
+    ]
+
+
+def build_calendar(counts_by_day, end=None, days=CALENDAR_DAYS):
+    """Compute the contributions heatmap for the year ending at `end`.
+
+    Weeks start on Sunday like GitHub's calendar, so the first and last
+    week can be partial. Every day of the window is included, with or
+    without commits.
+    """
+    start, counts = day_counts(counts_by_day, end, days)
+    total = sum(counts)
+    max_contributions = max(counts)
+    current_streak, longest_streak = streaks(counts)
+    levels = contribution_levels(max_contributions)
+
+    # One lookup per distinct count instead of a threshold scan per day
+    level_of = [bisect_left(levels, count) for count in range(max_contributions + 1)] if levels else [0]
+    first = start.toordinal()
+    lead = (start.weekday() + 1) % 7  # days between Sunday and the first slot
+
+    weeks = []
+    months = []
+    for week_start in range(-lead, len(counts), 7):
+        week = []
+        for index in range(max(week_start, 0), min(week_start + 7, len(counts))):
+            count = counts[index]
+            week.append({
+                'date': date.fromordinal(first + index).isoformat(),
+                'count': count,
+                'level': level_of[count]
+            })
+        weeks.append(week)
+
+        month = date.fromordinal(first + max(week_start, 0)).strftime('%b')
+        if not months or months[-1] != month:
+            months.append(month)
+
+    return {
+        'total_contributions': total,
+        'contributions_by_week': weeks,
+        'longest_streak': longest_streak,
+        'current_streak': current_streak,
+        'max_contributions': max_contributions,
+        'contribution_levels': levels,
+        'months': months
+    }
+
+
+def compact_calendar(counts_by_day, end=None, days=CALENDAR_DAYS):
+    """Compact heatmap payload: one little-endian uint16 per day, base64 encoded.
+
+    Day `i` of `counts` is `start + i days`; clients derive levels from
+    `contribution_levels` the same way build_calendar does.
+    """
+    start, counts = day_counts(counts_by_day, end, days)
+    packed = array('H', (min(count, 0xFFFF) for count in counts))
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    current_streak, longest_streak = streaks(counts)
+    max_contributions = max(counts)
+
+    return {
+        'start': start.isoformat(),
+        'days': len(counts),
+        'encoding': 'uint16le-base64',
+        'counts': base64.b64encode(packed.tobytes()).decode('ascii'),
+        'total_contributions': sum(counts),
+        'longest_streak': longest_streak,
+        'current_streak': current_streak,
+        'max_contributions': max_contributions,
+        'contribution_levels': contribution_levels(max_contributions)
+    }
@@ -1,47 +1,184 @@
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
-import certifi
+from pymongo import MongoClient, monitoring
+from utils.serving import WORKER_CONCURRENCY
+import threading
+import time
 import os
+import logging
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-# Initialize collections as None
-db = None
-users_collection = None
-skills_collection = None
-messages_collection = None
-
-try:
-    # Get MongoDB URI from environment variable
-    connection_string = os.getenv('MONGODB_URI')
-    if not connection_string:
-        raise ValueError("MONGODB_URI not found in environment variables")
-
-    # Initialize MongoDB client
-    client = MongoClient(
-        connection_string,
-        serverSelectionTimeoutMS=5000,
-        tlsCAFile=certifi.where()
-    )
-    
-    # Test connection
-    client.admin.command('ping')
-    
-    # Initialize database and collections
-    db = client.skill_swap
-    users_collection = db.users
-    skills_collection = db.skills
-    messages_collection = db.messages
-    
-    print("Successfully connected to MongoDB Atlas!")
-
-except Exception as e:
-    print(f"Error connecting to MongoDB: {str(e)}")
-    raise
+logger = logging.getLogger(__name__)
+
+DATABASE_NAME = 'skill_swap'
+# Each gunicorn worker gets its own pool; size it for the requests in flight
+# plus the background threads (karma flushes, cache refreshes) of one worker
+MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', str(WORKER_CONCURRENCY * 2)))
+MONGO_MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', '0'))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv('MONGO_MAX_IDLE_TIME_MS', '60000'))
+# How long a request waits for a free connection before failing
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', '2000'))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000'))
+# zlib needs nothing extra; snappy and zstd need python-snappy / zstandard
+MONGO_COMPRESSORS = os.getenv('MONGO_COMPRESSORS', 'zlib')
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Connection pool checkouts and how long requests waited for them"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.checkout_failures = 0
+            self.wait_ms_total = 0.0
+            self.wait_ms_max = 0.0
+            self.checked_out = 0
+            self.connections_created = 0
+            self.connections_closed = 0
+
+    def _waited(self):
+        started = getattr(self._started, 'at', None)
+        self._started.at = None
+        return (time.perf_counter() - started) * 1000 if started else 0.0
+
+    # Check-out start and result are published on the requesting thread
+    def connection_check_out_started(self, event):
+        self._started.at = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        waited = self._waited()
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.wait_ms_total += waited
+            self.wait_ms_max = max(self.wait_ms_max, waited)
+
+    def connection_check_out_failed(self, event):
+        waited = self._waited()
+        with self._lock:
+            self.checkout_failures += 1
+            self.wait_ms_total += waited
+            self.wait_ms_max = max(self.wait_ms_max, waited)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self.connections_created += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.connections_closed += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def snapshot(self):
+        with self._lock:
+            attempts = self.checkouts + self.checkout_failures
+            return {
+                'max_pool_size': MONGO_MAX_POOL_SIZE,
+                'checked_out': self.checked_out,
+                'checkouts': self.checkouts,
+                'checkout_failures': self.checkout_failures,
+                'wait_ms_avg': round(self.wait_ms_total / attempts, 3) if attempts else 0.0,
+                'wait_ms_max': round(self.wait_ms_max, 3),
+                'connections_open': self.connections_created - self.connections_closed
+            }
+
+
+pool_metrics = PoolMetrics()
+
+
+def get_client():
+    """Return this worker process's MongoClient, creating it on first use.
+
+    Nothing connects at import time, so the app can be preloaded by the
+    gunicorn master; after a fork the worker builds its own client and pool.
+    """
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                # certifi resolves its bundle through importlib.resources,
+                # which is slow enough to keep off the import path
+                import certifi
+
+                connection_string = os.getenv('MONGODB_URI')
+                if not connection_string:
+                    raise ValueError("MONGODB_URI not found in environment variables")
+
+                if _client_pid != os.getpid():
+                    # Counts inherited from the parent describe its pool, not ours
+                    pool_metrics.reset()
+                _client = MongoClient(
+                    connection_string,
+                    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                    maxPoolSize=MONGO_MAX_POOL_SIZE,
+                    minPoolSize=MONGO_MIN_POOL_SIZE,
+                    maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+                    waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                    compressors=MONGO_COMPRESSORS,
+                    event_listeners=[pool_metrics],
+                    tlsCAFile=certifi.where()
+                )
+                _client_pid = os.getpid()
+                logger.debug(f"Created MongoDB client for worker {_client_pid}")
+    return _client
+
 
 def get_db():
-    if not db:
-        raise ConnectionError("Database not initialized")
-    return db
\ No newline at end of file
+    return get_client()[DATABASE_NAME]
+
+
+def ping():
+    """Round trip to the server; raises if it cannot be reached"""
+    get_client().admin.command('ping')
+
+
+class _LazyCollection:
+    """Stands in for a collection until the first operation on it"""
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(get_db()[self._name], attr)
+
+    def __repr__(self):
+        return f'<lazy collection {DATABASE_NAME}.{self._name}>'
+
+
+users_collection = _LazyCollection('users')
+skills_collection = _LazyCollection('skills')
+messages_collection = _LazyCollection('messages')
+message_buckets_collection = _LazyCollection('message_buckets')
+message_archives_collection = _LazyCollection('message_archives')
+github_contributions_collection = _LazyCollection('github_contributions')
+singleflight_locks_collection = _LazyCollection('singleflight_locks')
+karma_events_collection = _LazyCollection('karma_events')
+karma_ledger_collection = _LazyCollection('karma_ledger')
@@ -0,0 +1,227 @@
+from utils.db_config import github_contributions_collection
+from utils.github_fetch import (
+    GITHUB_FETCH_TIME_BUDGET, FetchBudget, fetch_repos, fetch_repo_commits, fetch_all
+)
+from utils.github_graphql import fetch_contribution_calendar
+from utils.singleflight import (
+    SINGLEFLIGHT_DISTRIBUTED, SingleFlight, acquire_worker_lock, release_worker_lock, wait_for_worker_lock
+)
+from datetime import datetime, timedelta
+from functools import partial
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# How long cached contributions are served before they are refreshed from GitHub
+GITHUB_CONTRIBUTIONS_STALE_SECONDS = int(os.getenv('GITHUB_CONTRIBUTIONS_STALE_SECONDS', '900'))
+CONTRIBUTION_WINDOW_DAYS = 365
+# 'rest' crawls repos and their commits, 'graphql' reads the profile calendar in one call
+GITHUB_STATS_BACKEND = os.getenv('GITHUB_STATS_BACKEND', 'rest').strip().lower()
+
+# Dashboards fire the commits and contributions endpoints together
+contribution_flights = SingleFlight('github_contributions')
+
+
+def _window_start(now):
+    return now - timedelta(days=CONTRIBUTION_WINDOW_DAYS)
+
+
+def get_contributions(user, force_refresh=False):
+    """Return the per-day commit counts of the last year for a linked user.
+
+    Counts are read from the `github_contributions` collection and only
+    refreshed from GitHub when they are older than the staleness window or
+    when `force_refresh` is set. Concurrent calls for the same user share
+    one lookup.
+    """
+    return contribution_flights.do(
+        (str(user['_id']), force_refresh), _get_contributions, user, force_refresh
+    )
+
+
+def _read_cache(user):
+    """The user's cached counts; None when cached for another GitHub user or backend"""
+    cached = github_contributions_collection.find_one({'user_id': user['_id']})
+    if cached and (cached.get('github_username') != user.get('github_username')
+                   or cached.get('backend', 'rest') != GITHUB_STATS_BACKEND):
+        return None
+    return cached
+
+
+def _get_contributions(user, force_refresh):
+    cached = _read_cache(user)
+
+    now = datetime.utcnow()
+    is_fresh = (
+        cached is not None
+        and now - cached['synced_at'] < timedelta(seconds=GITHUB_CONTRIBUTIONS_STALE_SECONDS)
+    )
+    if not is_fresh or force_refresh:
+        cached = _refresh_once(user, cached)
+
+    start = _window_start(now).strftime('%Y-%m-%d')
+    return {date: count for date, count in cached['days'].items() if date >= start}
+
+
+def _refresh_once(user, cached):
+    """Refresh the cache, letting only one gunicorn worker crawl GitHub at a time"""
+    refresh = STATS_BACKENDS[GITHUB_STATS_BACKEND]
+    if not SINGLEFLIGHT_DISTRIBUTED:
+        return refresh(user, cached)
+
+    key = f'github_contributions:{user["_id"]}'
+    ttl = GITHUB_FETCH_TIME_BUDGET + 30
+    token = acquire_worker_lock(key, ttl)
+    if token is None:
+        # Another worker is refreshing this user; use what it stores
+        wait_for_worker_lock(key, ttl)
+        refreshed = _read_cache(user)
+        if refreshed and (not cached or refreshed['synced_at'] > cached['synced_at']):
+            return refreshed
+        return refresh(user, cached)
+
+    try:
+        return refresh(user, cached)
+    finally:
+        release_worker_lock(key, token)
+
+
+def refresh_contributions(user, cached=None):
+    """Fetch commits made since the last sync and fold them into the cache.
+
+    Each repo keeps a high-water mark (date of the newest counted commit) and
+    the ETag of its last commits response, so unchanged repos cost a 304.
+    When the fetch budget cuts a repo's history short, the uncounted range
+    is kept as a backfill gap and fetched first on the next refresh. When
+    a repo's fetch failed, the counts are stored without the previous
+    `synced_at`, so the next request refreshes again instead of serving
+    an undercount as fresh.
+    """
+    username = user.get('github_username')
+    headers = {
+        'Authorization': f'token {user["github_access_token"]}',
+        'Accept': 'application/vnd.github.v3+json'
+    }
+    now = datetime.utcnow()
+    window_start = _window_start(now)
+    budget = FetchBudget()
+
+    cached = cached or {'days': {}, 'repos': []}
+    days = dict(cached['days'])
+    # Repo names may contain dots, so states are stored as a list
+    repo_states = {state['name']: state for state in cached['repos']}
+
+    repos = [repo for repo in fetch_repos(username, headers, budget) if not repo['fork']]
+    # Least recently checked repos go first so a tight budget cannot starve them
+    repos.sort(key=lambda repo: repo_states.get(repo['name'], {}).get('checked_at') or datetime.min)
+    calls = []
+    for repo in repos:
+        state = repo_states.get(repo['name'], {})
+        gap = state.get('backfill')
+        if gap:
+            # `since`/`until` are inclusive, the gap bounds are filtered out
+            since = _parse_commit_date(gap['after']) if gap['after'] else window_start
+            calls.append(partial(
+                fetch_repo_commits, username, repo['name'], headers, max(window_start, since),
+                until=_parse_commit_date(gap['before']), after=gap['after'],
+                before=gap['before'], budget=budget
+            ))
+            continue
+
+        high_water = state.get('last_commit_at')
+        since = window_start
+        if high_water:
+            since = max(window_start, _parse_commit_date(high_water))
+        calls.append(partial(
+            fetch_repo_commits, username, repo['name'], headers, since,
+            etag=state.get('etag'), after=high_water, budget=budget
+        ))
+
+    failed = False
+    for repo, result in zip(repos, fetch_all(calls)):
+        if result is None or result['failed']:
+            failed = True
+        if result is None or not result['pages']:
+            continue
+
+        state = dict(repo_states.get(repo['name'], {'name': repo['name']}))
+        state['checked_at'] = now
+        repo_states[repo['name']] = state
+        if result['not_modified']:
+            continue
+
+        for date, count in result['counts'].items():
+            days[date] = days.get(date, 0) + count
+
+        gap = state.get('backfill')
+        if gap:
+            if result['complete']:
+                state.pop('backfill')
+            elif result['first_commit_at']:
+                state['backfill'] = {'after': gap['after'], 'before': result['first_commit_at']}
+        elif result['last_commit_at']:
+            if not result['complete']:
+                state['backfill'] = {
+                    'after': state.get('last_commit_at'),
+                    'before': result['first_commit_at']
+                }
+            state['last_commit_at'] = result['last_commit_at']
+            state['etag'] = result['etag']
+        else:
+            state['etag'] = result['etag']
+
+    # Drop days that fell out of the window so the document stays bounded
+    start = window_start.strftime('%Y-%m-%d')
+    days = {date: count for date, count in days.items() if date >= start}
+
+    document = {
+        'user_id': user['_id'],
+        'github_username': username,
+        'backend': 'rest',
+        'days': days,
+        'repos': list(repo_states.values()),
+        'synced_at': cached.get('synced_at', datetime.min) if failed else now
+    }
+    github_contributions_collection.replace_one({'user_id': user['_id']}, document, upsert=True)
+    return document
+
+
+
+def refresh_contributions_graphql(user, cached=None):
+    """Replace the cached counts with the year from GitHub's contribution calendar"""
+    now = datetime.utcnow()
+    days = fetch_contribution_calendar(
+        user.get('github_username'),
+        user['github_access_token'],
+        _window_start(now),
+        now
+    )
+    document = {
+        'user_id': user['_id'],
+        'github_username': user.get('github_username'),
+        'backend': 'graphql',
+        'days': days,
+        'repos': [],
+        'synced_at': now
+    }
+    github_contributions_collection.replace_one({'user_id': user['_id']}, document, upsert=True)
+    return document
+
+
+STATS_BACKENDS = {
+    'rest': refresh_contributions,
+    'graphql': refresh_contributions_graphql
+}
+
+if GITHUB_STATS_BACKEND not in STATS_BACKENDS:
+    # A typo in the environment should not turn every dashboard into a 500
+    logger.warning(
+        f"Unknown GITHUB_STATS_BACKEND {GITHUB_STATS_BACKEND!r}, "
+        f"expected one of {sorted(STATS_BACKENDS)}; using 'rest'"
+    )
+    GITHUB_STATS_BACKEND = 'rest'
+
+
+def _parse_commit_date(value):
+    return datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ')
@@ -0,0 +1,186 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+from functools import partial
+from utils.github_rate_limit import GitHubRateLimited, github_request
+import threading
+import time
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+GITHUB_API_URL = os.getenv('GITHUB_API_URL', 'https://api.github.com')
+
+# Max parallel commit fetches for a single request
+GITHUB_FETCH_CONCURRENCY = int(os.getenv('GITHUB_FETCH_CONCURRENCY', '8'))
+# Max parallel commit fetches across all request threads of one gunicorn worker
+GITHUB_FETCH_WORKER_CONCURRENCY = int(os.getenv('GITHUB_FETCH_WORKER_CONCURRENCY', '16'))
+# Pages and seconds one request may spend crawling GitHub
+GITHUB_MAX_PAGES = int(os.getenv('GITHUB_MAX_PAGES', '200'))
+GITHUB_FETCH_TIME_BUDGET = float(os.getenv('GITHUB_FETCH_TIME_BUDGET', '60'))
+
+_worker_slots = threading.BoundedSemaphore(GITHUB_FETCH_WORKER_CONCURRENCY)
+
+
+class GitHubTokenExpired(Exception):
+    """Raised when GitHub rejects the stored access token"""
+
+
+class FetchBudget:
+    """Page and wall-clock budget shared by all GitHub calls of one request"""
+
+    def __init__(self, max_pages=None, seconds=None):
+        self.pages_left = max_pages or GITHUB_MAX_PAGES
+        self.deadline = time.monotonic() + (seconds or GITHUB_FETCH_TIME_BUDGET)
+        self.exhausted = False
+        self._lock = threading.Lock()
+
+    def take_page(self):
+        with self._lock:
+            if self.pages_left <= 0 or time.monotonic() >= self.deadline:
+                self.exhausted = True
+                return False
+            self.pages_left -= 1
+            return True
+
+
+def iter_pages(url, headers, params=None, budget=None):
+    """Yield each page response, following GitHub `Link: rel="next"` headers.
+
+    Stops early when the budget runs out; callers can tell from
+    `budget.exhausted`. Any non-200 page is yielded and ends the walk.
+    """
+    budget = budget or FetchBudget()
+    while url:
+        if not budget.take_page():
+            logger.warning(f"GitHub fetch budget exhausted before {url}")
+            return
+        with _worker_slots:
+            response = github_request('GET', url, headers=headers, params=params)
+        yield response
+        if response.status_code != 200:
+            return
+        # The next link already carries the query string
+        url = response.links.get('next', {}).get('url')
+        params = None
+
+
+def fetch_repos(username, headers, budget=None):
+    """Fetch all repositories of a GitHub user"""
+    repos = []
+    for response in iter_pages(
+        f'{GITHUB_API_URL}/users/{username}/repos',
+        headers,
+        params={'per_page': 100},
+        budget=budget
+    ):
+        if response.status_code == 401:
+            raise GitHubTokenExpired()
+        response.raise_for_status()
+        repos.extend(response.json())
+    return repos
+
+
+def fetch_repo_commits(username, repo_name, headers, since, until=None, etag=None,
+                       after=None, before=None, budget=None):
+    """Walk one repo's commits authored by `username`, counting them per day.
+
+    Counts are updated page by page, so memory does not grow with history.
+    When `etag` is given it is sent as If-None-Match, and a 304 answer comes
+    back with `not_modified` set and no counts. Commits dated at or before
+    `after`, or at or after `before` (ISO 8601 strings), are left out.
+    `complete` is False when the budget ran out before the last page, and
+    `failed` is set when GitHub answered a page with an error.
+    """
+    commits_url = f'{GITHUB_API_URL}/repos/{username}/{repo_name}/commits'
+    params = {
+        'author': username,
+        'since': since.isoformat(),
+        'per_page': 100
+    }
+    if until:
+        params['until'] = until.isoformat()
+    if etag:
+        headers = {**headers, 'If-None-Match': etag}
+
+    budget = budget or FetchBudget()
+    result = {
+        'repo': repo_name,
+        'counts': defaultdict(int),
+        'etag': etag,
+        'last_commit_at': None,
+        'first_commit_at': None,
+        'not_modified': False,
+        'complete': False,
+        'failed': False,
+        'pages': 0
+    }
+    for page, response in enumerate(iter_pages(commits_url, headers, params, budget)):
+        result['pages'] += 1
+        if response.status_code == 304:
+            result['not_modified'] = True
+            break
+        if response.status_code == 401:
+            raise GitHubTokenExpired()
+        if not response.ok:
+            result['failed'] = True
+            break
+        if page == 0:
+            result['etag'] = response.headers.get('ETag')
+        # Only the last page lacks a next link; a budget stop leaves this False
+        result['complete'] = 'next' not in response.links
+
+        for commit in response.json():
+            committed_at = commit['commit']['author']['date']
+            if (after and committed_at <= after) or (before and committed_at >= before):
+                continue
+            result['counts'][committed_at[:10]] += 1  # YYYY-MM-DD
+            if not result['last_commit_at'] or committed_at > result['last_commit_at']:
+                result['last_commit_at'] = committed_at
+            if not result['first_commit_at'] or committed_at < result['first_commit_at']:
+                result['first_commit_at'] = committed_at
+    return result
+
+
+def fetch_all(calls, concurrency=None):
+    """Run zero-argument calls in parallel and return their results in order.
+
+    At most `concurrency` calls run at once for this request, and every
+    GitHub page fetch additionally holds one of the worker-wide slots.
+    A rate limit or an expired token is raised to the caller, after
+    cancelling the calls that have not started; other failed calls are
+    logged and come back as None.
+    """
+    if not calls:
+        return []
+
+    max_workers = min(concurrency or GITHUB_FETCH_CONCURRENCY, len(calls))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(call) for call in calls]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except (GitHubRateLimited, GitHubTokenExpired):
+                for pending in futures:
+                    pending.cancel()
+                raise
+            except Exception as e:
+                logger.error(f"Error fetching from GitHub: {str(e)}")
+                results.append(None)
+    return results
+
+
+def fetch_commit_counts(username, headers, repos, since, until, concurrency=None, budget=None):
+    """Fetch commits of all non-fork repos in parallel and merge the per-day counts"""
+    budget = budget or FetchBudget()
+    calls = [
+        partial(fetch_repo_commits, username, repo['name'], headers, since, until, budget=budget)
+        for repo in repos if not repo['fork']
+    ]
+    commit_data = defaultdict(int)
+    for result in fetch_all(calls, concurrency):
+        if result:
+            for date, count in result['counts'].items():
+                commit_data[date] += count
+    return commit_data
@@ -0,0 +1,71 @@
+from utils.github_rate_limit import github_request
+from utils.github_fetch import GITHUB_API_URL, GitHubTokenExpired
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+GITHUB_GRAPHQL_URL = os.getenv('GITHUB_GRAPHQL_URL', f'{GITHUB_API_URL}/graphql')
+
+CONTRIBUTION_CALENDAR_QUERY = '''
+query($login: String!, $from: DateTime!, $to: DateTime!) {
+  user(login: $login) {
+    contributionsCollection(from: $from, to: $to) {
+      contributionCalendar {
+        totalContributions
+        weeks {
+          contributionDays {
+            date
+            contributionCount
+          }
+        }
+      }
+    }
+  }
+}
+'''
+
+
+class GitHubGraphQLError(Exception):
+    """Raised when the GraphQL API answers with errors instead of data"""
+
+
+def fetch_contribution_calendar(username, access_token, since, until):
+    """Fetch per-day contribution counts between `since` and `until` in one call.
+
+    GitHub caps the range at one year. Counts cover every contribution type
+    GitHub puts on the profile calendar, not only commits.
+    """
+    response = github_request(
+        'POST',
+        GITHUB_GRAPHQL_URL,
+        json={
+            'query': CONTRIBUTION_CALENDAR_QUERY,
+            'variables': {
+                'login': username,
+                'from': since.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                'to': until.strftime('%Y-%m-%dT%H:%M:%SZ')
+            }
+        },
+        headers={'Authorization': f'bearer {access_token}'}
+    )
+    if response.status_code == 401:
+        raise GitHubTokenExpired()
+    response.raise_for_status()
+
+    payload = response.json()
+    if payload.get('errors'):
+        logger.error(f"GitHub GraphQL errors: {payload['errors']}")
+        raise GitHubGraphQLError(payload['errors'][0].get('message', 'GraphQL query failed'))
+
+    user = (payload.get('data') or {}).get('user')
+    if not user:
+        raise GitHubGraphQLError(f'GitHub user {username} not found')
+
+    calendar = user['contributionsCollection']['contributionCalendar']
+    return {
+        day['date']: day['contributionCount']
+        for week in calendar['weeks']
+        for day in week['contributionDays']
+        if day['contributionCount']
+    }
@@ -0,0 +1,184 @@
+from collections import OrderedDict
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+from flask import jsonify
+from utils import http_client
+import threading
+import hashlib
+import math
+import time
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Request priorities, lower is more important
+PRIORITY_LOGIN = 0
+PRIORITY_DASHBOARD = 1
+PRIORITY_BACKGROUND = 2
+
+# Share of the hourly limit kept in reserve for more important work; a call
+# is shed once the remaining budget drops to its priority's reserve
+GITHUB_RATE_RESERVE = {
+    PRIORITY_LOGIN: 0.0,
+    PRIORITY_DASHBOARD: float(os.getenv('GITHUB_RATE_DASHBOARD_RESERVE', '0.05')),
+    PRIORITY_BACKGROUND: float(os.getenv('GITHUB_RATE_BACKGROUND_RESERVE', '0.2'))
+}
+# Calls a token may make back to back before pacing kicks in
+GITHUB_RATE_BURST = int(os.getenv('GITHUB_RATE_BURST', '100'))
+# Longest a call may be held back for pacing before it is rejected instead
+GITHUB_RATE_MAX_WAIT = float(os.getenv('GITHUB_RATE_MAX_WAIT', '2'))
+GITHUB_RATE_TRACKED_TOKENS = 1024
+
+
+class GitHubRateLimited(Exception):
+    """Raised when a GitHub call has to wait for the rate limit to reset"""
+
+    def __init__(self, retry_after):
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(f'GitHub rate limit reached, retry after {self.retry_after}s')
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header in either of its forms.
+
+    GitHub sends delta seconds, but the header may also carry an HTTP-date.
+    Returns None when the value is neither.
+    """
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if when.tzinfo is None:
+        # HTTP-dates are always GMT
+        when = when.replace(tzinfo=timezone.utc)
+    return max(when.timestamp() - time.time(), 0.0)
+
+
+class TokenScheduler:
+    """Tracks one token's GitHub budget and paces calls with a token bucket.
+
+    The bucket refills at the rate that spreads the remaining budget evenly
+    until the reset time reported by GitHub. Once that time passes the
+    budget is unknown again until the next response reports it, so calls
+    shed for their priority's reserve go out again after the reset.
+    """
+
+    def __init__(self):
+        self.limit = None
+        self.remaining = None
+        self.reset_at = None
+        self.blocked_until = 0.0
+        self.tokens = float(GITHUB_RATE_BURST)
+        self.refilled_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill_rate(self):
+        if self.remaining is None or not self.reset_at:
+            return float(GITHUB_RATE_BURST)
+        return max(self.remaining, 1) / max(self.reset_at - time.time(), 1.0)
+
+    def _roll_over(self):
+        if self.reset_at and time.time() >= self.reset_at:
+            self.remaining = None
+            self.reset_at = None
+
+    def acquire(self, priority=PRIORITY_DASHBOARD):
+        with self._lock:
+            now = time.monotonic()
+            if self.blocked_until > now:
+                raise GitHubRateLimited(self.blocked_until - now)
+
+            self._roll_over()
+
+            if self.remaining is not None and self.limit:
+                if self.remaining <= self.limit * GITHUB_RATE_RESERVE[priority]:
+                    raise GitHubRateLimited(max((self.reset_at or 0) - time.time(), 1))
+
+            rate = self._refill_rate()
+            self.tokens = min(GITHUB_RATE_BURST, self.tokens + (now - self.refilled_at) * rate)
+            self.refilled_at = now
+            wait = (1 - self.tokens) / rate if self.tokens < 1 else 0.0
+            if wait > GITHUB_RATE_MAX_WAIT:
+                raise GitHubRateLimited(wait)
+            # Reserve the token now so concurrent callers queue up behind it
+            self.tokens -= 1
+            if self.remaining is not None:
+                self.remaining -= 1
+
+        if wait:
+            time.sleep(wait)
+
+    def update(self, response):
+        """Record the budget reported by a GitHub response"""
+        headers = response.headers
+        with self._lock:
+            if 'X-RateLimit-Remaining' in headers:
+                self.limit = int(headers.get('X-RateLimit-Limit', self.limit or 0))
+                self.remaining = int(headers['X-RateLimit-Remaining'])
+                self.reset_at = int(headers.get('X-RateLimit-Reset', 0))
+
+            if response.status_code in (403, 429):
+                retry_after = parse_retry_after(headers.get('Retry-After'))
+                if retry_after is not None:
+                    # Secondary rate limit
+                    self.blocked_until = time.monotonic() + retry_after
+                elif self.remaining == 0 and self.reset_at:
+                    self.blocked_until = time.monotonic() + max(self.reset_at - time.time(), 1)
+
+    def retry_after(self):
+        return max(self.blocked_until - time.monotonic(), 1)
+
+    def is_limited(self, response):
+        return response.status_code in (403, 429) and self.blocked_until > time.monotonic()
+
+
+_schedulers = OrderedDict()
+_schedulers_lock = threading.Lock()
+
+
+def scheduler_for(authorization):
+    """Return the scheduler of the token in an Authorization header"""
+    # 'token X' and 'bearer X' share one budget
+    token = (authorization or '').split(' ')[-1]
+    key = hashlib.sha256(token.encode()).hexdigest()
+    with _schedulers_lock:
+        scheduler = _schedulers.get(key)
+        if scheduler is None:
+            scheduler = _schedulers[key] = TokenScheduler()
+            if len(_schedulers) > GITHUB_RATE_TRACKED_TOKENS:
+                _schedulers.popitem(last=False)
+        else:
+            _schedulers.move_to_end(key)
+        return scheduler
+
+
+def github_request(method, url, headers=None, priority=PRIORITY_DASHBOARD, **kwargs):
+    """Make a GitHub API call paced by the token's scheduler.
+
+    Raises GitHubRateLimited instead of calling GitHub when the call would
+    exceed the budget kept for its priority, or when GitHub itself answers
+    with a rate limit.
+    """
+    scheduler = scheduler_for((headers or {}).get('Authorization'))
+    scheduler.acquire(priority)
+    response = http_client.get_session().request(method, url, headers=headers, **kwargs)
+    scheduler.update(response)
+    if scheduler.is_limited(response):
+        logger.warning(f"GitHub rate limit hit for {url}")
+        raise GitHubRateLimited(scheduler.retry_after())
+    return response
+
+
+def rate_limited_response(error):
+    """Structured 429 for callers, with the standard Retry-After header"""
+    response = jsonify({
+        'error': 'GitHub rate limit reached',
+        'retry_after': error.retry_after
+    })
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 429
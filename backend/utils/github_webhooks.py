@@ -0,0 +1,131 @@
+from utils.db_config import users_collection, github_contributions_collection
+from datetime import datetime, timezone
+from collections import defaultdict
+from pymongo.errors import DuplicateKeyError
+import hashlib
+import hmac
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Retries when concurrent deliveries race on one repo's high-water mark
+INGEST_ATTEMPTS = 5
+
+
+def verify_signature(secret, body, signature_header):
+    """Check GitHub's X-Hub-Signature-256 header against the raw request body"""
+    if not secret or not signature_header or not signature_header.startswith('sha256='):
+        return False
+    expected = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(f'sha256={expected}', signature_header)
+
+
+def _utc_timestamp(value):
+    # Push payloads carry local offsets, the commits API uses UTC 'Z' dates
+    moment = datetime.fromisoformat(value).astimezone(timezone.utc)
+    return moment.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def ingest_push(payload):
+    """Add the commits of a `push` event to the daily rollup of linked users.
+
+    Counts the same commits the REST crawl would: distinct commits on the
+    default branch of a non-fork repo, authored by the repo owner. The repo's
+    high-water mark moves forward so the next crawl, a redelivery or a
+    concurrent delivery of the same push does not count them again.
+    Returns the number of commits added.
+    """
+    repository = payload.get('repository') or {}
+    owner_info = repository.get('owner') or {}
+    owner = owner_info.get('login') or owner_info.get('name')
+    if not owner or repository.get('fork'):
+        return 0
+    if payload.get('ref') != f"refs/heads/{repository.get('default_branch')}":
+        return 0
+
+    timestamps = [
+        _utc_timestamp(commit['timestamp'])
+        for commit in payload.get('commits', [])
+        if commit.get('distinct', True) and (commit.get('author') or {}).get('username') == owner
+    ]
+    if not timestamps:
+        return 0
+
+    user = users_collection.find_one(
+        {'github_username': owner, 'github_connected': True},
+        {'_id': 1}
+    )
+    if not user:
+        return 0
+
+    for _ in range(INGEST_ATTEMPTS):
+        ingested = _ingest_once(user['_id'], owner, repository['name'], timestamps)
+        if ingested is not None:
+            return ingested
+    logger.warning(f"Gave up ingesting a push to {owner}/{repository['name']} after {INGEST_ATTEMPTS} conflicts")
+    return 0
+
+
+def _ingest_once(user_id, owner, repo_name, timestamps):
+    """Count the commits newer than the repo's high-water mark.
+
+    The update only applies while the mark is still the one read here, so
+    concurrent deliveries of the same push cannot both count it. Returns
+    None when another delivery moved the mark first; the caller retries
+    against the new mark.
+    """
+    rollup = github_contributions_collection.find_one(
+        {'user_id': user_id},
+        {'backend': 1, 'repos': 1}
+    )
+    if rollup and rollup.get('backend', 'rest') != 'rest':
+        # The GraphQL calendar already includes pushes
+        return 0
+
+    state = next((s for s in (rollup or {}).get('repos', []) if s['name'] == repo_name), None)
+    high_water = (state or {}).get('last_commit_at')
+    new_timestamps = [ts for ts in timestamps if not high_water or ts > high_water]
+    if not new_timestamps:
+        return 0
+
+    counts = defaultdict(int)
+    for ts in new_timestamps:
+        counts[ts[:10]] += 1
+    increments = {f'days.{date}': count for date, count in counts.items()}
+    newest = max(new_timestamps)
+
+    if state:
+        result = github_contributions_collection.update_one(
+            {
+                'user_id': user_id,
+                'repos': {'$elemMatch': {'name': repo_name, 'last_commit_at': high_water}}
+            },
+            {'$inc': increments, '$set': {'repos.$.last_commit_at': newest}}
+        )
+        return len(new_timestamps) if result.modified_count else None
+
+    # Never crawled: history before this push is left as a backfill gap.
+    # When the rollup already lists the repo the filter misses and the
+    # upsert collides with the unique user_id index instead.
+    try:
+        github_contributions_collection.update_one(
+            {'user_id': user_id, 'repos.name': {'$ne': repo_name}},
+            {
+                '$inc': increments,
+                '$push': {'repos': {
+                    'name': repo_name,
+                    'last_commit_at': newest,
+                    'backfill': {'after': None, 'before': min(new_timestamps)}
+                }},
+                '$setOnInsert': {
+                    'github_username': owner,
+                    'backend': 'rest',
+                    # Stale, so the first read crawls the remaining repos
+                    'synced_at': datetime.min
+                }
+            },
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return None
+    return len(new_timestamps)
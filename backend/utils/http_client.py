@@ -0,0 +1,110 @@
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.exceptions import MaxRetryError
+from utils.serving import WORKER_CONCURRENCY
+import threading
+import requests
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Each request in flight can fan out to several GitHub calls at once
+# (see utils.github_fetch), so pools hold a few connections per request
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', str(WORKER_CONCURRENCY * 4)))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '3.05'))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '15'))
+HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', '3'))
+HTTP_RETRY_BACKOFF = float(os.getenv('HTTP_RETRY_BACKOFF', '0.3'))
+# Longest Retry-After a retry will sleep for; longer waits are left to the caller
+HTTP_MAX_RETRY_AFTER = float(os.getenv('HTTP_MAX_RETRY_AFTER', '5'))
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+class _TimeoutSession(requests.Session):
+    """Session that applies the default connect/read timeouts"""
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+        return super().request(method, url, **kwargs)
+
+
+class _CappedRetry(Retry):
+    """Retry that gives up instead of sleeping through a long Retry-After"""
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        if response is not None and (self.get_retry_after(response) or 0) > HTTP_MAX_RETRY_AFTER:
+            # With raise_on_status off urllib3 hands this response back as-is
+            raise MaxRetryError(_pool, url, error)
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+
+def _build_session():
+    # Only idempotent methods are retried on 429/5xx; a POST (e.g. an OAuth
+    # code exchange) is only retried when the connection could not be made
+    retry = _CappedRetry(
+        total=HTTP_MAX_RETRIES,
+        backoff_factor=HTTP_RETRY_BACKOFF,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=['GET', 'HEAD'],
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_SIZE,
+        pool_maxsize=HTTP_POOL_SIZE,
+        max_retries=retry
+    )
+    session = _TimeoutSession()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session():
+    """Return this worker process's shared keep-alive session.
+
+    The session is created on first use and again after a fork, so
+    connections are never shared between gunicorn workers.
+    """
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        with _session_lock:
+            if _session is None or _session_pid != os.getpid():
+                _session = _build_session()
+                _session_pid = os.getpid()
+                logger.debug(f"Created HTTP session for worker {_session_pid}")
+    return _session
+
+
+def get(url, **kwargs):
+    return get_session().get(url, **kwargs)
+
+
+def post(url, **kwargs):
+    return get_session().post(url, **kwargs)
+
+
+def pool_stats():
+    """Return connection pool counters for every host this worker has called"""
+    if _session is None or _session_pid != os.getpid():
+        return {}
+
+    stats = {}
+    adapter = _session.get_adapter('https://')
+    pools = adapter.poolmanager.pools
+    for key in pools.keys():
+        pool = pools.get(key)
+        if pool is None:
+            continue
+        host = f'{pool.scheme}://{pool.host}:{pool.port}'
+        stats[host] = {
+            'connections_opened': pool.num_connections,
+            'requests': pool.num_requests,
+            'idle_connections': sum(1 for conn in list(pool.pool.queue) if conn) if pool.pool else 0,
+            'max_size': HTTP_POOL_SIZE
+        }
+    return stats
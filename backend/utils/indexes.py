@@ -0,0 +1,235 @@
+"""Index registry for the SkillSwap collections.
+
+Apply the indexes (idempotent) or check that every route query uses one:
+
+    python -m utils.indexes apply
+    python -m utils.indexes check
+
+The app applies them on startup unless MONGO_ENSURE_INDEXES=false. A
+deployment that turns that off must run `apply` first and after every
+change to the registry: some writes rely on the unique indexes in
+REQUIRED_INDEXES and silently double count or duplicate without them.
+"""
+from utils import db_config
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import PyMongoError
+from datetime import datetime
+from bson import ObjectId
+import threading
+import sys
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Create the registry's indexes when the app starts
+MONGO_ENSURE_INDEXES = os.getenv('MONGO_ENSURE_INDEXES', 'true').lower() == 'true'
+KARMA_EVENT_RETENTION_DAYS = int(os.getenv('KARMA_EVENT_RETENTION_DAYS', '35'))
+
+# Indexes that deployments created before this registry existed keep the
+# name create_index generated for them: creating the same keys under
+# another name fails with IndexOptionsConflict
+INDEXES = {
+    'users': [
+        # Login, register and both OAuth callbacks look users up by email
+        IndexModel([('email', ASCENDING)], name='email_1', unique=True),
+        # Leaderboard sort and rank counts; _id breaks karma ties
+        IndexModel([('karma_points', DESCENDING), ('_id', ASCENDING)], name='karma_points_-1__id_1'),
+        IndexModel([('github_username', ASCENDING)], name='github_username', sparse=True),
+        # Skill matcher sync of skill changes saved through other workers
+        IndexModel([('skills_updated_at', ASCENDING)], name='skills_updated_at', sparse=True),
+    ],
+    'messages': [
+        # Chat history pages and polls within one conversation
+        IndexModel(
+            [('conversation_id', ASCENDING), ('timestamp', ASCENDING), ('_id', ASCENDING)],
+            name='conversation_timestamp'
+        ),
+    ],
+    'message_buckets': [
+        # Bucket scans for CHAT_STORAGE=buckets; `start` orders a conversation's
+        # buckets, and the unique key stops two appends opening the same one
+        IndexModel(
+            [('conversation_id', ASCENDING), ('start', ASCENDING), ('seq', ASCENDING)],
+            name='conversation_start_seq', unique=True
+        ),
+    ],
+    'message_archives': [
+        # One stub per archived segment; unique so two archivers cannot both record one
+        IndexModel(
+            [('conversation_id', ASCENDING), ('first_timestamp', ASCENDING), ('first_id', ASCENDING)],
+            name='conversation_first', unique=True
+        ),
+    ],
+    'skills': [
+        IndexModel([('name', ASCENDING)], name='name', sparse=True),
+    ],
+    'karma_events': [
+        IndexModel([('user_id', ASCENDING), ('day', ASCENDING)], name='user_id_1_day_1', unique=True),
+        # Also serves the rolling-window match on day
+        IndexModel(
+            [('day', ASCENDING)], name='day_1',
+            expireAfterSeconds=KARMA_EVENT_RETENTION_DAYS * 86400
+        ),
+    ],
+    'karma_ledger': [
+        # The events of one flush, claimed under its flush id
+        IndexModel([('flush_id', ASCENDING)], name='flush_id'),
+        # Recovery of events a dead worker never applied; applied events stay out of it
+        IndexModel(
+            [('at', ASCENDING)], name='unapplied_at',
+            partialFilterExpression={'applied': False}
+        ),
+    ],
+    'github_contributions': [
+        IndexModel([('user_id', ASCENDING)], name='user_id_unique', unique=True),
+    ],
+}
+
+# Unique indexes that writes rely on for correctness rather than speed,
+# with what goes wrong while one is missing
+REQUIRED_INDEXES = {
+    ('users', 'email_1'): 'concurrent sign-ups with one email create duplicate users',
+    ('message_buckets', 'conversation_start_seq'): 'concurrent chat appends open duplicate buckets',
+    ('message_archives', 'conversation_first'): 'two archivers can record the same segment',
+    ('karma_events', 'user_id_1_day_1'): 'concurrent karma flushes create duplicate day buckets',
+    ('github_contributions', 'user_id_unique'): 'webhook ingest creates duplicate contribution documents',
+}
+
+
+def _route_queries():
+    # (label, collection, filter, sort) for the queries routes run; the
+    # values only need the right types for the planner to pick an index
+    any_id = ObjectId()
+    return [
+        ('login / register by email', 'users', {'email': 'user@example.com'}, None),
+        ('leaderboard top', 'users', {}, [('karma_points', DESCENDING), ('_id', ASCENDING)]),
+        ('leaderboard rank', 'users', {'$or': [
+            {'karma_points': {'$gt': 0}},
+            {'karma_points': 0, '_id': {'$lt': any_id}}
+        ]}, None),
+        ('webhook owner lookup', 'users', {'github_username': 'octocat', 'github_connected': True}, None),
+        ('skill matcher sync', 'users', {'skills_updated_at': {'$gte': datetime(2024, 1, 1)}}, None),
+        ('user listing page', 'users', {'_id': {'$gt': any_id}}, [('_id', ASCENDING)]),
+        ('chat poll', 'messages', {'conversation_id': 'general', '$or': [
+            {'timestamp': {'$gt': datetime(2024, 1, 1)}},
+            {'timestamp': datetime(2024, 1, 1), '_id': {'$gt': any_id}}
+        ]}, [('timestamp', ASCENDING), ('_id', ASCENDING)]),
+        ('chat latest', 'messages', {'conversation_id': {'$in': ['general', None]}},
+         [('timestamp', DESCENDING), ('_id', DESCENDING)]),
+        ('chat bucket page', 'message_buckets', {'conversation_id': 'general'}, [('start', DESCENDING)]),
+        ('chat archive page', 'message_archives', {
+            'conversation_id': 'general', 'last_timestamp': {'$gte': datetime(2024, 1, 1)}
+        }, [('first_timestamp', ASCENDING), ('first_id', ASCENDING)]),
+        ('skill by name', 'skills', {'name': 'python'}, None),
+        ('karma window', 'karma_events', {'day': {'$gte': datetime(2024, 1, 1)}}, None),
+        ('karma flush', 'karma_ledger', {'flush_id': any_id, 'applied': False}, None),
+        ('karma recovery', 'karma_ledger', {'applied': False, 'at': {'$lt': datetime(2024, 1, 1)}}, None),
+        ('contributions cache', 'github_contributions', {'user_id': any_id}, None),
+    ]
+
+
+def _log_missing(missing):
+    for collection, name in missing:
+        logger.error(
+            f"Required index {collection}.{name} is missing, so "
+            f"{REQUIRED_INDEXES[(collection, name)]}; run python -m utils.indexes apply"
+        )
+
+
+def ensure_indexes(db=None):
+    """Create every registered index and return the (collection, name) pairs that failed.
+
+    Existing indexes are left as they are. Each index is created on its
+    own, so one that cannot be built, such as the unique email index over
+    existing duplicate emails, does not hold back the others.
+    """
+    db = db if db is not None else db_config.get_db()
+    failed = []
+    for collection, indexes in INDEXES.items():
+        names = []
+        for index in indexes:
+            name = index.document['name']
+            try:
+                names += db[collection].create_indexes([index])
+            except PyMongoError as e:
+                logger.error(f"Could not create index {collection}.{name}: {str(e)}")
+                failed.append((collection, name))
+        logger.debug(f"Indexes on {collection}: {', '.join(names)}")
+    _log_missing([key for key in failed if key in REQUIRED_INDEXES])
+    return failed
+
+
+def missing_required_indexes(db=None):
+    """Return the REQUIRED_INDEXES pairs the database does not have"""
+    db = db if db is not None else db_config.get_db()
+    existing = {}
+    missing = []
+    for collection, name in REQUIRED_INDEXES:
+        if collection not in existing:
+            existing[collection] = set(db[collection].index_information())
+        if name not in existing[collection]:
+            missing.append((collection, name))
+    return missing
+
+
+def ensure_indexes_in_background(apply=True):
+    """Apply the registry on a daemon thread so startup does not wait on the database.
+
+    With `apply` off, only checks for the required indexes and logs the
+    missing ones.
+    """
+    def run():
+        try:
+            if apply:
+                ensure_indexes()
+            else:
+                _log_missing(missing_required_indexes())
+        except Exception as e:
+            logger.error(f"Could not apply indexes: {str(e)}")
+
+    threading.Thread(target=run, name='ensure-indexes', daemon=True).start()
+
+
+def _stages(plan):
+    yield plan.get('stage')
+    for key in ('inputStage', 'queryPlan'):
+        if key in plan:
+            yield from _stages(plan[key])
+    for child in plan.get('inputStages', []):
+        yield from _stages(child)
+
+
+def collection_scans(db=None):
+    """Return the labels of route queries whose winning plan is a COLLSCAN"""
+    db = db if db is not None else db_config.get_db()
+    scans = []
+    for label, collection, query, sort in _route_queries():
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = cursor.explain()['queryPlanner']['winningPlan']
+        if 'COLLSCAN' in _stages(plan):
+            scans.append(label)
+    return scans
+
+
+def main(argv):
+    command = argv[1] if len(argv) > 1 else 'apply'
+    if command == 'apply':
+        failed = ensure_indexes()
+        for collection, name in failed:
+            print(f"FAILED: {collection}.{name}")
+        print(f"Applied indexes on {len(INDEXES)} collections")
+        return 1 if failed else 0
+    if command == 'check':
+        scans = collection_scans()
+        for label in scans:
+            print(f"COLLSCAN: {label}")
+        return 1 if scans else 0
+    print(f"Unknown command: {command} (expected apply or check)")
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
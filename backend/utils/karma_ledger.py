@@ -0,0 +1,270 @@
+from utils.db_config import users_collection, karma_events_collection, karma_ledger_collection
+from utils.leaderboard import day_bucket
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+from bson import ObjectId
+from collections import defaultdict
+from datetime import datetime, timedelta
+import threading
+import atexit
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Buffer karma changes and write them in bulk; off means every change is
+# written before the request returns
+KARMA_COALESCE = os.getenv('KARMA_COALESCE', 'true').lower() == 'true'
+KARMA_FLUSH_INTERVAL = float(os.getenv('KARMA_FLUSH_INTERVAL', '0.5'))
+# Flush early once this many events are waiting
+KARMA_FLUSH_THRESHOLD = int(os.getenv('KARMA_FLUSH_THRESHOLD', '500'))
+# Ledger events still unapplied this long after they were recorded or
+# claimed belong to a worker that died; any worker then applies them
+KARMA_RECOVERY_SECONDS = float(os.getenv('KARMA_RECOVERY_SECONDS', '60'))
+# Flush ids remembered per user and day bucket. A flush re-applied after
+# this many newer flushes of the same user could count twice, which is far
+# beyond what one recovery interval sees
+KARMA_FLUSH_MEMORY = 64
+
+_DUPLICATE_KEY = 11000
+
+
+class KarmaLedger:
+    """Append-only karma ledger with per-user coalesced writes.
+
+    Every change is first inserted into `karma_ledger` as its own event,
+    before the request that made it is answered, so a killed worker loses
+    nothing it acknowledged. The worker keeps the ids of its unapplied
+    events; a background thread applies them every KARMA_FLUSH_INTERVAL
+    seconds, or sooner once KARMA_FLUSH_THRESHOLD are waiting, with one
+    `bulk_write` of per-user totals to `users` and of per-day buckets to
+    `karma_events`, so a burst of karma for one user becomes a single
+    `$inc`.
+
+    A flush first claims its events under a new flush id, then applies
+    them with updates that skip documents already listing that id, then
+    marks the events applied. Applying a claimed flush again is therefore
+    harmless, which is what lets any worker finish the flushes and apply
+    the unclaimed events a dead worker left behind.
+    """
+
+    def __init__(self, interval=KARMA_FLUSH_INTERVAL, threshold=KARMA_FLUSH_THRESHOLD,
+                 users=None, events=None, ledger=None, recovery_seconds=KARMA_RECOVERY_SECONDS):
+        self.interval = interval
+        self.threshold = threshold
+        self.recovery_seconds = recovery_seconds
+        self.users = users if users is not None else users_collection
+        self.events = events if events is not None else karma_events_collection
+        self.ledger = ledger if ledger is not None else karma_ledger_collection
+        self._pending = defaultdict(list)
+        self._totals = defaultdict(int)
+        self._events = 0
+        # Claimed flushes whose writes failed, retried before the next one
+        self._unfinished = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._worker = None
+        self._worker_pid = None
+        self._recovered_at = datetime.min
+        self.stats = {'events': 0, 'flushes': 0, 'writes': 0, 'recovered': 0}
+
+    def _ensure_worker(self):
+        # Threads do not survive a fork, so each gunicorn worker starts its own
+        if self._worker_pid != os.getpid():
+            with self._lock:
+                if self._worker_pid != os.getpid():
+                    self._worker = threading.Thread(target=self._run, name='karma-ledger', daemon=True)
+                    self._worker.start()
+                    self._worker_pid = os.getpid()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+                if datetime.utcnow() - self._recovered_at > timedelta(seconds=self.recovery_seconds):
+                    self.recover()
+            except Exception as e:
+                logger.error(f"Karma flush failed, will retry: {str(e)}")
+
+    def record(self, user_id, delta, at=None):
+        """Insert one karma event into the ledger and return its id"""
+        event = {
+            'user_id': ObjectId(user_id),
+            'delta': delta,
+            'at': at or datetime.utcnow(),
+            'flush_id': None,
+            'applied': False
+        }
+        return self.ledger.insert_one(event).inserted_id
+
+    def add(self, user_id, delta, at=None):
+        """Record a karma change; returns the user's delta still waiting to be applied.
+
+        The change is durable once this returns; it reaches the user's
+        total with the next flush.
+        """
+        user_id = ObjectId(user_id)
+        event_id = self.record(user_id, delta, at)
+        self._ensure_worker()
+        with self._lock:
+            self._pending[user_id].append(event_id)
+            self._totals[user_id] += delta
+            self._events += 1
+            self.stats['events'] += 1
+            pending = self._totals[user_id]
+            if self._events >= self.threshold:
+                self._wake.set()
+        return pending
+
+    def pending(self, user_id):
+        with self._lock:
+            return self._totals.get(ObjectId(user_id), 0)
+
+    def _take(self, user_id=None):
+        with self._lock:
+            if user_id is not None:
+                self._totals.pop(user_id, None)
+                ids = self._pending.pop(user_id, [])
+                self._events -= len(ids)
+                return ids
+            ids = [event_id for event_ids in self._pending.values() for event_id in event_ids]
+            self._pending, self._totals = defaultdict(list), defaultdict(int)
+            self._events = 0
+            return ids
+
+    def _claim(self, query):
+        flush_id = ObjectId()
+        result = self.ledger.update_many(
+            {**query, 'flush_id': None},
+            {'$set': {'flush_id': flush_id, 'claimed_at': datetime.utcnow()}}
+        )
+        return flush_id if result.modified_count else None
+
+    def _apply(self, flush_id, user_id=None, projection=None):
+        """Apply a claimed flush; with `user_id`, returns that user as updated"""
+        totals = defaultdict(int)
+        days = defaultdict(int)
+        last_at = {}
+        for event in self.ledger.find({'flush_id': flush_id, 'applied': False}, {'user_id': 1, 'delta': 1, 'at': 1}):
+            totals[event['user_id']] += event['delta']
+            key = (event['user_id'], day_bucket(event['at']))
+            days[key] += event['delta']
+            last_at[key] = max(event['at'], last_at.get(key, event['at']))
+
+        seen = {'$push': {'karma_flushes': {'$each': [flush_id], '$slice': -KARMA_FLUSH_MEMORY}}}
+        updated = None
+        if user_id is not None:
+            updated = self.users.find_one_and_update(
+                {'_id': user_id, 'karma_flushes': {'$ne': flush_id}},
+                {'$inc': {'karma_points': totals.pop(user_id, 0)}, **seen},
+                projection=projection, return_document=ReturnDocument.AFTER
+            )
+            if updated is None:
+                # Already applied by a recovering worker, or no such user
+                updated = self.users.find_one({'_id': user_id}, projection)
+            if updated is None:
+                days = {key: delta for key, delta in days.items() if key[0] != user_id}
+        user_writes = [
+            UpdateOne({'_id': uid, 'karma_flushes': {'$ne': flush_id}}, {'$inc': {'karma_points': delta}, **seen})
+            for uid, delta in totals.items()
+        ]
+        # A bucket that already lists the flush misses the filter and its
+        # upsert hits the unique (user_id, day) index. So does a bucket
+        # another flush created at the same moment, which the server does
+        # not retry because of the $ne; _write_days tells them apart
+        day_writes = [
+            (
+                {'user_id': uid, 'day': day, 'karma_flushes': {'$ne': flush_id}},
+                {'$inc': {'delta': delta}, '$max': {'updated_at': last_at[(uid, day)]}, **seen}
+            )
+            for (uid, day), delta in days.items()
+        ]
+        if user_writes:
+            self.users.bulk_write(user_writes, ordered=False)
+        if day_writes:
+            self._write_days(day_writes)
+        self.ledger.update_many({'flush_id': flush_id}, {'$set': {'applied': True}})
+        self.stats['flushes'] += 1
+        self.stats['writes'] += len(user_writes) + len(day_writes) + (user_id is not None)
+        return updated
+
+    def _write_days(self, day_writes):
+        """Upsert (filter, update) pairs into the day buckets"""
+        try:
+            self.events.bulk_write([UpdateOne(query, update, upsert=True) for query, update in day_writes],
+                                   ordered=False)
+        except BulkWriteError as e:
+            errors = e.details['writeErrors']
+            if any(error['code'] != _DUPLICATE_KEY for error in errors):
+                raise
+            # Without the upsert the same filter matches only a bucket that
+            # exists and does not list this flush yet, so nothing counts twice
+            self.events.bulk_write([UpdateOne(*day_writes[error['index']]) for error in errors], ordered=False)
+
+    def flush(self):
+        """Apply every event this worker has recorded.
+
+        Events whose claim or writes fail stay in the ledger; a failed
+        claimed flush is retried first next time, and events that were
+        never claimed are left to recovery.
+        """
+        with self._flush_lock:
+            while self._unfinished:
+                self._apply(self._unfinished[0])
+                self._unfinished.pop(0)
+            ids = self._take()
+            if not ids:
+                return
+            flush_id = self._claim({'_id': {'$in': ids}})
+            if flush_id:
+                try:
+                    self._apply(flush_id)
+                except Exception:
+                    self._unfinished.append(flush_id)
+                    raise
+
+    def apply_now(self, user_id, delta, projection=None):
+        """Record a karma change and apply it before returning the updated user.
+
+        This is the strict path: the caller's change is in the returned
+        total, together with anything this worker had buffered for the
+        user. Returns None when the user does not exist.
+        """
+        user_id = ObjectId(user_id)
+        event_id = self.record(user_id, delta)
+        with self._lock:
+            self.stats['events'] += 1
+        ids = self._take(user_id) + [event_id]
+        flush_id = self._claim({'_id': {'$in': ids}})
+        try:
+            return self._apply(flush_id, user_id, projection)
+        except Exception:
+            self._unfinished.append(flush_id)
+            raise
+
+    def recover(self):
+        """Apply events that dead workers recorded or claimed but never applied"""
+        self._recovered_at = datetime.utcnow()
+        cutoff = self._recovered_at - timedelta(seconds=self.recovery_seconds)
+        unclaimed = self._claim({'applied': False, 'at': {'$lt': cutoff}})
+        stalled = self.ledger.distinct('flush_id', {'applied': False, 'claimed_at': {'$lt': cutoff}})
+        flush_ids = set(stalled) | ({unclaimed} if unclaimed else set())
+        for flush_id in flush_ids:
+            self._apply(flush_id)
+        if flush_ids:
+            self.stats['recovered'] += len(flush_ids)
+            logger.warning(f"Applied {len(flush_ids)} karma flushes left unfinished by other workers")
+
+
+karma_ledger = KarmaLedger()
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        karma_ledger.flush()
+    except Exception as e:
+        logger.error(f"Karma left for recovery on exit: {str(e)}")
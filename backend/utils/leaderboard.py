@@ -0,0 +1,246 @@
+from utils.db_config import users_collection, karma_events_collection
+from bson import ObjectId
+from datetime import datetime, timedelta
+import threading
+import hashlib
+import bisect
+import json
+import time
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+LEADERBOARD_SIZE = int(os.getenv('LEADERBOARD_SIZE', '10'))
+# Spare entries kept below the visible top so a user dropping out of it can
+# be replaced without going back to the database
+LEADERBOARD_SPARE = int(os.getenv('LEADERBOARD_SPARE', '40'))
+# Other workers apply their own karma updates, so reload now and then
+LEADERBOARD_REFRESH_SECONDS = int(os.getenv('LEADERBOARD_REFRESH_SECONDS', '30'))
+
+# Rolling windows over the per-day karma buckets, in days
+KARMA_WINDOWS = {'week': 7, 'month': 30}
+MAX_NEIGHBOURS = 25
+
+LEADERBOARD_PROJECTION = {'username': 1, 'karma_points': 1}
+
+
+def _entry(user):
+    return {
+        '_id': str(user['_id']),
+        'username': user.get('username'),
+        'karma_points': user.get('karma_points', 0)
+    }
+
+
+def _rank_key(entry):
+    return (-entry['karma_points'], entry['_id'])
+
+
+def content_version(entries):
+    """Version of a board derived from what it lists, so every worker and
+    every reload agree on it as long as the board itself is the same"""
+    encoded = json.dumps(entries, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha1(encoded.encode()).hexdigest()[:16]
+
+
+class Leaderboard:
+    """Top users by karma, kept in memory and updated as karma changes.
+
+    Holds `size + spare` entries: exactly the best ranked users, so every
+    user not listed ranks below the last entry. The list is rebuilt from
+    the `karma_rank` index on first use, when it runs out of spare
+    entries, and every LEADERBOARD_REFRESH_SECONDS. A rebuild queries
+    MongoDB without holding the lock: readers keep the previous list
+    meanwhile, and karma applied during the query is replayed onto the
+    new list before it is swapped in.
+    """
+
+    def __init__(self, size=LEADERBOARD_SIZE, spare=LEADERBOARD_SPARE, collection=None):
+        self.collection = collection if collection is not None else users_collection
+        self.size = size
+        self.capacity = size + spare
+        self._entries = None
+        # True while the list holds every user, so any user may join it
+        self._complete = False
+        self._loaded_at = 0.0
+        # Users applied while a rebuild is querying; None when none is
+        self._replay = None
+        self._lock = threading.Lock()
+        # Held by the one thread rebuilding the list
+        self._load_lock = threading.Lock()
+
+    def _needs_load(self):
+        return self._entries is None or time.monotonic() - self._loaded_at > LEADERBOARD_REFRESH_SECONDS
+
+    def _query(self):
+        users = self.collection.find({}, LEADERBOARD_PROJECTION).sort(
+            [('karma_points', -1), ('_id', 1)]
+        ).limit(self.capacity)
+        return sorted((_entry(user) for user in users), key=_rank_key)
+
+    def _reload(self, wait):
+        # Without `wait`, a reader that finds another thread rebuilding
+        # goes on with the list it has
+        if not self._load_lock.acquire(blocking=wait):
+            return
+        try:
+            with self._lock:
+                if not self._needs_load():
+                    return
+                self._replay = []
+            try:
+                entries = self._query()
+            finally:
+                with self._lock:
+                    replay, self._replay = self._replay, None
+            with self._lock:
+                self._entries = entries
+                self._complete = len(entries) < self.capacity
+                self._loaded_at = time.monotonic()
+                for user in replay:
+                    self._apply(user)
+        finally:
+            self._load_lock.release()
+
+    def top(self):
+        """Return (version, entries) of the visible top of the board"""
+        while True:
+            if self._needs_load():
+                self._reload(wait=self._entries is None)
+            with self._lock:
+                if self._entries is not None:
+                    entries = [dict(entry) for entry in self._entries[:self.size]]
+                    break
+        return content_version(entries), entries
+
+    def apply(self, user):
+        """Fold a user's new karma total into the board"""
+        with self._lock:
+            if self._replay is not None:
+                self._replay.append(user)
+            self._apply(user)
+
+    def _apply(self, user):
+        if self._entries is None:
+            return
+        entry = _entry(user)
+        entries = [e for e in self._entries if e['_id'] != entry['_id']]
+        was_listed = len(entries) != len(self._entries)
+
+        # Unlisted users may outrank anyone who falls below the last
+        # entry, so only the complete list takes users from down there
+        if self._complete or (entries and _rank_key(entry) < _rank_key(entries[-1])):
+            bisect.insort(entries, entry, key=_rank_key)
+            if len(entries) > self.capacity:
+                del entries[self.capacity:]
+                self._complete = False
+        elif not was_listed:
+            # Still below the last tracked entry, nothing changes
+            return
+
+        self._entries = entries
+        if not self._complete and len(entries) < self.size:
+            # Someone dropped below the tracked range and no spare is left
+            self._entries = None
+
+
+leaderboard = Leaderboard()
+
+
+def _ranked(users, first_rank):
+    return [{**_entry(user), 'rank': first_rank + i} for i, user in enumerate(users)]
+
+
+def rank_of(user_id, neighbours=2):
+    """Return a user's global rank with the users just above and below.
+
+    The rank is one plus the number of users ordered before this one by
+    (karma desc, _id asc), counted on the `karma_rank` index, so it costs
+    an index walk rather than a sort of the whole collection. Returns None
+    for an unknown user.
+    """
+    user_id = ObjectId(user_id)
+    user = users_collection.find_one({'_id': user_id}, LEADERBOARD_PROJECTION)
+    if not user:
+        return None
+    karma = user.get('karma_points', 0)
+    neighbours = max(0, min(neighbours, MAX_NEIGHBOURS))
+
+    ahead = {'$or': [
+        {'karma_points': {'$gt': karma}},
+        {'karma_points': karma, '_id': {'$lt': user_id}}
+    ]}
+    behind = {'$or': [
+        {'karma_points': {'$lt': karma}},
+        {'karma_points': karma, '_id': {'$gt': user_id}}
+    ]}
+    rank = users_collection.count_documents(ahead) + 1
+
+    above, below = [], []
+    if neighbours:
+        above = list(users_collection.find(ahead, LEADERBOARD_PROJECTION)
+                     .sort([('karma_points', 1), ('_id', -1)]).limit(neighbours))[::-1]
+        below = list(users_collection.find(behind, LEADERBOARD_PROJECTION)
+                     .sort([('karma_points', -1), ('_id', 1)]).limit(neighbours))
+
+    return {
+        'user': {**_entry(user), 'rank': rank},
+        'above': _ranked(above, rank - len(above)),
+        'below': _ranked(below, rank + 1)
+    }
+
+
+def day_bucket(at):
+    """Midnight (UTC) of the day karma events at `at` are bucketed under"""
+    return datetime(at.year, at.month, at.day)
+
+
+class WindowedLeaderboard:
+    """Top users by karma gained over a rolling window of days.
+
+    Sums the per-day buckets written by utils.karma_ledger, so the work is
+    bounded by the window rather than the whole karma history. Results are
+    reused for LEADERBOARD_REFRESH_SECONDS.
+    """
+
+    def __init__(self, size=LEADERBOARD_SIZE):
+        self.size = size
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _aggregate(self, days):
+        start = day_bucket(datetime.utcnow()) - timedelta(days=days - 1)
+        totals = list(karma_events_collection.aggregate([
+            {'$match': {'day': {'$gte': start}}},
+            {'$group': {'_id': '$user_id', 'karma_points': {'$sum': '$delta'}}},
+            {'$match': {'karma_points': {'$gt': 0}}},
+            {'$sort': {'karma_points': -1, '_id': 1}},
+            {'$limit': self.size}
+        ]))
+        names = {
+            user['_id']: user.get('username')
+            for user in users_collection.find(
+                {'_id': {'$in': [total['_id'] for total in totals]}}, {'username': 1}
+            )
+        }
+        return [
+            {'_id': str(total['_id']), 'username': names.get(total['_id']),
+             'karma_points': total['karma_points']}
+            for total in totals if total['_id'] in names
+        ]
+
+    def top(self, window):
+        """Return (version, entries) for 'week' or 'month'"""
+        with self._lock:
+            cached = self._cache.get(window)
+            if cached and time.monotonic() - cached[0] <= LEADERBOARD_REFRESH_SECONDS:
+                return cached[1], [dict(entry) for entry in cached[2]]
+
+            entries = self._aggregate(KARMA_WINDOWS[window])
+            version = content_version(entries)
+            self._cache[window] = (time.monotonic(), version, entries)
+            return version, [dict(entry) for entry in entries]
+
+
+windowed_leaderboard = WindowedLeaderboard()
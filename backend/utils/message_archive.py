@@ -0,0 +1,442 @@
+"""Tiered storage for old chat messages.
+
+Messages older than CHAT_ARCHIVE_AFTER_DAYS move out of the messages
+collection into append-only segment files under CHAT_ARCHIVE_DIR. Archived
+messages are deleted from MongoDB, so the directory must be an absolute
+path on a persistent disk that every instance of the app mounts; the
+archiver does not start otherwise. Each segment holds
+one conversation's messages in (timestamp, _id) order as gzip-compressed
+NDJSON, written in blocks of CHAT_ARCHIVE_BLOCK_SIZE messages that are each
+a complete gzip member, so `zcat` reads a segment as a whole while the app
+decompresses only the blocks it needs. A sparse index next to each segment
+records every block's first position and byte range, and the
+message_archives collection keeps one stub per segment for history
+lookups. Segments are read through mmap.
+
+Archive once, or show what is archived:
+
+    python -m utils.message_archive run
+    python -m utils.message_archive stats
+"""
+from utils.chat_history import HISTORY_SORT, _beyond, conversation_query, page_cursors
+from utils.singleflight import acquire_worker_lock, release_worker_lock
+from bson import ObjectId, json_util
+from bson.json_util import JSONMode, JSONOptions
+from pymongo.errors import DuplicateKeyError
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import bisect
+import hashlib
+import itertools
+import threading
+import struct
+import mmap
+import gzip
+import zlib
+import time
+import sys
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 0 keeps every message in the messages collection
+CHAT_ARCHIVE_AFTER_DAYS = int(os.getenv('CHAT_ARCHIVE_AFTER_DAYS', '0'))
+# Must already exist: a mount point, not a directory on the instance's own disk
+CHAT_ARCHIVE_DIR = os.getenv('CHAT_ARCHIVE_DIR', '')
+CHAT_ARCHIVE_INTERVAL_SECONDS = int(os.getenv('CHAT_ARCHIVE_INTERVAL_SECONDS', '3600'))
+# Messages per segment file and per compressed block (one index entry each)
+CHAT_ARCHIVE_SEGMENT_SIZE = int(os.getenv('CHAT_ARCHIVE_SEGMENT_SIZE', '100000'))
+CHAT_ARCHIVE_BLOCK_SIZE = int(os.getenv('CHAT_ARCHIVE_BLOCK_SIZE', '64'))
+# Memory-mapped segments kept open per worker
+CHAT_ARCHIVE_OPEN_SEGMENTS = int(os.getenv('CHAT_ARCHIVE_OPEN_SEGMENTS', '64'))
+ARCHIVE_LOCK_KEY = 'chat-archive'
+DELETE_BATCH_SIZE = 1000
+
+# Relaxed extended JSON keeps ObjectIds and dates intact through a segment
+_JSON_OPTIONS = JSONOptions(json_mode=JSONMode.RELAXED, tz_aware=False)
+# Index entry: first message's time (ms) and id, block offset and length
+_INDEX_ENTRY = struct.Struct('>q12sQI')
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _position(message):
+    return (message['timestamp'], message['_id'])
+
+
+def _millis(timestamp):
+    return (timestamp - _EPOCH) // timedelta(milliseconds=1)
+
+
+def _stub_position(entry, end):
+    return (entry[f'{end}_timestamp'], entry[f'{end}_id'])
+
+
+def archive_dir_problem(directory):
+    """Why `directory` cannot hold the archive, or None when it can"""
+    if not directory:
+        return 'CHAT_ARCHIVE_DIR is not set'
+    if not os.path.isabs(directory):
+        return f'CHAT_ARCHIVE_DIR must be an absolute path on a persistent disk, not {directory!r}'
+    if not os.path.isdir(directory):
+        return f'CHAT_ARCHIVE_DIR {directory} does not exist; mount the persistent disk there first'
+    if not os.access(directory, os.W_OK):
+        return f'CHAT_ARCHIVE_DIR {directory} is not writable'
+    return None
+
+
+class Segment:
+    """A memory-mapped segment file and its sparse block index"""
+
+    def __init__(self, path):
+        with open(path + '.idx', 'rb') as f:
+            entries = list(_INDEX_ENTRY.iter_unpack(f.read()))
+        self.firsts = [(_EPOCH + timedelta(milliseconds=millis), ObjectId(oid)) for millis, oid, _, _ in entries]
+        self.ranges = [(offset, length) for _, _, offset, length in entries]
+        with open(path, 'rb') as f:
+            # The mapping stays valid after the file is closed
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def block(self, i):
+        offset, length = self.ranges[i]
+        data = zlib.decompress(self._map[offset:offset + length], 16 + zlib.MAX_WBITS)
+        return [json_util.loads(line, json_options=_JSON_OPTIONS) for line in data.splitlines()]
+
+    def block_before(self, position):
+        """Index of the last block that starts before `position`"""
+        return bisect.bisect_left(self.firsts, position) - 1
+
+
+class MessageArchive:
+    """Reads and writes archived conversation segments"""
+
+    def __init__(self, catalogue, directory=CHAT_ARCHIVE_DIR):
+        self.catalogue = catalogue
+        self.directory = directory
+        self._open = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {
+            'runs': 0, 'archived': 0, 'segments_written': 0, 'segments_opened': 0,
+            'segments_missing': 0, 'blocks_read': 0
+        }
+
+    def _segment(self, entry):
+        """The segment of a stub, or None when its file is missing"""
+        path = os.path.join(self.directory, entry['path'])
+        with self._lock:
+            segment = self._open.get(path)
+            if segment:
+                self._open.move_to_end(path)
+                return segment
+        # Segment files never change once written, so any worker's copy is current
+        try:
+            segment = Segment(path)
+        except FileNotFoundError:
+            # Lost with a disk that did not persist, or written where this
+            # instance cannot see it; history reads skip its messages
+            with self._lock:
+                self.stats['segments_missing'] += 1
+            logger.error(f"Chat archive segment missing, skipping it: {path}")
+            return None
+        with self._lock:
+            self.stats['segments_opened'] += 1
+            self._open[path] = segment
+            while len(self._open) > CHAT_ARCHIVE_OPEN_SEGMENTS:
+                # Unmapped once the last reader drops it
+                self._open.popitem(last=False)
+        return segment
+
+    def _read(self, segment, i):
+        self.stats['blocks_read'] += 1
+        return segment.block(i)
+
+    def last_position(self, conversation_id):
+        entry = self.catalogue.find_one(
+            {'conversation_id': conversation_id}, sort=[('first_timestamp', -1), ('first_id', -1)]
+        )
+        return _stub_position(entry, 'last') if entry else None
+
+    def page(self, conversation_id, limit, before=None, after=None):
+        """Up to `limit` archived messages past a position; returns (messages, has_more).
+
+        Same directions as utils.chat_history.history_page: `after` reads
+        forward, otherwise the page ends right before `before` (or at the
+        newest archived message).
+        """
+        collected = []
+        if after:
+            entries = self.catalogue.find(
+                {'conversation_id': conversation_id, 'last_timestamp': {'$gte': after[0]}}
+            ).sort([('first_timestamp', 1), ('first_id', 1)])
+            for entry in entries:
+                segment = self._segment(entry)
+                if segment is None:
+                    continue
+                for i in range(max(segment.block_before(after), 0), len(segment.ranges)):
+                    collected.extend(m for m in self._read(segment, i) if _position(m) > after)
+                    if len(collected) > limit:
+                        return collected[:limit], True
+            return collected, False
+
+        query = {'conversation_id': conversation_id}
+        if before:
+            query['first_timestamp'] = {'$lte': before[0]}
+        entries = self.catalogue.find(query).sort([('first_timestamp', -1), ('first_id', -1)])
+        for entry in entries:
+            segment = self._segment(entry)
+            if segment is None:
+                continue
+            start = segment.block_before(before) if before else len(segment.ranges) - 1
+            for i in range(start, -1, -1):
+                block = [m for m in self._read(segment, i) if not before or _position(m) < before]
+                collected[:0] = block
+                if len(collected) > limit:
+                    return collected[len(collected) - limit:], True
+        return collected, False
+
+    def find(self, conversation_id, message_id):
+        # An id's creation time is within a second of the message's timestamp,
+        # unless it was generated elsewhere; then every block is searched
+        created = message_id.generation_time.replace(tzinfo=None)
+        window = (created - timedelta(seconds=1), created + timedelta(seconds=2))
+        for near in (True, False):
+            query = {'conversation_id': conversation_id}
+            if near:
+                query.update({'first_timestamp': {'$lte': window[1]}, 'last_timestamp': {'$gte': window[0]}})
+            for entry in self.catalogue.find(query):
+                segment = self._segment(entry)
+                if segment is None:
+                    continue
+                blocks = range(len(segment.ranges))
+                if near:
+                    start = max(segment.block_before((window[0], ObjectId('0' * 24))), 0)
+                    stop = segment.block_before((window[1], ObjectId('f' * 24))) + 1
+                    blocks = range(start, stop)
+                for i in blocks:
+                    for message in self._read(segment, i):
+                        if message['_id'] == message_id:
+                            return message
+        return None
+
+    def export(self, conversation_id):
+        """Every archived message of a conversation, oldest first"""
+        entries = self.catalogue.find({'conversation_id': conversation_id}).sort(
+            [('first_timestamp', 1), ('first_id', 1)]
+        )
+        for entry in entries:
+            segment = self._segment(entry)
+            if segment is None:
+                continue
+            for i in range(len(segment.ranges)):
+                yield from self._read(segment, i)
+
+    def write_segment(self, conversation_id, messages):
+        """Write `messages` (in history order) as a new segment and record its stub.
+
+        Returns False when another archiver already recorded the same
+        segment.
+        """
+        first, last = _position(messages[0]), _position(messages[-1])
+        digest = hashlib.sha1(conversation_id.encode()).hexdigest()
+        relative = os.path.join(digest[:2], f'{digest}-{_millis(first[0])}-{first[1]}.ndjson.gz')
+        path = os.path.join(self.directory, relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        index = []
+        offset = 0
+        with open(path + '.tmp', 'wb') as f:
+            for start in range(0, len(messages), CHAT_ARCHIVE_BLOCK_SIZE):
+                block = messages[start:start + CHAT_ARCHIVE_BLOCK_SIZE]
+                data = gzip.compress(''.join(
+                    json_util.dumps(m, json_options=_JSON_OPTIONS) + '\n' for m in block
+                ).encode())
+                f.write(data)
+                head = _position(block[0])
+                index.append(_INDEX_ENTRY.pack(_millis(head[0]), head[1].binary, offset, len(data)))
+                offset += len(data)
+            f.flush()
+            os.fsync(f.fileno())
+        with open(path + '.idx.tmp', 'wb') as f:
+            f.write(b''.join(index))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.idx.tmp', path + '.idx')
+        os.replace(path + '.tmp', path)
+
+        try:
+            self.catalogue.insert_one({
+                'conversation_id': conversation_id,
+                'path': relative,
+                'count': len(messages),
+                'bytes': offset,
+                'first_timestamp': first[0], 'first_id': first[1],
+                'last_timestamp': last[0], 'last_id': last[1],
+                'archived_at': datetime.utcnow()
+            })
+        except DuplicateKeyError:
+            return False
+        self.stats['segments_written'] += 1
+        return True
+
+
+def _at_or_before(position):
+    timestamp, message_id = position
+    return {'$or': [
+        {'timestamp': {'$lt': timestamp}},
+        {'timestamp': timestamp, '_id': {'$lte': message_id}}
+    ]}
+
+
+def archive_conversation(messages, archive, conversation_id, cutoff):
+    """Move a conversation's messages sent before `cutoff` into segments; returns the count"""
+    query = conversation_query(conversation_id)
+    last = archive.last_position(conversation_id)
+    if last:
+        # Finish a run that stopped between writing a segment and deleting its messages
+        messages.delete_many({**query, **_at_or_before(last)})
+        query = {**query, **_beyond(last, 1)}
+
+    archived = 0
+    cursor = messages.find({**query, 'timestamp': {'$lt': cutoff}}).sort(HISTORY_SORT)
+    while True:
+        batch = list(itertools.islice(cursor, CHAT_ARCHIVE_SEGMENT_SIZE))
+        if not batch:
+            return archived
+        # Legacy messages without one are stored under the conversation they are read as
+        for message in batch:
+            message['conversation_id'] = conversation_id
+        if not archive.write_segment(conversation_id, batch):
+            logger.warning(f"Conversation {conversation_id} is being archived elsewhere")
+            return archived
+        ids = [m['_id'] for m in batch]
+        for start in range(0, len(ids), DELETE_BATCH_SIZE):
+            messages.delete_many({'_id': {'$in': ids[start:start + DELETE_BATCH_SIZE]}})
+        archived += len(batch)
+
+
+def archive_old_messages(messages, archive, cutoff=None):
+    """Archive every conversation's messages sent before `cutoff`; returns the count.
+
+    Conversations are listed from the conversation_timestamp index and each
+    one's oldest message is checked there too, so a run that finds nothing
+    to archive reads only index entries.
+    """
+    if cutoff is None:
+        cutoff = datetime.utcnow() - timedelta(days=CHAT_ARCHIVE_AFTER_DAYS)
+    archived = 0
+    conversation_ids = set(c or 'general' for c in messages.distinct('conversation_id'))
+    for conversation_id in sorted(conversation_ids):
+        oldest = messages.find_one(conversation_query(conversation_id), {'timestamp': 1}, sort=HISTORY_SORT)
+        if oldest and oldest['timestamp'] < cutoff:
+            count = archive_conversation(messages, archive, conversation_id, cutoff)
+            archived += count
+            logger.info(f"Archived {count} messages of conversation {conversation_id}")
+    archive.stats['runs'] += 1
+    archive.stats['archived'] += archived
+    return archived
+
+
+def start_archiver(messages, archive, interval=CHAT_ARCHIVE_INTERVAL_SECONDS):
+    """Archive on a daemon thread every `interval` seconds.
+
+    Every worker runs one; the cross-worker lock lets one of them at a
+    time do the work. Nothing starts unless the archive directory is
+    usable, since archived messages are deleted from the collection.
+    """
+    problem = archive_dir_problem(archive.directory)
+    if problem:
+        logger.error(f"Chat archiver not started: {problem}")
+        return False
+
+    def run():
+        while True:
+            token = None
+            try:
+                token = acquire_worker_lock(ARCHIVE_LOCK_KEY, interval)
+                if token:
+                    archive_old_messages(messages, archive)
+            except Exception as e:
+                logger.error(f"Chat archive run failed: {str(e)}")
+            finally:
+                if token:
+                    release_worker_lock(ARCHIVE_LOCK_KEY, token)
+            time.sleep(interval)
+
+    threading.Thread(target=run, name='chat-archiver', daemon=True).start()
+    return True
+
+
+class TieredMessageStore:
+    """Message store over the messages collection and the archive below it.
+
+    Only history past the archive cutoff can be archived, so polls of
+    recent messages never leave the collection; older pages continue into
+    the archive once the collection runs out.
+    """
+
+    def __init__(self, hot, archive, age=None):
+        self.hot = hot
+        self.archive = archive
+        self.age = age or timedelta(days=CHAT_ARCHIVE_AFTER_DAYS)
+        self.collection = hot.collection
+        self.watch_pipeline = hot.watch_pipeline
+
+    def append(self, document):
+        self.hot.append(document)
+
+    def messages_from_change(self, change):
+        return self.hot.messages_from_change(change)
+
+    def find(self, conversation_id, message_id):
+        return self.hot.find(conversation_id, message_id) or self.archive.find(conversation_id, message_id)
+
+    def page(self, conversation_id, limit, before=None, after=None):
+        if after:
+            if after[0] >= datetime.utcnow() - self.age:
+                return self.hot.page(conversation_id, limit, after=after)
+            older, has_more = self.archive.page(conversation_id, limit, after=after)
+            if not has_more:
+                newer, _, has_more = self.hot.page(
+                    conversation_id, limit - len(older), after=_position(older[-1]) if older else after
+                )
+                older += newer
+            return older, page_cursors(older, after), has_more
+
+        messages, _, has_more = self.hot.page(conversation_id, limit, before=before)
+        if not has_more:
+            older, has_more = self.archive.page(
+                conversation_id, limit - len(messages), before=_position(messages[0]) if messages else before
+            )
+            messages = older + messages
+        return messages, page_cursors(messages), has_more
+
+    def export(self, conversation_id):
+        return itertools.chain(self.archive.export(conversation_id), self.hot.export(conversation_id))
+
+
+def main(argv):
+    from utils.db_config import messages_collection, message_archives_collection
+    archive = MessageArchive(message_archives_collection)
+    if len(argv) == 2 and argv[1] == 'run':
+        if not CHAT_ARCHIVE_AFTER_DAYS:
+            print("Set CHAT_ARCHIVE_AFTER_DAYS to archive messages")
+            return 2
+        problem = archive_dir_problem(archive.directory)
+        if problem:
+            print(problem)
+            return 2
+        print(f"Archived {archive_old_messages(messages_collection, archive)} messages")
+        return 0
+    if len(argv) == 2 and argv[1] == 'stats':
+        totals = list(message_archives_collection.aggregate([{'$group': {
+            '_id': None, 'segments': {'$sum': 1}, 'messages': {'$sum': '$count'}, 'bytes': {'$sum': '$bytes'}
+        }}]))
+        totals = totals[0] if totals else {'segments': 0, 'messages': 0, 'bytes': 0}
+        print(f"{totals['messages']} messages in {totals['segments']} segments, {totals['bytes']} bytes")
+        return 0
+    print("Usage: python -m utils.message_archive run|stats")
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
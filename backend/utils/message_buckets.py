@@ -0,0 +1,211 @@
+"""Chat messages packed into per-conversation time buckets.
+
+Opt in with CHAT_STORAGE=buckets after converting existing messages:
+
+    python -m utils.message_buckets migrate
+"""
+from utils.chat_history import conversation_query, page_cursors
+from models.message import GENERAL_CONVERSATION
+from pymongo import DESCENDING
+from pymongo.errors import DuplicateKeyError
+from bson import ObjectId
+from datetime import datetime, timedelta
+import sys
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# A bucket holds up to CHAT_BUCKET_SIZE messages of one conversation sent
+# within the same CHAT_BUCKET_SECONDS window; a full window opens another
+CHAT_BUCKET_SIZE = int(os.getenv('CHAT_BUCKET_SIZE', '200'))
+CHAT_BUCKET_SECONDS = int(os.getenv('CHAT_BUCKET_SECONDS', '3600'))
+MIGRATION_BATCH_SIZE = 1000
+# Appends that lose the race to open a window's next bucket try again
+APPEND_ATTEMPTS = 5
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def bucket_start(timestamp):
+    """Start of the bucket window `timestamp` falls in"""
+    seconds = int((timestamp - _EPOCH).total_seconds())
+    return _EPOCH + timedelta(seconds=seconds - seconds % CHAT_BUCKET_SECONDS)
+
+
+def _position(message):
+    return (message['timestamp'], message['_id'])
+
+
+class BucketedMessageStore:
+    """Message store with one document per conversation and time window.
+
+    Buckets are keyed by (conversation_id, start, seq), so a page reads
+    a handful of bucket documents through one small index instead of one
+    index entry and document per message. Every message in a bucket was
+    sent in [start, start + CHAT_BUCKET_SECONDS), which is what lets a
+    page stop reading buckets as soon as no later one can hold a message
+    that belongs on it. `seq` numbers the buckets of a window that filled
+    up; the key is unique, so two appends cannot both open the same one.
+    """
+
+    watch_pipeline = [{'$match': {'operationType': {'$in': ['insert', 'update']}}}]
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def append(self, document):
+        """$push a message into its window's open bucket, opening one if needed"""
+        document.setdefault('_id', ObjectId())
+        document['conversation_id'] = document.get('conversation_id') or GENERAL_CONVERSATION
+        window = {'conversation_id': document['conversation_id'], 'start': bucket_start(document['timestamp'])}
+        push = {
+            '$push': {'messages': document},
+            '$inc': {'count': 1},
+            '$max': {'last_at': document['timestamp']}
+        }
+
+        if self.collection.update_one({**window, 'count': {'$lt': CHAT_BUCKET_SIZE}}, push).matched_count:
+            return
+        for _ in range(APPEND_ATTEMPTS):
+            last = self.collection.find_one(window, {'seq': 1, 'count': 1}, sort=[('seq', DESCENDING)])
+            if last is None:
+                seq = 0
+            else:
+                seq = last['seq'] + (last['count'] >= CHAT_BUCKET_SIZE)
+            try:
+                # Joins the bucket if another append opened it first; if
+                # that one has filled up meanwhile, the insert hits the
+                # unique key and we look again
+                self.collection.update_one(
+                    {**window, 'seq': seq, 'count': {'$lt': CHAT_BUCKET_SIZE}}, push, upsert=True
+                )
+                return
+            except DuplicateKeyError:
+                continue
+        raise RuntimeError(f"Could not open a chat bucket for {document['conversation_id']}")
+
+    def find(self, conversation_id, message_id):
+        # Ids are generated as messages are sent, so the id's creation time
+        # usually narrows the search to the buckets around it; ids that were
+        # not (imported data) fall back to scanning the conversation
+        created = message_id.generation_time.replace(tzinfo=None)
+        window = timedelta(seconds=CHAT_BUCKET_SECONDS)
+        query = {'conversation_id': conversation_id, 'messages._id': message_id}
+        near = {'$gte': bucket_start(created) - window, '$lte': bucket_start(created) + window}
+        projection = {'messages': {'$elemMatch': {'_id': message_id}}}
+        for bucket_query in ({**query, 'start': near}, query):
+            bucket = self.collection.find_one(bucket_query, projection)
+            if bucket:
+                return bucket['messages'][0]
+        return None
+
+    def _query(self, conversation_id):
+        # Buckets always carry a conversation_id; migration fills in 'general'
+        return {'conversation_id': conversation_id}
+
+    def page(self, conversation_id, limit, before=None, after=None):
+        """Same contract as utils.chat_history.history_page"""
+        window = timedelta(seconds=CHAT_BUCKET_SECONDS)
+        query = self._query(conversation_id)
+        collected = []
+
+        if after:
+            query['start'] = {'$gte': bucket_start(after[0])}
+            buckets = self.collection.find(query).sort('start', 1).batch_size(4)
+            for bucket in buckets:
+                if len(collected) > limit and bucket['start'] > _position(collected[limit])[0]:
+                    break
+                collected.extend(m for m in bucket['messages'] if _position(m) > after)
+                collected.sort(key=_position)
+            has_more = len(collected) > limit
+            messages = collected[:limit]
+        else:
+            if before:
+                query['start'] = {'$lte': bucket_start(before[0])}
+            buckets = self.collection.find(query).sort('start', -1).batch_size(4)
+            for bucket in buckets:
+                if len(collected) > limit and bucket['start'] + window <= _position(collected[limit])[0]:
+                    break
+                collected.extend(m for m in bucket['messages'] if not before or _position(m) < before)
+                collected.sort(key=_position, reverse=True)
+            has_more = len(collected) > limit
+            messages = collected[:limit][::-1]
+
+        return messages, page_cursors(messages, after), has_more
+
+    def export(self, conversation_id):
+        return self.collection.aggregate([
+            {'$match': self._query(conversation_id)},
+            {'$sort': {'start': 1}},
+            {'$unwind': '$messages'},
+            {'$replaceRoot': {'newRoot': '$messages'}},
+            # A window's messages can span several buckets
+            {'$sort': {'timestamp': 1, '_id': 1}}
+        ], allowDiskUse=True)
+
+    def messages_from_change(self, change):
+        if change['operationType'] == 'insert':
+            return change['fullDocument'].get('messages', [])
+        # A $push shows up as the new array element, e.g. 'messages.41'
+        updated = change.get('updateDescription', {}).get('updatedFields', {})
+        return [value for key, value in updated.items() if key.startswith('messages.')]
+
+
+def migrate(messages, buckets, conversation_id=None):
+    """Pack stored messages into buckets; returns (messages, buckets) written.
+
+    Reads each conversation in (timestamp, _id) order through the
+    conversation_timestamp index and replaces any buckets it already has,
+    so rerunning it after a partial run is safe. Pause chat writes, or
+    rerun it, before switching CHAT_STORAGE to buckets.
+    """
+    if conversation_id:
+        conversation_ids = [conversation_id]
+    else:
+        conversation_ids = messages.distinct('conversation_id')
+    message_count = bucket_count = 0
+
+    for conversation in set(c or GENERAL_CONVERSATION for c in conversation_ids):
+        buckets.delete_many({'conversation_id': conversation})
+        batch, current = [], None
+        cursor = messages.find(conversation_query(conversation)).sort([('timestamp', 1), ('_id', 1)])
+        for message in cursor:
+            message['conversation_id'] = conversation
+            start = bucket_start(message['timestamp'])
+            if not current or current['start'] != start or current['count'] >= CHAT_BUCKET_SIZE:
+                seq = current['seq'] + 1 if current and current['start'] == start else 0
+                current = {
+                    'conversation_id': conversation, 'start': start, 'seq': seq, 'count': 0, 'messages': []
+                }
+                batch.append(current)
+            current['messages'].append(message)
+            current['count'] += 1
+            current['last_at'] = message['timestamp']
+            message_count += 1
+            if len(batch) > MIGRATION_BATCH_SIZE:
+                # Keep the open bucket for the next batch
+                buckets.insert_many(batch[:-1])
+                bucket_count += len(batch) - 1
+                batch = batch[-1:]
+        if batch:
+            buckets.insert_many(batch)
+            bucket_count += len(batch)
+        logger.info(f"Migrated conversation {conversation}")
+    return message_count, bucket_count
+
+
+def main(argv):
+    from utils.db_config import messages_collection, message_buckets_collection
+    if len(argv) < 2 or argv[1] != 'migrate':
+        print("Usage: python -m utils.message_buckets migrate [conversation_id]")
+        return 2
+    message_count, bucket_count = migrate(
+        messages_collection, message_buckets_collection, argv[2] if len(argv) > 2 else None
+    )
+    print(f"Packed {message_count} messages into {bucket_count} buckets")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
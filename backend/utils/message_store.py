@@ -0,0 +1,20 @@
+from utils.db_config import messages_collection, message_buckets_collection, message_archives_collection
+from utils.chat_history import MessageStore
+from utils.message_buckets import BucketedMessageStore
+from utils.message_archive import CHAT_ARCHIVE_AFTER_DAYS, MessageArchive, TieredMessageStore
+import os
+
+# 'documents' keeps one document per message; 'buckets' packs each
+# conversation's messages into time buckets (run the migration first)
+CHAT_STORAGE = os.getenv('CHAT_STORAGE', 'documents')
+# Old messages are archived out of the documents layout only
+CHAT_ARCHIVE_ENABLED = CHAT_ARCHIVE_AFTER_DAYS > 0 and CHAT_STORAGE == 'documents'
+
+message_archive = MessageArchive(message_archives_collection)
+
+if CHAT_STORAGE == 'buckets':
+    message_store = BucketedMessageStore(message_buckets_collection)
+elif CHAT_ARCHIVE_ENABLED:
+    message_store = TieredMessageStore(MessageStore(messages_collection), message_archive)
+else:
+    message_store = MessageStore(messages_collection)
@@ -0,0 +1,58 @@
+from bson import ObjectId
+from bson.errors import InvalidId
+import base64
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Fields a user listing returns by default; passwords, tokens and emails stay out
+PUBLIC_USER_PROJECTION = {
+    'username': 1,
+    'skills_offered': 1,
+    'skills_needed': 1,
+    'karma_points': 1,
+    'github_connected': 1,
+    'github_username': 1,
+    'created_at': 1
+}
+
+
+def encode_cursor(object_id):
+    """Opaque cursor for the document after which the next page starts"""
+    return base64.urlsafe_b64encode(object_id.binary).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        return ObjectId(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (InvalidId, ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+
+def parse_page_args(args):
+    """Read `limit` and `after` from the query string; raises ValueError"""
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    after = args.get('after')
+    return limit, decode_cursor(after) if after else None
+
+
+def keyset_page(collection, query, projection, limit, after=None):
+    """Fetch one page ordered by `_id`, resuming after the `after` id.
+
+    Uses the `_id` index for both filter and sort, so every page costs the
+    same no matter how deep into the collection it is. Returns the
+    documents and the cursor of the next page (None on the last page).
+    """
+    if after:
+        query = {**query, '_id': {'$gt': after}}
+    documents = list(collection.find(query, projection).sort('_id', 1).limit(limit + 1))
+
+    next_cursor = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        next_cursor = encode_cursor(documents[-1]['_id'])
+    return documents, next_cursor
@@ -0,0 +1,17 @@
+import os
+
+# How gunicorn serves this process; see gunicorn_config.py
+GUNICORN_WORKER_CLASS = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+GUNICORN_THREADS = int(os.getenv('GUNICORN_THREADS', '4'))
+GUNICORN_WORKER_CONNECTIONS = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '1000'))
+ASYNC_WORKER = GUNICORN_WORKER_CLASS == 'gevent'
+
+# A gevent worker accepts up to worker_connections requests at once; its
+# pools are capped lower so a burst waits on them instead of opening
+# hundreds of sockets to GitHub and MongoDB
+GEVENT_POOL_CONCURRENCY = int(os.getenv('GEVENT_POOL_CONCURRENCY', '32'))
+
+# Requests one worker has in flight at once, used to size its pools
+WORKER_CONCURRENCY = (
+    min(GUNICORN_WORKER_CONNECTIONS, GEVENT_POOL_CONCURRENCY) if ASYNC_WORKER else GUNICORN_THREADS
+)
@@ -0,0 +1,105 @@
+from datetime import datetime, timedelta
+from pymongo.errors import DuplicateKeyError
+from utils.db_config import singleflight_locks_collection
+import threading
+import uuid
+import time
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Also coalesce across gunicorn workers through a lock document in MongoDB
+SINGLEFLIGHT_DISTRIBUTED = os.getenv('SINGLEFLIGHT_DISTRIBUTED', 'false').lower() == 'true'
+SINGLEFLIGHT_POLL_SECONDS = 0.2
+
+_registry = {}
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Lets concurrent identical calls in one process share a single execution.
+
+    The first caller for a key runs the function; callers arriving while it
+    is in flight wait for it and get the same result (or exception).
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.stats = {'calls': 0, 'executed': 0, 'deduplicated': 0}
+        _registry[name] = self
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            self.stats['calls'] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.stats['executed'] += 1
+            else:
+                self.stats['deduplicated'] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+def flight_stats():
+    """Counters of every SingleFlight in this worker, keyed by name"""
+    return {name: dict(flight.stats) for name, flight in _registry.items()}
+
+
+def acquire_worker_lock(key, ttl):
+    """Try to take the cross-worker lock for `key`; return its token or None.
+
+    A lock left behind by a crashed worker is taken over once it expires.
+    """
+    token = uuid.uuid4().hex
+    now = datetime.utcnow()
+    lock = {'owner': token, 'expires_at': now + timedelta(seconds=ttl)}
+    try:
+        singleflight_locks_collection.insert_one({'_id': key, **lock})
+        return token
+    except DuplicateKeyError:
+        taken_over = singleflight_locks_collection.find_one_and_update(
+            {'_id': key, 'expires_at': {'$lt': now}},
+            {'$set': lock}
+        )
+        return token if taken_over else None
+
+
+def release_worker_lock(key, token):
+    singleflight_locks_collection.delete_one({'_id': key, 'owner': token})
+
+
+def wait_for_worker_lock(key, timeout):
+    """Block until no live lock for `key` exists or `timeout` seconds pass"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        lock = singleflight_locks_collection.find_one({'_id': key})
+        if not lock or lock['expires_at'] < datetime.utcnow():
+            return True
+        time.sleep(SINGLEFLIGHT_POLL_SECONDS)
+    return False
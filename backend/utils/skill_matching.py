@@ -0,0 +1,297 @@
+from utils.db_config import users_collection
+from bson import ObjectId
+from collections import Counter
+from datetime import datetime, timedelta
+from operator import itemgetter
+import heapq
+import random
+import threading
+import time
+import sys
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+MATCH_LIMIT = int(os.getenv('MATCH_LIMIT', '10'))
+MAX_MATCH_LIMIT = 50
+# How often a worker picks up skill changes saved through other workers
+MATCH_SYNC_SECONDS = float(os.getenv('MATCH_SYNC_SECONDS', '5'))
+# 'reciprocal': both can teach each other; 'learn': they offer what you
+# need; 'teach': they need what you offer
+MATCH_MODES = ('reciprocal', 'learn', 'teach')
+# Users a match query counts before it samples the postings of popular
+# skills instead of walking them. Unset or 0 keeps every result exact;
+# a budget bounds the work per query, and responses it shortened say
+# `approximate`. With 1000, 21-36% of users got a different top list in
+# scripts/bench_matches.py
+MATCH_SCAN_BUDGET = int(os.getenv('MATCH_SCAN_BUDGET', '0')) or None
+
+MATCH_PROJECTION = {'username': 1, 'skills_offered': 1, 'skills_needed': 1}
+LOAD_BATCH_SIZE = 10000
+# Wait before loading again after a load that failed
+LOAD_RETRY_SECONDS = 5
+# Sync windows overlap so clock differences between workers drop no change
+SYNC_OVERLAP = timedelta(seconds=30)
+
+_NO_SKILLS = (frozenset(), frozenset())
+
+
+def normalize_skills(skills):
+    """Distinct lowercase skill names of a skills array"""
+    if not isinstance(skills, list):
+        return frozenset()
+    return frozenset(
+        sys.intern(skill.strip().lower()) for skill in skills if isinstance(skill, str) and skill.strip()
+    )
+
+
+def _add(index, key, slot):
+    postings = index.get(key)
+    if postings is None:
+        postings = index[key] = set()
+    postings.add(slot)
+
+
+def _discard(index, key, slot):
+    postings = index.get(key)
+    if postings is not None:
+        postings.discard(slot)
+        if not postings:
+            del index[key]
+
+
+def _top(postings, slot, limit, budget):
+    """Top `limit` (user, score) pairs over postings, excluding `slot`.
+
+    A user's score is the number of postings it appears in. Postings are
+    counted smallest first while their total size fits in `budget`
+    (everything when it is None), which gives exact results. Postings
+    beyond it, those of the most popular skills, are not walked: a random
+    sample of each adds candidates, and every candidate is then probed
+    against them with set intersections. Returned scores stay exact and
+    the counting stays bounded however popular a skill is, at the cost of
+    sometimes missing a user no sample picked. Returns the pairs and
+    whether any posting was sampled.
+    """
+    postings = sorted((posting for posting in postings if posting), key=len)
+    counts = Counter()
+    spent = 0
+    large = []
+    for posting in postings:
+        if budget is None or spent + len(posting) <= budget:
+            counts.update(posting)
+            spent += len(posting)
+        else:
+            large.append(posting)
+
+    if large:
+        share = max((budget - spent) // len(large), limit + 1)
+        candidates = set(counts)
+        for posting in large:
+            # A prefix of the set would be its lowest slots, the oldest users
+            candidates.update(random.sample(list(posting), min(share, len(posting))))
+        for posting in large:
+            counts.update(posting.intersection(candidates))
+    counts.pop(slot, None)
+    return heapq.nlargest(limit, counts.items(), key=itemgetter(1)), bool(large)
+
+
+class MatcherLoading(Exception):
+    """Raised by SkillMatcher.matches until this worker has loaded its indexes"""
+
+
+class SkillMatcher:
+    """Inverted skill indexes for finding people to swap skills with.
+
+    `offered` and `needed` map a skill to the users offering and needing
+    it. `pairs` maps (skill offered, skill needed) to the users with both:
+    the people who can teach a user something and want to learn something
+    that user offers are exactly the ones under (one of the user's needs,
+    one of their offers), so reciprocal matches come from a few small
+    postings instead of every offerer of a popular skill. A reciprocal
+    match scores the number of such skill pairs it shares with the user.
+
+    Users are kept as small integer slots. A background thread loads the
+    indexes from the users collection after the first match request and
+    then picks up changes made through other workers by their
+    `skills_updated_at` every MATCH_SYNC_SECONDS; skill changes made
+    through this worker are applied as they are saved. The thread reads
+    MongoDB without holding the lock, so match requests only wait for the
+    in-memory updates, and requests before the first load completes get
+    MatcherLoading.
+
+    Every worker process keeps its own copy of the indexes:
+    scripts/bench_matches.py measured about 230 MiB of RSS at 100k users
+    and 1.9 GB at 1M, so a host needs that much per gunicorn worker.
+    """
+
+    def __init__(self, collection=None, sync_seconds=MATCH_SYNC_SECONDS, scan_budget=MATCH_SCAN_BUDGET):
+        self.collection = collection if collection is not None else users_collection
+        self.sync_seconds = sync_seconds
+        self.scan_budget = scan_budget
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._synced_at = None
+        self._worker_pid = None
+        self._reset()
+
+    def _reset(self):
+        self._slots = {}
+        self._ids = []
+        self._usernames = []
+        self._skills = []
+        self.offered = {}
+        self.needed = {}
+        self.pairs = {}
+
+    def _apply(self, user):
+        user_id = str(user['_id'])
+        slot = self._slots.get(user_id)
+        if slot is None:
+            slot = self._slots[user_id] = len(self._ids)
+            self._ids.append(user_id)
+            self._usernames.append(None)
+            self._skills.append(_NO_SKILLS)
+        self._usernames[slot] = user.get('username')
+
+        old_offered, old_needed = self._skills[slot]
+        offered = normalize_skills(user.get('skills_offered')) if 'skills_offered' in user else old_offered
+        needed = normalize_skills(user.get('skills_needed')) if 'skills_needed' in user else old_needed
+        if (offered, needed) == (old_offered, old_needed):
+            return
+
+        for skill in old_offered - offered:
+            _discard(self.offered, skill, slot)
+        for skill in offered - old_offered:
+            _add(self.offered, skill, slot)
+        for skill in old_needed - needed:
+            _discard(self.needed, skill, slot)
+        for skill in needed - old_needed:
+            _add(self.needed, skill, slot)
+        old_pairs = {(o, n) for o in old_offered for n in old_needed}
+        new_pairs = {(o, n) for o in offered for n in needed}
+        for pair in old_pairs - new_pairs:
+            _discard(self.pairs, pair, slot)
+        for pair in new_pairs - old_pairs:
+            _add(self.pairs, pair, slot)
+        self._skills[slot] = (offered, needed)
+
+    def apply(self, user):
+        """Fold a saved user's skills into the indexes.
+
+        Fields missing from `user` keep their indexed value. Before the
+        indexes are loaded this is a no-op; the load reads the saved user.
+        """
+        with self._lock:
+            if self._loaded:
+                self._apply(user)
+
+    def _adopt(self, other):
+        # Under the lock: take over indexes built without holding it
+        self._slots, self._ids = other._slots, other._ids
+        self._usernames, self._skills = other._usernames, other._skills
+        self.offered, self.needed, self.pairs = other.offered, other.needed, other.pairs
+
+    def rebuild(self, users):
+        """Replace the indexes with `users` (documents with MATCH_PROJECTION fields)"""
+        fresh = SkillMatcher(self.collection, sync_seconds=None)
+        for user in users:
+            fresh._apply(user)
+        with self._lock:
+            self._adopt(fresh)
+            self._loaded = True
+            self._synced_at = datetime.utcnow()
+
+    def _sync(self):
+        # The start time is taken before reading, so changes saved during
+        # the read are picked up again next time. That also repairs a user
+        # this worker saved while the read still returned the old document
+        started = datetime.utcnow()
+        if not self._loaded:
+            users = self.collection.find({}, MATCH_PROJECTION).batch_size(LOAD_BATCH_SIZE)
+            self.rebuild(users)
+            logger.info(f"Skill matcher loaded {len(self._ids)} users")
+        else:
+            changed = list(self.collection.find(
+                {'skills_updated_at': {'$gte': self._synced_at - SYNC_OVERLAP}}, MATCH_PROJECTION
+            ))
+            with self._lock:
+                for user in changed:
+                    self._apply(user)
+        self._synced_at = started
+
+    def _run(self):
+        while True:
+            try:
+                self._sync()
+            except Exception as e:
+                logger.error(f"Skill matcher sync failed, will retry: {str(e)}")
+            if self._loaded and self.sync_seconds is None:
+                return
+            time.sleep(self.sync_seconds if self._loaded else LOAD_RETRY_SECONDS)
+
+    def _ensure_worker(self):
+        # Threads do not survive a fork, so each gunicorn worker starts its own
+        if self._worker_pid != os.getpid():
+            with self._lock:
+                if self._worker_pid != os.getpid():
+                    self._worker_pid = os.getpid()
+                    threading.Thread(target=self._run, name='skill-matcher', daemon=True).start()
+
+    def matches(self, user_id, mode='reciprocal', limit=MATCH_LIMIT):
+        """Top `limit` matches for a user, best first, and whether they are approximate.
+
+        Returns None for an unknown user. Results are approximate only
+        when the scan budget made the query sample a popular skill. Raises
+        MatcherLoading while the first load is still running.
+        """
+        if not self._loaded or self.sync_seconds is not None:
+            self._ensure_worker()
+        with self._lock:
+            if not self._loaded:
+                raise MatcherLoading()
+            found = self._matches(str(user_id), mode, limit)
+        if found is None and self.collection.find_one({'_id': ObjectId(user_id)}, {'_id': 1}):
+            # Saved but not indexed here yet, e.g. signed up through another worker
+            return [], False
+        return found
+
+    def _matches(self, user_id, mode, limit):
+        slot = self._slots.get(user_id)
+        if slot is None:
+            return None
+        offered, needed = self._skills[slot]
+
+        if mode == 'reciprocal':
+            postings = [self.pairs.get((want, give), ()) for want in needed for give in offered]
+        elif mode == 'learn':
+            postings = [self.offered.get(want, ()) for want in needed]
+        else:
+            postings = [self.needed.get(give, ()) for give in offered]
+
+        top, approximate = _top(postings, slot, limit, self.scan_budget)
+
+        results = []
+        for match, match_score in top:
+            match_offered, match_needed = self._skills[match]
+            results.append({
+                '_id': self._ids[match],
+                'username': self._usernames[match],
+                'score': match_score,
+                'teaches_you': sorted(match_offered & needed),
+                'learns_from_you': sorted(match_needed & offered)
+            })
+        return results, approximate
+
+    def stats(self):
+        with self._lock:
+            return {
+                'users': len(self._ids),
+                'skills_offered': len(self.offered),
+                'skills_needed': len(self.needed),
+                'skill_pairs': len(self.pairs)
+            }
+
+
+skill_matcher = SkillMatcher()
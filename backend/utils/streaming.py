@@ -0,0 +1,66 @@
+from flask import Response
+from bson import ObjectId
+from datetime import date, datetime
+from werkzeug.http import http_date
+import json
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+STREAM_BATCH_SIZE = 500
+
+
+def _default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (date, datetime)):
+        # Same format jsonify uses for dates
+        return http_date(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def to_json(document):
+    """Compact JSON for a Mongo document, ObjectIds and dates included"""
+    return json.dumps(document, default=_default, separators=(',', ':'))
+
+
+def stream_format(request):
+    """Return 'ndjson', 'json' or None for a buffered response.
+
+    NDJSON is chosen through the Accept header, a streamed JSON array
+    through `?stream=true`.
+    """
+    if NDJSON_MIMETYPE in request.headers.get('Accept', ''):
+        return 'ndjson'
+    if request.args.get('stream', 'false').lower() == 'true':
+        return 'json'
+    return None
+
+
+def _generate(cursor, fmt):
+    if hasattr(cursor, 'batch_size'):
+        # Plain iterables (archived chat history) have no server batches
+        cursor = cursor.batch_size(STREAM_BATCH_SIZE)
+    chunk = []
+    first = True
+    if fmt == 'json':
+        yield '['
+    for document in cursor:
+        encoded = to_json(document)
+        if fmt == 'ndjson':
+            chunk.append(encoded + '\n')
+        else:
+            chunk.append(encoded if first else ',' + encoded)
+            first = False
+        # One write per server batch keeps memory flat without tiny writes
+        if len(chunk) >= STREAM_BATCH_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+    if fmt == 'json':
+        yield ']'
+
+
+def stream_cursor(cursor, fmt):
+    """Stream a PyMongo cursor (or any iterable of documents) as a JSON array or NDJSON"""
+    mimetype = NDJSON_MIMETYPE if fmt == 'ndjson' else 'application/json'
+    return Response(_generate(cursor, fmt), mimetype=mimetype)
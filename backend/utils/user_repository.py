@@ -0,0 +1,91 @@
+from utils.db_config import users_collection
+from pymongo import ReturnDocument
+from bson import ObjectId
+from datetime import datetime
+
+# What the API returns for a user; the password hash never leaves the
+# database, nor do the karma ledger's bookkeeping ids
+USER_PROJECTION = {'password': 0, 'karma_flushes': 0}
+SKILL_FIELDS = ('skills_offered', 'skills_needed')
+
+
+def _stamp_skills(fields):
+    # Lets every worker's skill matcher pick up the change
+    if any(field in fields for field in SKILL_FIELDS):
+        return {**fields, 'skills_updated_at': datetime.utcnow()}
+    return fields
+
+
+class UserRepository:
+    """User reads and writes that each cost a single database round trip.
+
+    Updates use `find_one_and_update` so the new document comes back with
+    the write, and creates either keep the inserted document or upsert
+    instead of reading it back.
+    """
+
+    def __init__(self, collection=None):
+        self.collection = collection if collection is not None else users_collection
+
+    def find_by_id(self, user_id, projection=USER_PROJECTION):
+        return self.collection.find_one({'_id': ObjectId(user_id)}, projection)
+
+    def find_by_email(self, email, projection=None):
+        return self.collection.find_one({'email': email}, projection)
+
+    def _update(self, query, update, projection=USER_PROJECTION, upsert=False):
+        return self.collection.find_one_and_update(
+            query,
+            update,
+            projection=projection,
+            upsert=upsert,
+            return_document=ReturnDocument.AFTER
+        )
+
+    def update(self, user_id, fields, projection=USER_PROJECTION):
+        """$set `fields` and return the updated user, or None if it does not exist"""
+        return self._update({'_id': ObjectId(user_id)}, {'$set': _stamp_skills(fields)}, projection)
+
+    def increment(self, user_id, deltas, projection=USER_PROJECTION):
+        """$inc `deltas` and return the updated user, or None if it does not exist"""
+        return self._update({'_id': ObjectId(user_id)}, {'$inc': deltas}, projection)
+
+    def create(self, document):
+        """Insert a new user and return it with its `_id`"""
+        document = _stamp_skills(dict(document))
+        document['_id'] = self.collection.insert_one(document).inserted_id
+        return document
+
+    def create_unless_exists(self, document):
+        """Insert a user unless one with the same email exists; returns it, or None.
+
+        A unique index on `email` makes this safe against two concurrent
+        registrations.
+        """
+        document = _stamp_skills(dict(document))
+        document.pop('_id', None)
+        result = self.collection.update_one(
+            {'email': document['email']},
+            {'$setOnInsert': document},
+            upsert=True
+        )
+        if result.upserted_id is None:
+            return None
+        document['_id'] = result.upserted_id
+        return document
+
+    def upsert_by_email(self, email, on_insert, fields=None, projection=USER_PROJECTION):
+        """Find the user with `email`, creating it from `on_insert` if missing.
+
+        `fields` are $set whether or not the user existed and win over the
+        same keys in `on_insert`. Returns the user as stored after the write.
+        """
+        # A new user, even one without skills yet, is news to every worker's skill matcher
+        on_insert = {**on_insert, 'skills_updated_at': datetime.utcnow()}
+        update = {'$setOnInsert': {k: v for k, v in on_insert.items() if k not in (fields or {})}}
+        if fields:
+            update['$set'] = fields
+        return self._update({'email': email}, update, projection, upsert=True)
+
+
+user_repository = UserRepository()
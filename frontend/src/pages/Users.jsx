@@ -3,21 +3,42 @@ import axios from "axios";
 
 const Users = () => {
   const [users, setUsers] = useState([]);
+  // Cursor of the next page; null once the last page is loaded
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loading, setLoading] = useState(false);
+
+  const loadUsers = (after) => {
+    setLoading(true);
+    axios.get("http://localhost:5000/api/users", { params: after ? { after } : {} })
+      .then(response => {
+        setUsers(previous => after ? [...previous, ...response.data.users] : response.data.users);
+        setNextCursor(response.data.next_cursor);
+      })
+      .catch(error => console.error(error))
+      .finally(() => setLoading(false));
+  };
 
   useEffect(() => {
-    axios.get("http://localhost:5000/api/users")
-      .then(response => setUsers(response.data))
-      .catch(error => console.error(error));
+    loadUsers(null);
   }, []);
 
   return (
     <div className="p-4">
       <h1 className="text-2xl font-bold">Users</h1>
       <ul>
-        {users.map((user, index) => (
-          <li key={index}>{user.username}</li>
+        {users.map((user) => (
+          <li key={user._id}>{user.username}</li>
         ))}
       </ul>
+      {nextCursor && (
+        <button
+          className="mt-4 bg-blue-500 text-white px-4 py-2 rounded hover:bg-blue-600 disabled:opacity-50"
+          onClick={() => loadUsers(nextCursor)}
+          disabled={loading}
+        >
+          {loading ? "Loading..." : "Load more"}
+        </button>
+      )}
     </div>
   );
 };